@@ -0,0 +1,145 @@
+"""
+Benchmark: the old unread archiver (list every matching ID first, then serial batchModify calls of 100
+IDs) vs. email_archive_unread.run_archive_unread (each listed page archived while the next is listed,
+1,000 IDs per batchModify call, ARCHIVE_WORKERS calls in flight, checkpointed).
+
+Runs against a local fake Gmail HTTP server, so no credentials or network access are needed. Each
+request costs ROUND_TRIP_LATENCY seconds plus MODIFY_LATENCY_PER_ID per ID in a batchModify call. Like
+Gmail, the fake pages through the current query result by offset, so modifying messages while listing
+makes the paging skip some; the archiver's extra listing pass picks them up.
+
+Usage:
+    python bench_archive.py [message_count]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import httplib2
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+import email_checkpoint
+from email_archive_unread import run_archive_unread
+
+ROUND_TRIP_LATENCY = 0.03 # Simulated network latency per HTTP request (seconds)
+MODIFY_LATENCY_PER_ID = 0.0002 # Simulated server time per ID in a batchModify call (seconds)
+LEGACY_BATCH_SIZE = 100 # batchModify size of the old archiver
+
+
+class FakeGmailHandler(BaseHTTPRequestHandler):
+    unread = set()
+    order = []
+    labels = []
+    calls = {"list": 0, "batchModify": 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(ROUND_TRIP_LATENCY)
+        url = urlparse(self.path)
+        if url.path.endswith('/labels'):
+            return self._send({'labels': self.labels})
+        params = parse_qs(url.query)
+        offset = int(params.get('pageToken', ['0'])[0])
+        size = int(params.get('maxResults', ['100'])[0])
+        with self.lock:
+            FakeGmailHandler.calls["list"] += 1
+            matching = [msg_id for msg_id in self.order if msg_id in self.unread]
+        page = matching[offset:offset + size]
+        response = {'messages': [{'id': msg_id, 'threadId': msg_id} for msg_id in page]}
+        if offset + size < len(matching):
+            response['nextPageToken'] = str(offset + size)
+        self._send(response)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])) or b'{}')
+        if urlparse(self.path).path.endswith('/labels'):
+            time.sleep(ROUND_TRIP_LATENCY)
+            label = {'id': f'Label_{len(self.labels) + 1}', 'name': body['name']}
+            self.labels.append(label)
+            return self._send(label)
+        time.sleep(ROUND_TRIP_LATENCY + MODIFY_LATENCY_PER_ID * len(body['ids']))
+        with self.lock:
+            FakeGmailHandler.calls["batchModify"] += 1
+            FakeGmailHandler.unread.difference_update(body['ids'])
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def reset(count):
+    FakeGmailHandler.order = [f'{i:016x}' for i in range(count)]
+    FakeGmailHandler.unread = set(FakeGmailHandler.order)
+    FakeGmailHandler.labels = []
+    FakeGmailHandler.calls = {"list": 0, "batchModify": 0}
+
+
+def build_fake_service(base_url):
+    doc = json.loads(get_static_doc('gmail', 'v1'))
+    doc['rootUrl'] = base_url + '/'
+    return build_from_document(doc, http=httplib2.Http())
+
+
+def legacy_archive(service, query):
+    """The old run_archive_unread: list everything, then modify 100 IDs per call, one call at a time."""
+    ids, page_token = [], None
+    while True:
+        response = service.users().messages().list(userId='me', q=query, maxResults=500, **({'pageToken': page_token} if page_token else {})).execute()
+        ids.extend(msg['id'] for msg in response.get('messages', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+    label_id = service.users().labels().create(userId='me', body={'name': 'Old Stuff'}).execute()['id']
+    for i in range(0, len(ids), LEGACY_BATCH_SIZE):
+        service.users().messages().batchModify(userId='me', body={'ids': ids[i:i + LEGACY_BATCH_SIZE], 'removeLabelIds': ['UNREAD'], 'addLabelIds': [label_id]}).execute()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGmailHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    service = build_fake_service(f'http://127.0.0.1:{server.server_port}')
+
+    reset(count)
+    start = time.perf_counter()
+    legacy_archive(service, 'is:unread')
+    legacy_time = time.perf_counter() - start
+    legacy_calls, legacy_left = dict(FakeGmailHandler.calls), len(FakeGmailHandler.unread)
+
+    reset(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        email_checkpoint._default_store = email_checkpoint.CheckpointStore(os.path.join(tmp, "checkpoints.sqlite3"))
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            summary = run_archive_unread(service, cutoff_date="2030-01-01")
+        pipelined_time = time.perf_counter() - start
+        email_checkpoint._default_store.close()
+    server.shutdown()
+
+    print(f"{count} unread emails ({ROUND_TRIP_LATENCY * 1000:.0f} ms per request, {MODIFY_LATENCY_PER_ID * 1e6:.0f} us per modified ID)")
+    print(f"legacy (list all, then serial 100-ID batches): {legacy_calls['list']:3d} list, {legacy_calls['batchModify']:4d} batchModify  "
+          f"{legacy_time:6.2f} s  ({legacy_left} left unread)")
+    print(f"pipelined (1,000-ID chunks, concurrent):       {FakeGmailHandler.calls['list']:3d} list, {FakeGmailHandler.calls['batchModify']:4d} batchModify  "
+          f"{pipelined_time:6.2f} s  ({len(FakeGmailHandler.unread)} left unread)  {legacy_time / pipelined_time:.1f}x faster")
+    print(f"summary: {summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Benchmark: serial messages().get calls vs. batched hydration (email_fetch.fetch_messages)
+vs. per-message fetching on a worker pool (email_fetch.fetch_messages_concurrently), and the same pool
+serving a whole streamed run (email_fetch.iter_fetched_messages) with one service object per worker.
+
+Runs against a local fake Gmail HTTP server, so no credentials or network access are needed.
+Each HTTP round trip to the fake server costs ROUND_TRIP_LATENCY seconds, and a fraction of
+batch sub-requests fail with 429 to exercise the retry path. A final run checks partial failures:
+a whole batch answered with 503, messages that are gone (404) and messages rate-limited on every
+attempt must come back as None in their place, with only the retryable ones retried. Exits non-zero
+if any check fails.
+
+Usage:
+    python bench_batch_fetch.py [message_count]
+"""
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+from collections import defaultdict
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import httplib2
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+import email_fetch
+from email_fetch import fetch_messages, fetch_messages_concurrently, iter_fetched_messages
+
+ROUND_TRIP_LATENCY = 0.02 # Simulated network latency per HTTP request (seconds)
+FAIL_EVERY_NTH = 17 # Every Nth sub-request fails with 429 on its first attempt
+WORKERS = 8 # Pool size for the concurrent run
+# Partial-failure run: every Nth message is gone (404, not retryable) or rate-limited on every attempt (429)
+MISSING_EVERY_NTH = 11
+ALWAYS_LIMITED_EVERY_NTH = 13
+PARTIAL_MAX_RETRIES = 2
+
+
+def fake_message(msg_id):
+    return {
+        'id': msg_id, 'threadId': f't{msg_id}', 'internalDate': '1700000000000', 'snippet': 'Hello',
+        'payload': {'mimeType': 'text/plain', 'headers': [{'name': 'Subject', 'value': f'Message {msg_id}'}], 'body': {'data': 'SGVsbG8='}}
+    }
+
+
+class FakeGmailHandler(BaseHTTPRequestHandler):
+    round_trips = 0
+    failed_once = set()
+    lock = threading.Lock()
+    partial_failures = False # Set for the partial-failure run
+    batch_503_pending = False # Answer the next batch request as a whole with 503
+    attempts = defaultdict(int) # msg_id -> requests seen during the partial-failure run
+
+    def log_message(self, *args):
+        pass
+
+    def _count(self):
+        with self.lock:
+            FakeGmailHandler.round_trips += 1
+        time.sleep(ROUND_TRIP_LATENCY)
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _partial_failure(self, msg_id):
+        """(status, error JSON) this message fails with in the partial-failure run, or None."""
+        with self.lock:
+            FakeGmailHandler.attempts[msg_id] += 1
+        if int(msg_id, 16) % MISSING_EVERY_NTH == 0:
+            return 404, '{"error": {"code": 404, "message": "Requested entity was not found."}}'
+        if int(msg_id, 16) % ALWAYS_LIMITED_EVERY_NTH == 0:
+            return 429, '{"error": {"code": 429, "message": "Rate Limit Exceeded"}}'
+        return None
+
+    def do_GET(self):
+        self._count()
+        msg_id = urlparse(self.path).path.rsplit('/', 1)[-1]
+        failure = self._partial_failure(msg_id) if self.partial_failures else None
+        if failure:
+            return self._send(failure[0], 'application/json', failure[1].encode())
+        self._send(200, 'application/json', json.dumps(fake_message(msg_id)).encode())
+
+    def do_POST(self):
+        self._count()
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        envelope = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        requests = []
+        for part in envelope.iter_parts():
+            request_line = part.get_payload(decode=True).decode().split('\r\n', 1)[0].split('\n', 1)[0]
+            requests.append((part['Content-ID'].strip('<>'), urlparse(request_line.split(' ')[1]).path.rsplit('/', 1)[-1]))
+        with self.lock:
+            fail_batch, FakeGmailHandler.batch_503_pending = self.batch_503_pending, False
+            if fail_batch: # Counts as an attempt for every message of the batch
+                for _, msg_id in requests:
+                    FakeGmailHandler.attempts[msg_id] += 1
+        if fail_batch:
+            return self._send(503, 'application/json', b'{"error": {"code": 503, "message": "Backend Error"}}')
+        boundary = 'fake_batch_boundary'
+        out = []
+        for content_id, msg_id in requests:
+            failure = self._partial_failure(msg_id) if self.partial_failures else None
+            with self.lock:
+                should_fail = not self.partial_failures and int(msg_id, 16) % FAIL_EVERY_NTH == 0 and msg_id not in self.failed_once
+                if should_fail:
+                    self.failed_once.add(msg_id)
+            if should_fail:
+                inner = 'HTTP/1.1 429 Too Many Requests\r\nContent-Type: application/json\r\n\r\n{"error": {"code": 429, "message": "Rate Limit Exceeded"}}'
+            elif failure:
+                reason = 'Not Found' if failure[0] == 404 else 'Too Many Requests'
+                inner = f"HTTP/1.1 {failure[0]} {reason}\r\nContent-Type: application/json\r\n\r\n{failure[1]}"
+            else:
+                inner = f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n{json.dumps(fake_message(msg_id))}"
+            out.append(f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n{inner}\r\n")
+        out.append(f"--{boundary}--\r\n")
+        self._send(200, f'multipart/mixed; boundary={boundary}', ''.join(out).encode())
+
+
+def build_fake_service(base_url):
+    doc = json.loads(get_static_doc('gmail', 'v1'))
+    doc['rootUrl'] = base_url + '/'
+    return build_from_document(doc, http=httplib2.Http())
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGmailHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    service = build_fake_service(f'http://127.0.0.1:{server.server_port}')
+    ids = [f'{i:016x}' for i in range(count)]
+
+    FakeGmailHandler.round_trips = 0
+    start = time.perf_counter()
+    serial = [service.users().messages().get(userId='me', id=i, format='full').execute() for i in ids]
+    serial_time = time.perf_counter() - start
+    serial_trips = FakeGmailHandler.round_trips
+
+    FakeGmailHandler.round_trips = 0
+    start = time.perf_counter()
+    batched = fetch_messages(service, ids, format='full')
+    batched_time = time.perf_counter() - start
+    batched_trips = FakeGmailHandler.round_trips
+
+    FakeGmailHandler.round_trips = 0
+    start = time.perf_counter()
+    concurrent = fetch_messages_concurrently(service, ids, format='full', workers=WORKERS)
+    concurrent_time = time.perf_counter() - start
+    concurrent_trips = FakeGmailHandler.round_trips
+
+    clones = []
+    clone = email_fetch.clone_gmail_service
+    email_fetch.clone_gmail_service = lambda service: clones.append(1) or clone(service)
+    FakeGmailHandler.round_trips = 0
+    start = time.perf_counter()
+    streamed = list(iter_fetched_messages(service, iter(ids), format='full', workers=WORKERS))
+    streamed_time = time.perf_counter() - start
+    streamed_trips = FakeGmailHandler.round_trips
+    email_fetch.clone_gmail_service = clone
+
+    partial = partial_failure_run(service, ids)
+    server.shutdown()
+
+    print(f"Messages fetched: {count}")
+    print(f"Serial:  {serial_trips:5d} round trips, {serial_time:7.2f}s")
+    print(f"Batched: {batched_trips:5d} round trips, {batched_time:7.2f}s (includes retries of {len(FakeGmailHandler.failed_once)} rate-limited sub-requests)")
+    print(f"Pool({WORKERS}): {concurrent_trips:5d} round trips, {concurrent_time:7.2f}s")
+    print(f"Streamed pool({WORKERS}): {streamed_trips:5d} round trips, {streamed_time:7.2f}s, {len(clones)} service objects")
+    print(f"Round trip reduction: {serial_trips / max(batched_trips, 1):.1f}x")
+    results = [
+        check("serial results in order", [m['id'] for m in serial] == ids),
+        check("batched results in order, rate-limited sub-requests retried", [m and m['id'] for m in batched] == ids),
+        check("concurrent results in order", [m and m['id'] for m in concurrent] == ids),
+        check("streamed results in order", [m['id'] for m in streamed] == ids),
+        check(f"streamed run builds at most {WORKERS} service objects ({len(clones)})", len(clones) <= WORKERS),
+    ] + [check(description, passed) for description, passed in partial]
+    sys.exit(0 if all(results) else 1)
+
+
+def check(description, passed):
+    print(f"  {'ok    ' if passed else 'FAILED'} {description}")
+    return passed
+
+
+def partial_failure_run(service, ids):
+    """
+    Fetches ids batched (the first batch request failing as a whole with 503) and on the pool while some
+    messages are gone or always rate-limited. Backoff is skipped so the retries are immediate.
+    Returns:
+        list: (description, passed) pairs.
+    """
+    missing = {i for i in ids if int(i, 16) % MISSING_EVERY_NTH == 0}
+    limited = {i for i in ids if int(i, 16) % ALWAYS_LIMITED_EVERY_NTH == 0} - missing
+    expected = [None if i in missing | limited else i for i in ids]
+    backoff = email_fetch.backoff_delay
+    email_fetch.backoff_delay = lambda attempt, base_delay=0: 0
+    FakeGmailHandler.partial_failures = True
+    try:
+        results = []
+        first_batch = set(ids[:email_fetch.BATCH_SIZE]) # Also sent once in the 503 batch request
+        for label, fetch in (("batched", lambda: fetch_messages(service, ids, format='full', max_retries=PARTIAL_MAX_RETRIES)),
+                             ("pool", lambda: fetch_messages_concurrently(service, ids, format='full', workers=WORKERS,
+                                                                           max_retries=PARTIAL_MAX_RETRIES))):
+            FakeGmailHandler.attempts = defaultdict(int)
+            FakeGmailHandler.batch_503_pending = label == "batched"
+            with contextlib.redirect_stdout(open(os.devnull, "w")): # Per-message error lines
+                fetched = fetch()
+            attempts = FakeGmailHandler.attempts
+            extra = (lambda i: i in first_batch) if label == "batched" else (lambda i: 0)
+            results += [
+                (f"{label}: failed messages are None in their place, the others fetched", [m and m['id'] for m in fetched] == expected),
+                (f"{label}: gone messages (404) not retried", all(attempts[i] == 1 + extra(i) for i in missing)),
+                (f"{label}: always rate-limited messages given up after {PARTIAL_MAX_RETRIES} retries",
+                 all(attempts[i] == PARTIAL_MAX_RETRIES + 1 for i in limited)),
+            ]
+        return results
+    finally:
+        FakeGmailHandler.partial_failures = False
+        email_fetch.backoff_delay = backoff
+
+
+if __name__ == "__main__":
+    main()
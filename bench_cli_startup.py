@@ -0,0 +1,65 @@
+"""
+Benchmark: CLI startup time per subcommand, with import-time profiling.
+
+Each scenario runs in a fresh interpreter under `python -X importtime`: it imports what the CLI
+imports for that subcommand and builds a Gmail service from the bundled (static) discovery document,
+which is as far as a run gets before its first API call. The "eager" scenario imports every tool
+module up front, as cli.py used to. Reports the wall time of each scenario and where its import time
+goes, summed per top-level package. No credentials or network access are needed.
+
+Usage:
+    python bench_cli_startup.py [top_packages]
+"""
+import os
+import sys
+import time
+import subprocess
+from collections import defaultdict
+
+ROUNDS = 3 # Best of this many runs is reported
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BUILD_SERVICE = (
+    "import httplib2; from googleapiclient.discovery import build; "
+    "build('gmail', 'v1', http=httplib2.Http(), static_discovery=True, cache_discovery=False)"
+)
+SCENARIOS = {
+    "--help": "import cli; cli.build_parser()",
+    "archive": f"import cli; cli.build_parser(); import email_archive_unread; {BUILD_SERVICE}",
+    "filters": f"import cli; cli.build_parser(); import email_manage_filters; {BUILD_SERVICE}",
+    "triage": f"import cli; cli.build_parser(); import openai, email_triage; {BUILD_SERVICE}",
+    "eager (all tools)": (
+        "import cli, openai, email_triage, email_categorize_opportunities, email_draft_reply, email_plan_cleanup, "
+        f"email_execute_cleanup, email_archive_unread, email_general_categorizer, email_manage_filters; {BUILD_SERVICE}"
+    ),
+}
+
+
+def run_scenario(code):
+    """Runs code in a fresh interpreter. Returns (wall seconds, {top-level package: self import seconds})."""
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=SCRIPT_DIR,
+                               capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - start
+    per_package = defaultdict(float)
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        per_package[name.strip().split(".")[0]] += int(self_us) / 1e6
+    return elapsed, per_package
+
+
+def main():
+    top = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for name, code in SCENARIOS.items():
+        runs = [run_scenario(code) for _ in range(ROUNDS)]
+        elapsed, per_package = min(runs, key=lambda run: run[0])
+        imports = sum(per_package.values())
+        print(f"{name:<18} {elapsed * 1000:7.0f} ms wall, {imports * 1000:6.0f} ms importing")
+        for package, seconds in sorted(per_package.items(), key=lambda item: item[1], reverse=True)[:top]:
+            print(f"{'':<20}{package:<28} {seconds * 1000:6.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
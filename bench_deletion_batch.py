@@ -0,0 +1,192 @@
+"""
+End-to-end check of the OpenAI Batch API mode of cleanup planning: submit_deletion_batch, then
+resume_deletion_batch until the batch is collected (the path of running cleanup planning again later),
+merging the results into deletion_candidates.json. A second submit of the same emails shows the LLM cache
+covering every email except the failed one, which is the only request sent again.
+
+Runs against a local fake OpenAI Files/Batches server, reached through the client's base_url, so no API key
+or network access is needed. A batch moves one status per retrieve (validating, in_progress, finalizing,
+completed). Every FAIL_EVERY_NTH request lands in the error file with a 500, like a failed batch line.
+All files are written to a temporary directory.
+
+Usage:
+    python bench_deletion_batch.py [email_count]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import contextlib
+from datetime import datetime, timedelta, timezone
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+
+import email_llm_cache
+import email_plan_cleanup
+from email_llm_batch import BATCH_ENDPOINT
+from email_plan_cleanup import EmailDetails, submit_deletion_batch, resume_deletion_batch
+
+FAIL_EVERY_NTH = 7 # Every Nth request of a batch fails with a 500 in the error file
+STATUS_STEPS = ["validating", "in_progress", "finalizing", "completed"] # One step per batches.retrieve
+SUGGESTIONS = ["strong_candidate", "possible_candidate", "keep"]
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    files = {} # file_id -> bytes
+    batches = {} # batch_id -> batch object
+    calls = {"files.create": 0, "batches.create": 0, "batches.retrieve": 0, "files.content": 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload, content_type='application/json', status=200):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _add_file(self, data, purpose, filename):
+        file_id = f"file-{len(self.files) + 1}"
+        self.files[file_id] = data
+        return {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with self.lock:
+            if self.path == '/v1/files':
+                FakeOpenAIHandler.calls["files.create"] += 1
+                form = BytesParser(policy=HTTP).parsebytes(b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+                fields = {part.get_param('name', header='content-disposition'): part for part in form.iter_parts()}
+                return self._send(self._add_file(fields['file'].get_payload(decode=True), fields['purpose'].get_content().strip(),
+                                                 fields['file'].get_filename()))
+            if self.path == '/v1/batches':
+                FakeOpenAIHandler.calls["batches.create"] += 1
+                request = json.loads(body)
+                if request['input_file_id'] not in self.files or request['endpoint'] != BATCH_ENDPOINT:
+                    return self._send({"error": {"message": "bad batch request"}}, status=400)
+                batch_id = f"batch_{len(self.batches) + 1}"
+                self.batches[batch_id] = {
+                    "id": batch_id, "object": "batch", "endpoint": request['endpoint'], "input_file_id": request['input_file_id'],
+                    "completion_window": request['completion_window'], "status": STATUS_STEPS[0], "created_at": int(time.time()),
+                    "metadata": request.get('metadata'), "output_file_id": None, "error_file_id": None, "request_counts": None
+                }
+                return self._send(self.batches[batch_id])
+        self._send({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+    def do_GET(self):
+        with self.lock:
+            if self.path.startswith('/v1/batches/'):
+                FakeOpenAIHandler.calls["batches.retrieve"] += 1
+                batch = self.batches[self.path.rsplit('/', 1)[1]]
+                if batch["status"] != STATUS_STEPS[-1]:
+                    batch["status"] = STATUS_STEPS[STATUS_STEPS.index(batch["status"]) + 1]
+                    if batch["status"] == STATUS_STEPS[-1]:
+                        self._complete(batch)
+                return self._send(batch)
+            if self.path.startswith('/v1/files/') and self.path.endswith('/content'):
+                FakeOpenAIHandler.calls["files.content"] += 1
+                return self._send(self.files[self.path.split('/')[3]], content_type='application/octet-stream')
+        self._send({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+    def _complete(self, batch):
+        """Answers each request of the input file, failing every FAIL_EVERY_NTH one."""
+        output, errors = [], []
+        for n, line in enumerate(self.files[batch["input_file_id"]].decode().splitlines(), start=1):
+            request = json.loads(line)
+            assert request["method"] == "POST" and request["url"] == BATCH_ENDPOINT and request["body"]["messages"]
+            record = {"id": f"batch_req_{n}", "custom_id": request["custom_id"], "error": None}
+            if n % FAIL_EVERY_NTH == 0:
+                record["response"] = {"status_code": 500, "body": {"error": {"message": "simulated server error"}}}
+                errors.append(record)
+                continue
+            content = json.dumps({"suggestion": SUGGESTIONS[n % len(SUGGESTIONS)], "reason_category": "ai_newsletter",
+                                  "reason_detail": "Fake batch result.", "ai_confidence": 0.9})
+            record["response"] = {"status_code": 200, "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}}
+            output.append(record)
+        to_jsonl = lambda records: "".join(json.dumps(record) + "\n" for record in records).encode()
+        batch["output_file_id"] = self._add_file(to_jsonl(output), "batch_output", "output.jsonl")["id"]
+        batch["error_file_id"] = self._add_file(to_jsonl(errors), "batch_output", "errors.jsonl")["id"] if errors else None
+        batch["request_counts"] = {"total": len(output) + len(errors), "completed": len(output), "failed": len(errors)}
+
+
+def make_emails(count):
+    now = datetime.now(timezone.utc)
+    return [EmailDetails(
+        id=f"{i:016x}", thread_id=f"{i:016x}", subject=f"Project update {i}", sender=f"Person {i} <person{i}@example.org>",
+        received_date=now - timedelta(days=40 + i), snippet=f"Notes from week {i}."
+    ) for i in range(count)]
+
+
+def use_temp_files(tmp):
+    """Points every file the batch mode writes at tmp."""
+    for name in ("DELETION_BATCH_INPUT_FILE", "DELETION_BATCH_STATE_FILE", "DELETION_PLAN_REPORT_FILE",
+                 "DELETION_CANDIDATES_JSON_FILE", "DELETION_JOURNAL_FILE"):
+        setattr(email_plan_cleanup, name, os.path.join(tmp, os.path.basename(getattr(email_plan_cleanup, name))))
+    email_llm_cache._default_cache = email_llm_cache.LLMResultCache(os.path.join(tmp, "llm_cache.sqlite3"))
+
+
+def check(description, passed):
+    print(f"  {'ok    ' if passed else 'FAILED'} {description}")
+    return passed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = OpenAI(api_key="fake", base_url=f"http://127.0.0.1:{server.server_port}/v1", max_retries=0)
+    emails = make_emails(count)
+    expected_failed = {email.id for n, email in enumerate(emails, start=1) if n % FAIL_EVERY_NTH == 0}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        use_temp_files(tmp)
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            state = submit_deletion_batch(client, emails)
+            collect_runs, summary = 0, None
+            while summary is None: # Each call is one later cleanup planning run collecting the pending batch
+                collect_runs += 1
+                summary = resume_deletion_batch(client, wait=False)
+        with open(email_plan_cleanup.DELETION_CANDIDATES_JSON_FILE, encoding="utf-8") as f:
+            plan = json.load(f)
+        with open(email_plan_cleanup.DELETION_JOURNAL_FILE, encoding="utf-8") as f:
+            journal = [json.loads(line) for line in f]
+        failed = {entry["email_id"] for entry in journal if entry["reason_detail"].startswith("AI analysis failed")}
+        state_cleared = not os.path.exists(email_plan_cleanup.DELETION_BATCH_STATE_FILE)
+
+        # Submitting the same emails again: the cache answers every email that had a result
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            rerun_state = submit_deletion_batch(client, emails)
+        with open(email_plan_cleanup.DELETION_BATCH_INPUT_FILE, encoding="utf-8") as f:
+            resubmitted = {json.loads(line)["custom_id"] for line in f}
+        email_llm_cache._default_cache.close()
+    server.shutdown()
+
+    print(f"{count} emails, every {FAIL_EVERY_NTH}th batch request failing")
+    print(f"first batch {state['batch_id']}: collected on run {collect_runs} ({summary['batch_status']}), "
+          f"{summary['strong_candidates']} strong / {summary['possible_candidates']} possible candidates, {len(failed)} failed")
+    print(f"calls: {FakeOpenAIHandler.calls}")
+    results = [
+        check("batch collected only after reaching 'completed'", collect_runs == len(STATUS_STEPS) - 1 and summary["batch_status"] == "completed"),
+        check("every email has exactly one suggestion", sorted(entry["email_id"] for entry in journal) == sorted(email.id for email in emails)),
+        check("failed batch lines are marked keep / ai_unsure", failed == expected_failed and all(
+            entry["suggestion"] == "keep" and entry["reason_category"] == "ai_unsure" for entry in journal if entry["email_id"] in failed)),
+        check("deletion_candidates.json matches the fake results", len(plan["strong_candidates"]) == summary["strong_candidates"]
+              and len(plan["possible_candidates"]) == summary["possible_candidates"]
+              and not failed & {c["email_id"] for c in plan["strong_candidates"] + plan["possible_candidates"]}),
+        check("pending batch state cleared", state_cleared),
+        check(f"second submit ({rerun_state['batch_id']}) resends only the failed emails", resubmitted == expected_failed),
+    ]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
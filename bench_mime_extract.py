@@ -0,0 +1,145 @@
+"""
+Benchmark: the old per-module body extraction (top-level parts only, whole-body decode, regex tag
+stripping) vs. email_mime.extract_body, in full and with the 200-character limit the cleanup and
+categorization prompts use.
+
+Runs on synthetic Gmail payloads (no network access needed): a mix of flat text/plain messages,
+HTML-only newsletters and multipart/mixed messages with a nested multipart/alternative and an attachment.
+Then checks what extract_body returns for each kind and for edge cases (multi-byte characters split
+across decode slices, unpadded base64, text attachments, empty payloads). Exits non-zero if any check fails.
+
+Usage:
+    python bench_mime_extract.py [message_count] [body_kb]
+"""
+import re
+import sys
+import time
+import base64
+
+from email_mime import extract_body, DECODE_MIN_CHUNK_CHARS
+
+PREVIEW_CHARS = 200 # Body characters used by the cleanup and categorization prompts
+ROUNDS = 3 # Best of this many timed rounds is reported
+
+
+def encode(text):
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode().rstrip('=')
+
+
+def make_texts(body_kb):
+    """(plain, html) bodies of about body_kb KB each."""
+    paragraph = "Thanks for your order. Your package ships on Tuesday — tracking details follow. " * 4
+    plain = (paragraph + "\n\n") * max(1, body_kb * 1024 // (len(paragraph) + 2))
+    html = ("<html><head><style>p {color: red}</style></head><body>"
+            + "".join(f"<p>{paragraph} &amp; more</p>" for _ in range(max(1, body_kb * 1024 // (len(paragraph) + 20))))
+            + "</body></html>")
+    return plain, html
+
+
+def make_payloads(count, body_kb):
+    plain, html = make_texts(body_kb)
+    payloads = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            payloads.append({'mimeType': 'text/plain', 'body': {'data': encode(plain)}})
+        elif kind == 1:
+            payloads.append({'mimeType': 'text/html', 'body': {'data': encode(html)}})
+        else:
+            payloads.append({'mimeType': 'multipart/mixed', 'parts': [
+                {'mimeType': 'multipart/alternative', 'parts': [
+                    {'mimeType': 'text/plain', 'body': {'data': encode(plain)}},
+                    {'mimeType': 'text/html', 'body': {'data': encode(html)}},
+                ]},
+                {'mimeType': 'application/pdf', 'filename': 'invoice.pdf', 'body': {'attachmentId': 'a1'}},
+            ]})
+    return payloads
+
+
+def legacy_extract(payload):
+    """The extraction previously copied into email_triage and email_categorize_opportunities."""
+    body_content = ""
+    if 'parts' in payload:
+        for part in payload['parts']:
+            if part['mimeType'] == 'text/plain':
+                body_data = part['body'].get('data')
+                if body_data:
+                    body_content += base64.urlsafe_b64decode(body_data + '==').decode('utf-8', errors='replace')
+                break
+        if not body_content:
+            for part in payload['parts']:
+                if part['mimeType'] == 'text/html':
+                    body_data = part['body'].get('data')
+                    if body_data:
+                        html_content = base64.urlsafe_b64decode(body_data + '==').decode('utf-8', errors='replace')
+                        body_content += re.sub('<[^<]+?>', '', html_content)
+                    break
+    elif 'body' in payload and payload['body'].get('data'):
+        body_content = base64.urlsafe_b64decode(payload['body']['data'] + '==').decode('utf-8', errors='replace')
+        if payload.get('mimeType') == 'text/html':
+            body_content = re.sub('<[^<]+?>', '', body_content)
+    return body_content.strip()
+
+
+def best_time(func, payloads):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        results = [func(p) for p in payloads]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    body_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    payloads = make_payloads(count, body_kb)
+
+    legacy_time, legacy = best_time(legacy_extract, payloads)
+    full_time, full = best_time(extract_body, payloads)
+    preview_time, preview = best_time(lambda p: extract_body(p, PREVIEW_CHARS), payloads)
+
+    legacy_empty = sum(1 for body in legacy if not body)
+    new_empty = sum(1 for body in full if not body)
+
+    print(f"Messages: {count} ({body_kb} KB bodies)")
+    print(f"Legacy (top-level parts, full decode): {legacy_time * 1000:8.1f} ms, {legacy_empty} empty bodies")
+    print(f"extract_body (full):                   {full_time * 1000:8.1f} ms, {new_empty} empty bodies")
+    print(f"extract_body ({PREVIEW_CHARS} chars):             {preview_time * 1000:8.1f} ms")
+    print(f"Speedup for {PREVIEW_CHARS}-char previews vs legacy: {legacy_time / max(preview_time, 1e-9):.1f}x")
+
+    plain, html = make_texts(body_kb)
+    plain_text, html_text, nested_text = (extract_body(payload) for payload in make_payloads(3, body_kb))
+    accented = "Café crème — naïve résumé. " * 200 # Two-byte characters land on every decode slice boundary
+    accented_payload = {'mimeType': 'text/plain', 'body': {'data': encode(accented)}}
+    limits = [1, PREVIEW_CHARS, DECODE_MIN_CHUNK_CHARS - 1, DECODE_MIN_CHUNK_CHARS, DECODE_MIN_CHUNK_CHARS * 3 + 1, len(accented)]
+    text_attachment = {'mimeType': 'multipart/mixed', 'parts': [
+        {'mimeType': 'text/html', 'body': {'data': encode("<p>Body</p>")}},
+        {'mimeType': 'text/plain', 'filename': 'notes.txt', 'body': {'data': encode("attachment text")}},
+    ]}
+    results = [
+        check(f"{PREVIEW_CHARS}-char extraction is the prefix of the full body", all(p == f[:PREVIEW_CHARS] for p, f in zip(preview, full))),
+        check("no message comes back empty", new_empty == 0),
+        check("flat text/plain body returned whole", plain_text == plain.strip()),
+        check("nested multipart/alternative: the text/plain part is used, the attachment ignored", nested_text == plain.strip()),
+        check("HTML: tags and <style> dropped, entities decoded, one line per paragraph",
+              '<' not in html_text and 'color: red' not in html_text and '&amp;' not in html_text
+              and '& more' in html_text and html_text.count('\n') >= html.count('<p>') - 1),
+        check("multi-byte characters split across decode slices survive limited reads",
+              all(extract_body(accented_payload, limit) == accented.strip()[:limit] for limit in limits)),
+        check("unpadded base64 decodes", extract_body({'mimeType': 'text/plain', 'body': {'data': encode("ab")}}) == "ab"),
+        check("text/plain attachments are not the body", extract_body(text_attachment) == "Body"),
+        check("empty payloads give an empty body", extract_body({}) == '' and extract_body(None) == ''
+              and extract_body({'mimeType': 'text/plain', 'body': {'size': 0}}) == ''),
+    ]
+    sys.exit(0 if all(results) else 1)
+
+
+def check(description, passed):
+    print(f"  {'ok    ' if passed else 'FAILED'} {description}")
+    return passed
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Benchmark: the old per-candidate unsubscribe visits (one blocking requests.get with a new connection
+per email) vs. email_unsubscribe.HttpUnsubscriber (one request per list, pooled connections, several
+lists in parallel, RFC 8058 one-click POST where advertised, ledger of handled lists).
+
+Runs against a local stub unsubscribe server, so no network access is needed. Each request to the stub
+costs RESPONSE_LATENCY seconds. A second engine run over the same plan shows the ledger skipping every
+list already handled. Then checks the ledger: failed attempts do not count as handled, and the queue of
+unsubscribe emails (MailtoUnsubscriber, against a fake Gmail send) sends once per address, keeps emails
+queued on quota errors and never queues a list that was already unsubscribed. Exits non-zero if any
+check fails.
+
+Usage:
+    python bench_unsubscribe.py [email_count] [list_count]
+"""
+import os
+import sys
+import time
+import base64
+import socket
+import tempfile
+import threading
+import contextlib
+from email import message_from_bytes
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from googleapiclient.errors import HttpError
+
+from email_unsubscribe import (
+    HttpUnsubscriber, MailtoUnsubscriber, TokenBucket, UnsubscribeLedger, list_identity,
+    USER_AGENT, UNSUBSCRIBED, FAILED, MAILTO_MAX_ATTEMPTS
+)
+
+RESPONSE_LATENCY = 0.05 # Simulated server time per request (seconds)
+ONE_CLICK_EVERY_NTH = 2 # Every Nth list advertises List-Unsubscribe-Post: List-Unsubscribe=One-Click
+HOSTS = 3 # Lists are spread over this many host names (all served by the stub)
+
+
+class StubUnsubscribeHandler(BaseHTTPRequestHandler):
+    requests_seen = {"GET": 0, "POST": 0}
+    cookies_seen = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, method, body):
+        with self.lock:
+            StubUnsubscribeHandler.requests_seen[method] += 1
+            StubUnsubscribeHandler.cookies_seen += bool(self.headers.get('Cookie'))
+        time.sleep(RESPONSE_LATENCY)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Set-Cookie', 'session=tracking') # Must never be sent back
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._respond("GET", b"<html><body>You have been unsubscribed.</body></html>")
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode()
+        self._respond("POST", b"ok" if body == "List-Unsubscribe=One-Click" else b"bad one-click body")
+
+
+def resolves_to_loopback(host):
+    try:
+        return socket.gethostbyname(host) == "127.0.0.1"
+    except OSError:
+        return False
+
+
+def make_candidates(port, email_count, list_count):
+    # *.localhost names resolve to the loopback address on most systems, which lets per-host limits apply
+    hosts = [f"unsub{n}.localhost" for n in range(HOSTS)]
+    if not all(resolves_to_loopback(host) for host in hosts):
+        hosts = ["127.0.0.1"]
+    candidates = []
+    for i in range(email_count):
+        list_number = i % list_count
+        host = hosts[list_number % len(hosts)]
+        candidates.append({
+            "email_id": f"m{i}", "subject": f"Issue {i}", "sender": f"News <news@list{list_number}.example>",
+            "list_unsubscribe_http": f"http://{host}:{port}/u/{list_number}?token={i}",
+            "list_unsubscribe_one_click": list_number % ONE_CLICK_EVERY_NTH == 0,
+        })
+    return candidates
+
+
+def legacy_visits(candidates):
+    """The old visit_unsubscribe_link_action, once per candidate."""
+    for candidate in candidates:
+        requests.get(candidate["list_unsubscribe_http"], headers={'User-Agent': USER_AGENT}, timeout=10, allow_redirects=True)
+
+
+def reset_counts():
+    StubUnsubscribeHandler.requests_seen = {"GET": 0, "POST": 0}
+    StubUnsubscribeHandler.cookies_seen = 0
+
+
+def main():
+    email_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    list_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubUnsubscribeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    candidates = make_candidates(server.server_address[1], email_count, list_count)
+
+    reset_counts()
+    start = time.perf_counter()
+    legacy_visits(candidates)
+    legacy_time = time.perf_counter() - start
+    legacy_requests = sum(StubUnsubscribeHandler.requests_seen.values())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ledger = UnsubscribeLedger(os.path.join(tmp, "ledger.sqlite3"))
+        reset_counts()
+        start = time.perf_counter()
+        summary = HttpUnsubscriber(ledger=ledger).unsubscribe(candidates)
+        engine_time = time.perf_counter() - start
+        engine_requests = dict(StubUnsubscribeHandler.requests_seen)
+        cookies = StubUnsubscribeHandler.cookies_seen
+
+        reset_counts()
+        rerun = HttpUnsubscriber(ledger=ledger).unsubscribe(candidates)
+        rerun_requests = sum(StubUnsubscribeHandler.requests_seen.values())
+        all_handled = all(ledger.is_handled(list_identity(c)) for c in candidates)
+        ledger.close()
+        mailto = mailto_queue_checks(UnsubscribeLedger(os.path.join(tmp, "mailto_ledger.sqlite3")))
+    server.shutdown()
+
+    print(f"{email_count} candidate emails from {list_count} lists ({RESPONSE_LATENCY * 1000:.0f} ms per request)")
+    print(f"legacy (per email, serial):  {legacy_requests:5d} requests  {legacy_time:6.2f} s")
+    print(f"engine (per list, parallel): {sum(engine_requests.values()):5d} requests  {engine_time:6.2f} s  "
+          f"({engine_requests['POST']} one-click POST, {engine_requests['GET']} GET, {cookies} with cookies)  "
+          f"{legacy_time / engine_time:.1f}x faster")
+    print(f"engine rerun (ledger):       {rerun_requests:5d} requests  ({rerun['skipped']} lists skipped)")
+    print(f"outcomes: {summary}")
+    lists = min(list_count, email_count)
+    one_click_lists = sum(1 for n in range(lists) if n % ONE_CLICK_EVERY_NTH == 0)
+    results = [
+        check("one request per list", sum(engine_requests.values()) == lists and summary["lists"] == lists),
+        check("one-click POST exactly for the lists advertising it", engine_requests["POST"] == one_click_lists),
+        check("no cookies sent back", cookies == 0),
+        check("every list recorded as handled", all_handled),
+        check("rerun skips every list without a request", rerun_requests == 0 and rerun["skipped"] == lists),
+    ] + [check(description, passed) for description, passed in mailto]
+    sys.exit(0 if all(results) else 1)
+
+
+def check(description, passed):
+    print(f"  {'ok    ' if passed else 'FAILED'} {description}")
+    return passed
+
+
+class FakeSendService:
+    """Gmail service stub for messages().send: addresses in reject fail with 400, quota_errors sends fail with 429 first."""
+
+    def __init__(self, reject=(), quota_errors=0):
+        self.reject = set(reject)
+        self.quota_errors = quota_errors
+        self.sent = []
+        self._to = None
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def send(self, userId, body):
+        self._to = message_from_bytes(base64.urlsafe_b64decode(body['raw']))['to']
+        return self
+
+    def execute(self):
+        class Response:
+            def __init__(self, status):
+                self.status, self.reason = status, "fake"
+        if self.quota_errors:
+            self.quota_errors -= 1
+            raise HttpError(Response(429), b'{"error": {"code": 429, "message": "Rate Limit Exceeded"}}')
+        if self._to in self.reject:
+            raise HttpError(Response(400), b'{"error": {"code": 400, "message": "Invalid To header"}}')
+        self.sent.append(self._to)
+        return {"id": f"sent{len(self.sent)}"}
+
+
+def mailto_queue_checks(ledger):
+    """Runs the ledger and MailtoUnsubscriber checks on an empty ledger. Returns (description, passed) pairs."""
+    def candidate(n, address):
+        return {"email_id": f"e{n}", "subject": f"Issue {n}", "sender": f"News <news@{address.split('@')[1]}>",
+                "list_unsubscribe_mailto": f"{address}?subject=unsubscribe"}
+    results = []
+
+    ledger.record("failed-list", "get", "http://example.invalid/u", FAILED, "timeout")
+    results.append(("a failed attempt does not count as handled", not ledger.is_handled("failed-list")))
+    ledger.record("failed-list", "get", "http://example.invalid/u", UNSUBSCRIBED)
+    entry = ledger.get("failed-list")
+    results.append(("a later success counts, with both attempts recorded", ledger.is_handled("failed-list") and entry["attempts"] == 2))
+
+    first = ledger.claim_mailto("leave@a.example", "a", "unsubscribe", "body")
+    again = ledger.claim_mailto("leave@a.example", "a", "unsubscribe", "body")
+    results.append(("claim_mailto queues an address once", first and not again))
+
+    service = FakeSendService(reject={"bad@c.example"}, quota_errors=1)
+    unsubscriber = MailtoUnsubscriber(service, ledger=ledger, bucket=TokenBucket(1000, 1000))
+    queued = unsubscriber.enqueue([candidate(1, "leave@a.example"), candidate(2, "leave@a.example"),
+                                   candidate(3, "leave@b.example"), candidate(4, "bad@c.example")])
+    results.append(("enqueue collapses candidates to one email per new address", queued == 2 and unsubscriber.pending() == 3))
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        stopped = unsubscriber.send()
+    results.append(("a quota error stops sending and keeps every email queued",
+                    stopped["stopped"] is not None and stopped["sent"] == 0 and unsubscriber.pending() == 3))
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        outcome = unsubscriber.send()
+    results.append(("the next send() sends each queued address once and fails the rejected one",
+                    sorted(service.sent) == ["leave@a.example", "leave@b.example"] and outcome["failed"] == 1))
+    results.append(("sent lists are recorded as unsubscribed",
+                    ledger.is_handled(list_identity(candidate(3, "leave@b.example"))) and unsubscriber.sent_last_day() == 2))
+    results.append(("already unsubscribed lists are not queued again", unsubscriber.enqueue([candidate(5, "leave@b.example")]) == 0))
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        for _ in range(MAILTO_MAX_ATTEMPTS):
+            unsubscriber.send()
+    results.append((f"a rejected address is given up after {MAILTO_MAX_ATTEMPTS} attempts",
+                    unsubscriber.pending() == 0 and service.sent.count("bad@c.example") == 0))
+    ledger.close()
+    return results
+
+
+if __name__ == "__main__":
+    main()
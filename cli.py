@@ -1,23 +1,16 @@
 import os
-from openai import OpenAI
-from dotenv import load_dotenv
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
 
 # Import utilities from email_utils
-from email_utils import get_gmail_service, TermColors
-
-# Placeholder for importing refactored module functions
-from email_triage import run_triage # Import the refactored function
-from email_categorize_opportunities import run_opportunity_categorization
-from email_draft_reply import run_reply_drafting
-from email_plan_cleanup import run_cleanup_planning
-from email_execute_cleanup import run_cleanup_execution
-from email_archive_unread import run_archive_unread
-from email_general_categorizer import run_general_categorization
-from email_manage_filters import run_filter_management
-# ... other imports will go here
-
-# Load environment variables
-load_dotenv(override=True)
+from email_utils import get_gmail_service, granted_scopes, TermColors
+
+# The tool modules (and openai, pydantic, requests behind them) are imported only when a menu choice or
+# subcommand needs them, so starting the CLI does not pay for every tool. See bench_cli_startup.py.
 
 # --- Configuration for cli.py ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -34,6 +27,21 @@ CLI_SCOPES = [
     'https://www.googleapis.com/auth/gmail.labels'          # For labels & filters
 ]
 
+# Exit codes of non-interactive (subcommand) runs, keyed by the 'status' of the run summary
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2 # Also what argparse exits with on bad arguments
+EXIT_INCOMPLETE = 3 # Some emails failed; rerun with --resume
+EXIT_PENDING = 4 # A cleanup batch is still running; rerun with --collect-batch
+EXIT_INTERRUPTED = 130
+STATUS_EXIT_CODES = {"ok": EXIT_OK, "error": EXIT_ERROR, "incomplete": EXIT_INCOMPLETE, "pending": EXIT_PENDING}
+# Subcommands that do not use OpenAI (openai is not even imported for them)
+GMAIL_ONLY_COMMANDS = {"archive", "filters", "execute-cleanup"}
+# Help of the --estimate flag of the classification subcommands (see email_estimate.py)
+ESTIMATE_HELP = "Only estimate quota units, tokens, requests, cost and time from a sample; no OpenAI key needed"
+# Scope required on top of CLI_SCOPES by `execute-cleanup --permanent` (same as email_execute_cleanup.PERMANENT_DELETE_SCOPE)
+PERMANENT_DELETE_SCOPE = 'https://mail.google.com/'
+
 def display_menu():
     """Displays the main menu options."""
     print(f"\n{TermColors.BOLD}{TermColors.BLUE}--- Email Assistant CLI ---{TermColors.RESET}")
@@ -50,24 +58,38 @@ def display_menu():
     choice = input("Enter your choice: ")
     return choice
 
-def main():
-    """Main function to run the CLI assistant."""
+def init_services(need_openai=True, extra_scopes=()):
+    """
+    Initializes the Gmail service (with CLI_SCOPES plus extra_scopes) and (if need_openai) the OpenAI client.
+    Returns:
+        tuple: (gmail_service, openai_client); gmail_service is None if initialization failed.
+    """
     print(f"{TermColors.STATUS_INFO}Initializing Email Assistant...{TermColors.RESET}")
 
     # Initialize Gmail Service
-    gmail_service = get_gmail_service(TOKEN_FILE, CREDENTIALS_FILE, CLI_SCOPES)
+    gmail_service = get_gmail_service(TOKEN_FILE, CREDENTIALS_FILE, CLI_SCOPES + list(extra_scopes))
     if not gmail_service:
         print(f"{TermColors.STATUS_ERROR}Failed to initialize Gmail service. Exiting.{TermColors.RESET}")
-        return
+        return None, None
+    if not need_openai:
+        return gmail_service, None
 
     # Initialize OpenAI Client
     try:
+        from openai import OpenAI
         openai_client = OpenAI()
         # Test client (optional, but good for early check)
         # openai_client.models.list() 
         print(f"{TermColors.STATUS_SUCCESS}OpenAI client initialized.{TermColors.RESET}")
     except Exception as e:
         print(f"{TermColors.STATUS_ERROR}Failed to initialize OpenAI client: {e}{TermColors.RESET}")
+        return None, None
+    return gmail_service, openai_client
+
+def run_interactive_menu():
+    """Runs the interactive menu (cli.py without a subcommand)."""
+    gmail_service, openai_client = init_services()
+    if not gmail_service:
         return
 
     while True:
@@ -75,48 +97,60 @@ def main():
         if choice == '1':
             print(f"\n{TermColors.STATUS_INFO}Starting Email Triage...{TermColors.RESET}")
             try:
+                from email_triage import run_triage
                 run_triage(gmail_service, openai_client) # Call the imported and refactored function
             except Exception as e:
                 print(f"{TermColors.STATUS_ERROR}An error occurred during triage: {e}{TermColors.RESET}")
         elif choice == '2':
             print(f"\n{TermColors.STATUS_INFO}Starting Opportunity Categorization...{TermColors.RESET}")
             try:
+                from email_categorize_opportunities import run_opportunity_categorization
                 run_opportunity_categorization(gmail_service, openai_client)
             except Exception as e:
                 print(f"{TermColors.STATUS_ERROR}An error occurred during opportunity categorization: {e}{TermColors.RESET}")
         elif choice == '3':
             print(f"\n{TermColors.STATUS_INFO}Starting Reply Drafting...{TermColors.RESET}")
             try:
+                from email_draft_reply import run_reply_drafting
                 run_reply_drafting(gmail_service, openai_client)
             except Exception as e:
                 print(f"{TermColors.STATUS_ERROR}An error occurred during reply drafting: {e}{TermColors.RESET}")
         elif choice == '4':
             print(f"\n{TermColors.STATUS_INFO}Starting Email Cleanup Planning...{TermColors.RESET}")
             try:
+                from email_plan_cleanup import run_cleanup_planning
                 run_cleanup_planning(gmail_service, openai_client)
             except Exception as e:
                 print(f"{TermColors.STATUS_ERROR}An error occurred during cleanup planning: {e}{TermColors.RESET}")
         elif choice == '5':
             print(f"\n{TermColors.STATUS_INFO}Starting Email Cleanup Execution...{TermColors.RESET}")
             try:
+                from email_execute_cleanup import run_cleanup_execution
                 run_cleanup_execution(gmail_service) # openai_client not needed by this module
             except Exception as e:
                 print(f"{TermColors.STATUS_ERROR}An error occurred during cleanup execution: {e}{TermColors.RESET}")
         elif choice == '6':
             print(f"\n{TermColors.STATUS_INFO}Starting Unread Email Archiver...{TermColors.RESET}")
             try:
-                run_archive_unread(gmail_service) # openai_client not needed
+                from email_checkpoint import confirm_resume
+                from email_archive_unread import run_archive_unread, ARCHIVE_CHECKPOINT_JOB
+                run_archive_unread(gmail_service, resume=confirm_resume(ARCHIVE_CHECKPOINT_JOB, "archive")) # openai_client not needed
             except Exception as e:
                 print(f"{TermColors.STATUS_ERROR}An error occurred during unread email archiving: {e}{TermColors.RESET}")
         elif choice == '7':
             print(f"\n{TermColors.STATUS_INFO}Starting General Email Categorization & Labeling...{TermColors.RESET}")
             try:
-                run_general_categorization(gmail_service, openai_client)
+                from email_checkpoint import confirm_resume
+                from email_general_categorizer import run_general_categorization, CATEGORIZER_CHECKPOINT_JOB
+                resume = confirm_resume(CATEGORIZER_CHECKPOINT_JOB, "general categorization")
+                incremental = not resume and input("Only categorize emails new since the last categorization run (Gmail history sync)? (y/n) [n]: ").lower().strip() == 'y'
+                run_general_categorization(gmail_service, openai_client, incremental=incremental, resume=resume)
             except Exception as e:
                 print(f"{TermColors.STATUS_ERROR}An error occurred during general categorization: {e}{TermColors.RESET}")
         elif choice == '8':
             print(f"\n{TermColors.STATUS_INFO}Starting Gmail Filter Management...{TermColors.RESET}")
             try:
+                from email_manage_filters import run_filter_management
                 run_filter_management(gmail_service) # openai_client not needed
             except Exception as e:
                 print(f"{TermColors.STATUS_ERROR}An error occurred during filter management: {e}{TermColors.RESET}")
@@ -126,5 +160,160 @@ def main():
         else:
             print(f"{TermColors.STATUS_ERROR}Invalid choice. Please try again.{TermColors.RESET}")
 
+# --- Non-interactive subcommands ---
+def build_parser():
+    """Argument parser for non-interactive runs, e.g. `helixmail triage --hours 24 --include-read`."""
+    parser = argparse.ArgumentParser(
+        prog="helixmail",
+        description="Email assistant. Without a command, starts the interactive menu. With a command, runs it "
+                    "without prompting and prints a JSON summary on stdout (progress goes to stderr)."
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+
+    triage = subparsers.add_parser("triage", help="Identify important emails and those needing a response")
+    triage.add_argument("--hours", type=int, default=24, help="How far back to look for emails (default: 24)")
+    triage.add_argument("--include-read", action="store_true", help="Triage read emails too")
+    triage.add_argument("--max", type=int, dest="max_emails", help="Maximum emails to triage (default: MAX_EMAILS_TO_PROCESS)")
+    triage.add_argument("--incremental", action="store_true", help="Only emails new since the last incremental run")
+    triage.add_argument("--resume", action="store_true", help="Resume the interrupted triage run")
+    triage.add_argument("--estimate", action="store_true", help=ESTIMATE_HELP)
+
+    cleanup = subparsers.add_parser("plan-cleanup", help="Plan which old emails to delete")
+    cleanup.add_argument("--days", type=int, default=30, help="Scan emails older than this many days (default: 30)")
+    cleanup.add_argument("--max", type=int, default=50, dest="max_emails", help="Maximum emails to analyze (default: 50)")
+    cleanup.add_argument("--batch", action="store_true", help="Analyze with the OpenAI Batch API")
+    cleanup.add_argument("--wait", action="store_true", help="In batch mode, wait for the batch to complete")
+    cleanup.add_argument("--collect-batch", action="store_true", help="Check the pending batch instead of scanning")
+    cleanup.add_argument("--resume", action="store_true", help="Resume the interrupted planning run")
+    cleanup.add_argument("--estimate", action="store_true", help=ESTIMATE_HELP)
+
+    categorize = subparsers.add_parser("categorize", help="Categorize and label recent emails")
+    categorize.add_argument("--hours", type=int, help="How far back to look for emails (default: FETCH_TIMEFRAME_HOURS)")
+    categorize.add_argument("--max", type=int, dest="max_emails", help="Maximum emails to categorize (default: MAX_EMAILS_TO_PROCESS)")
+    categorize.add_argument("--incremental", action="store_true", help="Only emails new since the last incremental run")
+    categorize.add_argument("--resume", action="store_true", help="Resume the interrupted categorization run")
+    categorize.add_argument("--estimate", action="store_true", help=ESTIMATE_HELP)
+
+    opportunities = subparsers.add_parser("opportunities", help="Categorize sponsorship and business opportunities")
+    opportunities.add_argument("--hours", type=int, default=72, help="How far back to look for emails (default: 72)")
+    opportunities.add_argument("--max", type=int, dest="max_emails", help="Maximum emails to analyze (default: MAX_EMAILS_TO_PROCESS)")
+    opportunities.add_argument("--estimate", action="store_true", help=ESTIMATE_HELP)
+
+    archive = subparsers.add_parser("archive", help="Mark old unread inbox emails read and move them to a label")
+    archive_start = archive.add_mutually_exclusive_group(required=True)
+    archive_start.add_argument("--before", metavar="YYYY-MM-DD", help="Archive unread emails older than this date")
+    archive_start.add_argument("--resume", action="store_true", help="Resume the interrupted archive run")
+    archive.add_argument("--label", help="Target label (default: TARGET_LABEL_NAME, 'Old Stuff')")
+
+    execute = subparsers.add_parser("execute-cleanup", help="Trash the deletion candidates of the cleanup plan in bulk")
+    execute.add_argument("--include-possible", action="store_true", help="Also delete the possible candidates")
+    execute.add_argument("--unsubscribe", action="store_true", help="Also unsubscribe from their lists (HTTP link, else a queued email; once per list)")
+    execute.add_argument("--permanent", action="store_true",
+                         help="Delete permanently instead of moving to trash (needs a token with full mailbox access)")
+
+    subparsers.add_parser("filters", help="Create the Gmail labels and filters defined in email_manage_filters.py")
+    return parser
+
+def _given(**kwargs):
+    """The keyword arguments whose value was given on the command line (the rest keep the tool's defaults)."""
+    return {name: value for name, value in kwargs.items() if value is not None}
+
+def run_command(args, gmail_service, openai_client):
+    """Runs the subcommand in args with the given services and returns its summary dict."""
+    if args.command == "triage":
+        from email_triage import run_triage
+        return run_triage(gmail_service, openai_client, resume=args.resume, hours=args.hours,
+                          include_read=args.include_read, incremental=args.incremental, estimate=args.estimate,
+                          **_given(max_emails=args.max_emails))
+    if args.command == "plan-cleanup":
+        from email_plan_cleanup import run_cleanup_planning
+        return run_cleanup_planning(gmail_service, openai_client, resume=args.resume, days=args.days,
+                                    max_emails=args.max_emails, batch=args.batch, wait=args.wait,
+                                    collect_batch=args.collect_batch, estimate=args.estimate)
+    if args.command == "categorize":
+        from email_general_categorizer import run_general_categorization
+        return run_general_categorization(gmail_service, openai_client, incremental=args.incremental, resume=args.resume,
+                                          estimate=args.estimate, **_given(hours=args.hours, max_emails=args.max_emails))
+    if args.command == "opportunities":
+        from email_categorize_opportunities import run_opportunity_categorization
+        return run_opportunity_categorization(gmail_service, openai_client, hours=args.hours, estimate=args.estimate,
+                                              **_given(max_emails=args.max_emails))
+    if args.command == "archive":
+        from email_archive_unread import run_archive_unread
+        return run_archive_unread(gmail_service, cutoff_date=args.before, resume=args.resume, **_given(label_name=args.label))
+    if args.command == "execute-cleanup":
+        from email_execute_cleanup import run_cleanup_execution
+        return run_cleanup_execution(gmail_service, mode='bulk', include_possible=args.include_possible,
+                                     permanent=args.permanent, unsubscribe=args.unsubscribe)
+    if args.command == "filters":
+        from email_manage_filters import run_filter_management
+        return run_filter_management(gmail_service)
+    raise ValueError(f"Unknown command: {args.command}")
+
+def check_token_scopes(scopes):
+    """
+    Checks that token.json already grants scopes, without touching it: get_gmail_service would delete a
+    token lacking a scope and wait on the browser consent flow, which an unattended run cannot complete.
+    Returns:
+        str: What is missing and how to grant it, or None when the token covers scopes.
+    """
+    token_scopes = granted_scopes(TOKEN_FILE)
+    if token_scopes is None:
+        return f"no usable {os.path.basename(TOKEN_FILE)}; run 'python cli.py' once to authorize Gmail access"
+    missing = sorted(set(scopes) - token_scopes)
+    if not missing:
+        return None
+    hint = ("grant it from the interactive menu (option 5, bulk mode)" if missing == [PERMANENT_DELETE_SCOPE]
+            else "run 'python cli.py' to re-authorize")
+    return f"{os.path.basename(TOKEN_FILE)} lacks the scopes {missing}; {hint}"
+
+def run_noninteractive(args):
+    """
+    Runs one subcommand without prompting: progress output goes to stderr and a one-line JSON summary
+    to stdout. Any prompt the run would still need fails instead of waiting for input.
+    Returns:
+        int: Exit code (see STATUS_EXIT_CODES).
+    """
+    started = time.monotonic()
+    stdout, stdin = sys.stdout, sys.stdin
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            sys.stdin = io.StringIO() # input() raises EOFError instead of blocking
+            extra_scopes = [PERMANENT_DELETE_SCOPE] if getattr(args, "permanent", False) else []
+            need_openai = args.command not in GMAIL_ONLY_COMMANDS and not getattr(args, "estimate", False)
+            token_error = check_token_scopes(CLI_SCOPES + extra_scopes)
+            if token_error:
+                print(f"{TermColors.STATUS_ERROR}{token_error}{TermColors.RESET}")
+                summary = {"status": "error", "error": token_error}
+            else:
+                gmail_service, openai_client = init_services(need_openai=need_openai, extra_scopes=extra_scopes)
+                if not gmail_service:
+                    summary = {"status": "error", "error": "failed to initialize services"}
+                else:
+                    summary = run_command(args, gmail_service, openai_client)
+    except KeyboardInterrupt:
+        summary = {"status": "interrupted"}
+    except EOFError:
+        summary = {"status": "error", "error": "interactive input required"}
+    except Exception as e:
+        summary = {"status": "error", "error": str(e)}
+    finally:
+        sys.stdin = stdin
+    exit_code = EXIT_INTERRUPTED if summary["status"] == "interrupted" else STATUS_EXIT_CODES.get(summary["status"], EXIT_ERROR)
+    result = {"command": args.command, **summary, "duration_seconds": round(time.monotonic() - started, 1), "exit_code": exit_code}
+    stdout.write(json.dumps(result) + "\n")
+    stdout.flush()
+    return exit_code
+
+def main(argv=None):
+    """Runs the interactive menu, or the subcommand given on the command line."""
+    args = build_parser().parse_args(argv)
+    from dotenv import load_dotenv
+    load_dotenv(override=True) # Load environment variables
+    if args.command is None:
+        run_interactive_menu()
+        return EXIT_OK
+    return run_noninteractive(args)
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,10 +1,17 @@
 import os
 import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timezone
 import re # For date validation
 
 # Import utilities
-from email_utils import get_gmail_service, TermColors
+from email_utils import get_gmail_service, TermColors, clone_gmail_service
+from email_fetch import (
+    iter_message_pages, is_retryable_error, retry_after_seconds, backoff_delay, RateLimitGate, MAX_BATCH_RETRIES
+)
+from email_checkpoint import get_checkpoint_store
 import sys # For sys.exit in standalone mode
 
 from googleapiclient.errors import HttpError
@@ -20,19 +27,149 @@ CREDENTIALS_FILE = os.path.join(SCRIPT_DIR, "credentials.json")
 
 # Target label (folder) name
 TARGET_LABEL_NAME = 'Old Stuff'
+# IDs per batchModify call (the Gmail API maximum)
+ARCHIVE_CHUNK_SIZE = 1000
+# batchModify calls in flight at once; each worker thread uses its own service object (clone_gmail_service)
+ARCHIVE_WORKERS = 4
+# Checkpoint job name of archive runs (see email_checkpoint.py)
+ARCHIVE_CHECKPOINT_JOB = "archive_unread"
+
+# --- Archiving ---
+def get_or_create_label(gmail_service, label_name):
+    """Returns the ID of the user label named label_name, creating the label if needed."""
+    print(f"{TermColors.STATUS_INFO}Checking for target label '{label_name}'...{TermColors.RESET}")
+    results = gmail_service.users().labels().list(userId='me').execute()
+    for label in results.get('labels', []):
+        if label['name'] == label_name:
+            print(f"{TermColors.STATUS_SUCCESS}Found existing label '{label_name}' with ID: {label['id']}{TermColors.RESET}")
+            return label['id']
+    print(f"{TermColors.STATUS_INFO}Label '{label_name}' not found. Creating it...{TermColors.RESET}")
+    created_label = gmail_service.users().labels().create(userId='me', body={'name': label_name}).execute()
+    print(f"{TermColors.STATUS_SUCCESS}Created label '{label_name}' with ID: {created_label['id']}{TermColors.RESET}")
+    return created_label['id']
+
+
+class PipelinedArchiver:
+    """
+    Marks messages read and adds the target label with batchModify calls of up to ARCHIVE_CHUNK_SIZE IDs,
+    ARCHIVE_WORKERS at a time, while the caller keeps listing. submit() blocks once twice as many chunks as
+    workers are in flight, so listing never runs far ahead. Rate-limit responses pause every worker.
+    Each finished chunk is recorded in the checkpoint job as done or failed.
+    """
+
+    def __init__(self, gmail_service, label_name, store, job=ARCHIVE_CHECKPOINT_JOB, workers=ARCHIVE_WORKERS):
+        self.gmail_service = gmail_service
+        self.label_name = label_name
+        self.label_id = None # Looked up when the first chunk is submitted
+        self.store = store
+        self.job = job
+        self.workers = max(1, workers)
+        self.submitted = set()
+        self.archived = 0
+        self.failed = 0
+        self.failed_batches = 0
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        self._in_flight = set()
+        self._local = threading.local()
+        self._gate = RateLimitGate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wait()
+        self._pool.shutdown()
+
+    def _modify(self, message_ids):
+        """Runs on a worker thread. Returns (message_ids, error or None)."""
+        if not hasattr(self._local, 'service'):
+            self._local.service = clone_gmail_service(self.gmail_service)
+        body = {'ids': message_ids, 'removeLabelIds': ['UNREAD'], 'addLabelIds': [self.label_id]}
+        for attempt in range(MAX_BATCH_RETRIES + 1):
+            self._gate.wait()
+            try:
+                self._local.service.users().messages().batchModify(userId='me', body=body).execute()
+                return message_ids, None
+            except HttpError as error:
+                if not is_retryable_error(error) or attempt == MAX_BATCH_RETRIES:
+                    return message_ids, error
+                delay = retry_after_seconds(error) or backoff_delay(attempt + 1)
+                if error.resp.status in (429, 403):
+                    self._gate.pause(delay)
+                else:
+                    time.sleep(delay)
+        return message_ids, None
+
+    def _collect(self, done):
+        for future in done:
+            self._in_flight.discard(future)
+            message_ids, error = future.result()
+            if error is None:
+                self.archived += len(message_ids)
+                self.store.mark_many_done(self.job, message_ids)
+                print(f"{TermColors.STATUS_INFO}Archived {self.archived} emails so far...{TermColors.RESET}")
+            else:
+                self.failed += len(message_ids)
+                self.failed_batches += 1
+                self.store.mark_many_failed(self.job, message_ids, error)
+                print(f'{TermColors.STATUS_ERROR}An error occurred while processing batch starting with ID {message_ids[0]}: {error}{TermColors.RESET}')
+
+    def submit(self, message_ids):
+        """Queues message_ids (at most ARCHIVE_CHUNK_SIZE) for one batchModify call."""
+        if self.label_id is None:
+            self.label_id = get_or_create_label(self.gmail_service, self.label_name)
+        while len(self._in_flight) >= 2 * self.workers:
+            done, _ = wait(self._in_flight, return_when=FIRST_COMPLETED)
+            self._collect(done)
+        self.submitted.update(message_ids)
+        self._in_flight.add(self._pool.submit(self._modify, list(message_ids)))
+
+    def wait(self):
+        """Waits for every submitted chunk to finish."""
+        if self._in_flight:
+            self._collect(wait(self._in_flight)[0])
+
 
 # --- Main Logic ---
-def run_archive_unread(gmail_service): # Renamed and added parameter
+def run_archive_unread(gmail_service, cutoff_date=None, label_name=TARGET_LABEL_NAME, resume=False): # Renamed and added parameter
+    """
+    Marks unread inbox emails older than cutoff_date (YYYY-MM-DD, asked for when None) as read and moves
+    them to label_name. Each listed page is archived while the next one is listed (PipelinedArchiver),
+    and progress is checkpointed. With resume=True, continues the interrupted run recorded in the
+    checkpoint database instead (same cutoff date and label): emails it listed but did not archive are
+    archived first, then the search picks up the rest.
+    Returns:
+        dict: Run summary ('status' is 'ok', 'incomplete' when some batches failed, or 'error').
+    """
     print(f"{TermColors.BOLD}Starting Email Unread Archiver...{TermColors.RESET}")
 
     if not gmail_service:
         print(f"{TermColors.STATUS_ERROR}Gmail service not available for unread archiver. Exiting.{TermColors.RESET}")
-        return
-
+        return {"status": "error", "error": "Gmail service not available"}
+
+    store = get_checkpoint_store()
+    pending_ids = []
+    if resume:
+        checkpoint = store.unfinished_job(ARCHIVE_CHECKPOINT_JOB)
+        if checkpoint is None:
+            print(f"{TermColors.YELLOW}No interrupted archive run to resume.{TermColors.RESET}")
+            return {"status": "error", "error": "no interrupted archive run to resume"}
+        cutoff_date, label_name = checkpoint["params"]["cutoff_date"], checkpoint["params"]["label_name"]
+        pending_ids = store.pending_ids(ARCHIVE_CHECKPOINT_JOB)
+        print(f"{TermColors.STATUS_INFO}Resuming {store.describe(ARCHIVE_CHECKPOINT_JOB)}.{TermColors.RESET}")
     # 0. Get cutoff date from user
     cutoff_date_str = ""
     cutoff_date_obj = None
-    while True:
+    if cutoff_date is not None:
+        cutoff_date_str = cutoff_date.strip()
+        try:
+            if not re.match(r"^\d{4}-\d{2}-\d{2}$", cutoff_date_str):
+                raise ValueError(cutoff_date_str)
+            cutoff_date_obj = datetime.strptime(cutoff_date_str, "%Y-%m-%d")
+        except ValueError:
+            print(f"{TermColors.STATUS_ERROR}Invalid cutoff date '{cutoff_date_str}'. Please use YYYY-MM-DD.{TermColors.RESET}")
+            return {"status": "error", "error": f"invalid cutoff date: {cutoff_date_str}"}
+    while cutoff_date_obj is None:
         cutoff_date_str = input(f"{TermColors.YELLOW}Enter cutoff date (YYYY-MM-DD) to archive unread emails older than this date: {TermColors.RESET}").strip()
         if re.match(r"^\d{4}-\d{2}-\d{2}$", cutoff_date_str):
             try:
@@ -49,101 +186,63 @@ def run_archive_unread(gmail_service): # Renamed and added parameter
 
     # Format date for Gmail query (YYYY/MM/DD)
     gmail_query_date = cutoff_date_obj.strftime("%Y/%m/%d")
-    
-    # 1. Find all unread emails older than the cutoff date
-    unread_message_ids = []
-    page_token = None
-    print(f"{TermColors.STATUS_INFO}Searching for unread emails older than {cutoff_date_str}...{TermColors.RESET}")
-    
+    if not resume:
+        store.start_job(ARCHIVE_CHECKPOINT_JOB, {"cutoff_date": cutoff_date_str, "label_name": label_name})
+
+    # 1. Find unread emails older than the cutoff date, and archive (mark read and add label) each page as it arrives
     query_string = f'is:unread in:inbox -in:spam -in:trash before:{gmail_query_date}'
+    print(f"{TermColors.STATUS_INFO}Searching for unread emails older than {cutoff_date_str} and moving them to '{label_name}'...{TermColors.RESET}")
     print(f"{TermColors.STATUS_INFO}Using Gmail query: {query_string}{TermColors.RESET}")
 
+    passes = 0
+    archiver = PipelinedArchiver(gmail_service, label_name, store)
     try:
-        while True:
-            response = gmail_service.users().messages().list(
-                userId='me',
-                q=query_string,
-                pageToken=page_token,
-                maxResults=500 # Fetch in batches
-            ).execute()
-            
-            messages = response.get('messages', [])
-            if not messages:
-                break # No more unread messages
-
-            unread_message_ids.extend([msg['id'] for msg in messages])
-            page_token = response.get('nextPageToken')
-
-            print(f"{TermColors.STATUS_INFO}Found {len(unread_message_ids)} unread emails so far...{TermColors.RESET}")
-
-            if not page_token:
-                break # No more pages
-
-        print(f"{TermColors.STATUS_SUCCESS}Finished searching. Found a total of {len(unread_message_ids)} unread emails.{TermColors.RESET}")
-
+        with archiver:
+            for i in range(0, len(pending_ids), ARCHIVE_CHUNK_SIZE):
+                archiver.submit(pending_ids[i:i + ARCHIVE_CHUNK_SIZE])
+            # Modifying messages while later pages are listed can make the paging skip some, so the search is
+            # repeated until a pass finds nothing new (archived emails no longer match the query)
+            while True:
+                passes += 1
+                found_this_pass = 0
+                chunk = []
+                for messages in iter_message_pages(gmail_service, query_string):
+                    new_ids = [msg['id'] for msg in messages if msg['id'] not in archiver.submitted and msg['id'] not in chunk]
+                    store.add_messages(ARCHIVE_CHECKPOINT_JOB, new_ids)
+                    found_this_pass += len(new_ids)
+                    chunk.extend(new_ids)
+                    print(f"{TermColors.STATUS_INFO}Found {len(archiver.submitted) + len(chunk)} unread emails so far...{TermColors.RESET}")
+                    if len(chunk) >= ARCHIVE_CHUNK_SIZE:
+                        archiver.submit(chunk[:ARCHIVE_CHUNK_SIZE])
+                        chunk = chunk[ARCHIVE_CHUNK_SIZE:]
+                if chunk:
+                    archiver.submit(chunk)
+                archiver.wait() # The next pass must not list messages that are still being modified
+                if not found_this_pass:
+                    break
     except HttpError as error:
-        print(f'{TermColors.STATUS_ERROR}An error occurred while searching for unread emails: {error}{TermColors.RESET}')
-        return
-
-    if not unread_message_ids:
+        print(f'{TermColors.STATUS_ERROR}An error occurred while archiving unread emails: {error}{TermColors.RESET}')
+        print(f"{TermColors.YELLOW}Run the archiver with --resume to continue.{TermColors.RESET}")
+        store.report(ARCHIVE_CHECKPOINT_JOB)
+        return {"status": "error", "error": f"archiving unread emails failed: {error}", "archived": archiver.archived}
+
+    found = len(archiver.submitted)
+    if not found:
+        store.finish_job(ARCHIVE_CHECKPOINT_JOB)
         print(f"{TermColors.YELLOW}No unread emails found to archive. Exiting.{TermColors.RESET}")
-        return
-
-    # 2. Get or create the target label
-    target_label_id = None
-    print(f"{TermColors.STATUS_INFO}Checking for target label '{TARGET_LABEL_NAME}'...{TermColors.RESET}")
-
-    try:
-        results = gmail_service.users().labels().list(userId='me').execute()
-        labels = results.get('labels', [])
-        for label in labels:
-            if label['name'] == TARGET_LABEL_NAME:
-                target_label_id = label['id']
-                print(f"{TermColors.STATUS_SUCCESS}Found existing label '{TARGET_LABEL_NAME}' with ID: {target_label_id}{TermColors.RESET}")
-                break
-
-        if not target_label_id:
-            print(f"{TermColors.STATUS_INFO}Label '{TARGET_LABEL_NAME}' not found. Creating it...{TermColors.RESET}")
-            created_label = gmail_service.users().labels().create(userId='me', body={'name': TARGET_LABEL_NAME}).execute()
-            target_label_id = created_label['id']
-            print(f"{TermColors.STATUS_SUCCESS}Created label '{TARGET_LABEL_NAME}' with ID: {target_label_id}{TermColors.RESET}")
-
-    except HttpError as error:
-        print(f'{TermColors.STATUS_ERROR}An error occurred while getting or creating label: {error}{TermColors.RESET}')
-        return
-
-    if not target_label_id:
-        print(f"{TermColors.STATUS_ERROR}Could not find or create target label. Cannot proceed. Exiting.{TermColors.RESET}")
-        return
-
-    # 3. Process emails (Mark Read and Add Label)
-    print(f"\n{TermColors.STATUS_INFO}Processing {len(unread_message_ids)} emails: marking as read and moving to '{TARGET_LABEL_NAME}'...{TermColors.RESET}")
-
-    batch_size = 100 # Gmail API modify allows batch operations
-    processed_count = 0
-
-    for i in range(0, len(unread_message_ids), batch_size):
-        batch_ids = unread_message_ids[i:i + batch_size]
-        
-        try:
-            # Modify messages: remove UNREAD label, add target label
-            gmail_service.users().messages().batchModify(
-                userId='me',
-                body={
-                    'ids': batch_ids,
-                    'removeLabelIds': ['UNREAD'],
-                    'addLabelIds': [target_label_id]
-                }
-            ).execute()
-            processed_count += len(batch_ids)
-            print(f"{TermColors.STATUS_INFO}Processed batch {i//batch_size + 1}: {processed_count}/{len(unread_message_ids)} emails...{TermColors.RESET}")
-
-        except HttpError as error:
-            print(f'{TermColors.STATUS_ERROR}An error occurred while processing batch starting with ID {batch_ids[0]}: {error}{TermColors.RESET}')
-            # Decide how to handle errors - skip batch, retry, etc. For now, just report and continue.
-
-    print(f"\n{TermColors.STATUS_SUCCESS}Finished processing emails. Total processed: {processed_count}.{TermColors.RESET}")
+        return {"status": "ok", "cutoff_date": cutoff_date_str, "found": 0, "archived": 0, "failed_batches": 0}
+
+    print(f"\n{TermColors.STATUS_SUCCESS}Finished processing emails. Total processed: {archiver.archived} of {found} ({passes} listing passes).{TermColors.RESET}")
+    if archiver.failed:
+        print(f"{TermColors.YELLOW}{archiver.failed} emails could not be archived. Run the archiver with --resume to retry them.{TermColors.RESET}")
+        store.report(ARCHIVE_CHECKPOINT_JOB)
+    else:
+        store.finish_job(ARCHIVE_CHECKPOINT_JOB)
     print(f"{TermColors.BOLD}Email Unread Archiver finished.{TermColors.RESET}")
+    return {
+        "status": "incomplete" if archiver.failed_batches else "ok", "cutoff_date": cutoff_date_str,
+        "found": found, "archived": archiver.archived, "failed_batches": archiver.failed_batches, "listing_passes": passes
+    }
 
 
 if __name__ == "__main__":
@@ -153,4 +252,4 @@ if __name__ == "__main__":
         print(f"{TermColors.STATUS_ERROR}Failed to initialize Gmail service for standalone run. Exiting.{TermColors.RESET}")
         sys.exit(1)
     
-    run_archive_unread(standalone_gmail_service)
+    run_archive_unread(standalone_gmail_service, resume="--resume" in sys.argv[1:])
@@ -5,17 +5,21 @@ from datetime import datetime, timedelta
 from openai import OpenAI
 from pydantic import BaseModel
 from typing import Optional, Literal
-import base64
 # from email.mime.text import MIMEText # No longer needed here as send_email is in utils
-import re 
 
 # Import utilities
 from email_utils import get_gmail_service, TermColors # send_email is not directly used by this script's main flow
+from email_fetch import iter_fetched_messages, iter_message_ids, FetchProfile, MESSAGE_FULL_FIELDS
+from email_records import email_record_from_message, spool_records, iter_spool
+from email_store import get_message_store
+from email_llm_cache import get_llm_cache
+from email_llm_pipeline import classify_all
+from email_rules import get_rule_engine
+from email_prompt_prep import get_body_preparer
+from email_estimate import estimate_run
 
 from googleapiclient.errors import HttpError # Keep for exception handling
 
-# Load environment variables
-load_dotenv(override=True)
 
 # --- Configuration ---
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly', 'https://www.googleapis.com/auth/gmail.send'] # Readonly for fetching, send if it were to use the send_email util directly
@@ -25,10 +29,26 @@ TOKEN_FILE = os.path.join(SCRIPT_DIR, "token.json")
 CREDENTIALS_FILE = os.path.join(SCRIPT_DIR, "credentials.json")
 
 # File paths - make them SCRIPT_DIR relative
-EMAILS_FILE = os.path.join(SCRIPT_DIR, "emails.txt")
+# Append-only JSONL copy of the emails handed to analysis (None disables spooling)
+EMAILS_SPOOL = os.path.join(SCRIPT_DIR, "emails.jsonl")
 CATEGORIZED_EMAILS_JSON = os.path.join(SCRIPT_DIR, "categorized_emails.json")
 OPPORTUNITY_REPORT = os.path.join(SCRIPT_DIR, "opportunity_report.md") # Changed to .md
 
+# Model used for opportunity analysis. Bump the prompt version whenever the prompt or parsing changes,
+# so results cached for the old prompt are no longer served.
+ANALYSIS_MODEL = "gpt-4.1"
+ANALYSIS_PROMPT_VERSION = "opportunity-v1"
+# Maximum emails analyzed per run; each one is a request to ANALYSIS_MODEL, so long --hours windows are
+# capped instead of costing whatever the inbox holds (the original fetch listed at most 50)
+MAX_EMAILS_TO_PROCESS = 50
+# Token budget for the email body in the opportunity prompt (after quoted history, signatures and footers are stripped)
+ANALYSIS_BODY_TOKENS = 1000
+# Header-rule categories (email_rules) that are never sponsorships or business inquiries. Promotions are
+# left to the AI because sponsor pitches often read like marketing.
+RULE_OTHER_CATEGORIES = {"Transactional", "Notifications"}
+# The opportunity prompt reads the body, so messages are fetched in 'full' format (without sizeEstimate)
+OPPORTUNITY_FETCH_PROFILE = FetchProfile(format='full', fields=MESSAGE_FULL_FIELDS)
+
 
 class EmailAnalysis(BaseModel):
     category: Literal["sponsorship", "business_inquiry", "other"]
@@ -40,9 +60,15 @@ class EmailAnalysis(BaseModel):
 # get_gmail_service and send_email functions are now in email_utils.py
 import sys # For sys.exit in standalone mode
 
-def get_emails(service, hours=72): # Added service parameter
+def opportunity_query(hours):
+    """Gmail search query for inbox emails from the last hours hours."""
+    query_date = (datetime.now() - timedelta(hours=hours)).strftime('%Y/%m/%d')
+    return f'after:{query_date} in:INBOX -in:spam -in:trash' # Changed category:primary to in:INBOX and added exclusions
+
+def get_emails(service, hours=72, max_emails=MAX_EMAILS_TO_PROCESS): # Added service parameter
     """
-    Fetches emails from Gmail from the last {hours} hours and saves to EMAILS_FILE.
+    Fetches emails from Gmail from the last {hours} hours, at most max_emails of them (None = all matching emails).
+    Returns a list of EmailRecord (also spooled to EMAILS_SPOOL).
     """
     # service = get_gmail_service(TOKEN_FILE, CREDENTIALS_FILE, SCOPES) # Service is now passed in
     if not service:
@@ -50,113 +76,44 @@ def get_emails(service, hours=72): # Added service parameter
         return []
 
     emails_data = []
-    query_date = (datetime.now() - timedelta(hours=hours)).strftime('%Y/%m/%d')
-    query = f'after:{query_date} in:INBOX -in:spam -in:trash' # Changed category:primary to in:INBOX and added exclusions
+    query = opportunity_query(hours)
 
     try:
-        response = service.users().messages().list(userId='me', q=query, maxResults=50).execute() 
-        messages = response.get('messages', [])
-        
-        with open(EMAILS_FILE, "w", encoding="utf-8") as f_out: 
-            for message_info in messages:
-                msg_id = message_info['id']
-                msg = service.users().messages().get(userId='me', id=msg_id, format='full').execute() 
-                
-                payload = msg.get('payload', {})
-                headers = payload.get('headers', [])
-                
-                subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-                from_sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown Sender')
-                received_date_unix = int(msg.get('internalDate', '0')) / 1000
-                received_date = datetime.fromtimestamp(received_date_unix).isoformat()
-
-                body_content = ""
-                if 'parts' in payload:
-                    for part in payload['parts']:
-                        if part['mimeType'] == 'text/plain':
-                            body_data = part['body'].get('data')
-                            if body_data:
-                                body_content += base64.urlsafe_b64decode(body_data).decode('utf-8', errors='replace')
-                            break 
-                    if not body_content: 
-                         for part in payload['parts']:
-                            if part['mimeType'] == 'text/html':
-                                body_data = part['body'].get('data')
-                                if body_data:
-                                    html_content = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='replace')
-                                    body_content += re.sub('<[^<]+?>', '', html_content) 
-                                break
-                elif 'body' in payload and payload['body'].get('data'):
-                    body_data = payload['body']['data']
-                    body_content = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='replace')
-                    if payload.get('mimeType') == 'text/html': 
-                        body_content = re.sub('<[^<]+?>', '', body_content)
-
-                email_detail = {
-                    'subject': subject, 'from': from_sender,
-                    'receivedDateTime': received_date, 'body': body_content.strip()
-                }
-                emails_data.append(email_detail)
-
-                f_out.write(f"Subject: {subject}\nFrom: {from_sender}\nReceived: {received_date}\nBody: {body_content.strip()}\n" + "-" * 50 + "\n")
-                
-        print(f"{TermColors.STATUS_INFO}Fetched {len(emails_data)} emails from the last {hours} hours into {os.path.basename(EMAILS_FILE)} (in the project directory).{TermColors.RESET}")
+        messages = iter_message_ids(service, query, max_results=max_emails) # Streams IDs page by page
+        records = (email_record_from_message(msg) for msg in
+                   iter_fetched_messages(service, messages, profile=OPPORTUNITY_FETCH_PROFILE, store=get_message_store()))
+        if EMAILS_SPOOL:
+            records = spool_records(records, EMAILS_SPOOL)
+        emails_data = list(records)
+        print(f"{TermColors.STATUS_INFO}Fetched {len(emails_data)} emails from the last {hours} hours.{TermColors.RESET}")
+        if max_emails is not None and len(emails_data) >= max_emails:
+            print(f"{TermColors.YELLOW}Stopped at the limit of {max_emails} emails; older matching emails are not analyzed (raise it with --max).{TermColors.RESET}")
         if not emails_data:
-            with open(EMAILS_FILE, 'w', encoding='utf-8') as f_empty: f_empty.write("")
-            print(f"{TermColors.YELLOW}{os.path.basename(EMAILS_FILE)} (in the project directory) is empty as no new emails were found.{TermColors.RESET}")
+            print(f"{TermColors.YELLOW}No new emails were found.{TermColors.RESET}")
 
     except HttpError as error:
         print(f"{TermColors.STATUS_ERROR}An error occurred fetching emails: {error}{TermColors.RESET}")
-        with open(EMAILS_FILE, 'w', encoding='utf-8') as f_err: f_err.write("")
-        print(f"{TermColors.YELLOW}{os.path.basename(EMAILS_FILE)} (in the project directory) is empty due to an error.{TermColors.RESET}")
+        emails_data = []
     return emails_data
 
 def read_emails():
-    """Read emails from emails.txt and return as a list of dictionaries"""
-    try:
-        with open(EMAILS_FILE, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-    except FileNotFoundError:
-        print(f"{TermColors.YELLOW}No {EMAILS_FILE} file found. Creating empty file.{TermColors.RESET}")
-        with open(EMAILS_FILE, "w", encoding="utf-8") as f_create:
-            f_create.write("")
+    """Streams the EmailRecords of the last fetch back from EMAILS_SPOOL (e.g. to re-run analysis offline)."""
+    if not EMAILS_SPOOL or not os.path.exists(EMAILS_SPOOL):
+        print(f"{TermColors.YELLOW}No spooled emails found.{TermColors.RESET}")
         return []
-    
-    emails = []
-    current_email = {}
-    current_body_lines = []
-    
-    for line in lines:
-        line = line.rstrip()
-        if line.startswith("Subject: "):
-            if current_email:
-                current_email["body"] = "\n".join(l for l in current_body_lines if l.strip())
-                emails.append(current_email)
-                current_body_lines = []
-            current_email = {"subject": line[9:], "from": "unknown"}
-        elif line.startswith("From: "): current_email["from"] = line[6:]
-        elif line.startswith("Received: "): current_email["received"] = line[10:]
-        elif line.startswith("Body: "): current_body_lines = [line[6:]]
-        elif line.startswith("-" * 50): continue
-        else:
-            if current_body_lines is not None: current_body_lines.append(line)
-            
-    if current_email:
-        current_email["body"] = "\n".join(l for l in current_body_lines if l.strip())
-        emails.append(current_email)
-    return emails
+    return list(iter_spool(EMAILS_SPOOL))
 
-def analyze_email(client, email):
-    """Analyze a single email using OpenAI API with Structured Outputs"""
-    body = email['body'].strip()
+def analysis_messages(email):
+    """Builds the chat messages for the opportunity analysis of one email."""
+    body = get_body_preparer().prepare(email.body, ANALYSIS_BODY_TOKENS, ANALYSIS_MODEL)
     prompt = f"""
     You are an email categorizer for a professional. Your task is to categorize incoming emails
     and identify important information.
     Email to analyze:
-    Subject: {email['subject']}
-    From: {email['from']}
+    Subject: {email.subject}
+    From: {email.sender}
     Body:
-    {body[:4000]}
+    {body}
     Categorize this email into one of the following:
     1. "sponsorship" - Companies wanting to sponsor content or services
     2. "business_inquiry" - Business-related emails, partnership offers, marketing opportunities
@@ -170,46 +127,68 @@ def analyze_email(client, email):
         "company_name": <extracted company name or null>,
         "topic": <main topic/product or null>
     }}"""
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[
-                {"role": "system", "content": "You are a precise email categorizer. Your goal is to accurately categorize emails and extract relevant business information."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
-        content = response.choices[0].message.content
-        if content:
-            analysis = json.loads(content)
-            print(f"\n{TermColors.STATUS_INFO}Analyzing: {email['subject']}{TermColors.RESET}")
-            print(f"Analysis result: {json.dumps(analysis, indent=2)}")
-            return EmailAnalysis(**analysis)
-        else:
-            print(f"{TermColors.YELLOW}Empty response for email: {email['subject']}{TermColors.RESET}")
-            return None
-    except Exception as e:
-        print(f"{TermColors.STATUS_ERROR}Error analyzing email: {e}{TermColors.RESET}")
-        print(f"Failed email subject: {email['subject']}")
+    return [
+        {"role": "system", "content": "You are a precise email categorizer. Your goal is to accurately categorize emails and extract relevant business information."},
+        {"role": "user", "content": prompt}
+    ]
+
+def parse_analysis(email, content):
+    """Validates the model's JSON answer for one email. Returns None for an empty answer."""
+    if not content:
+        print(f"{TermColors.YELLOW}Empty response for email: {email.subject}{TermColors.RESET}")
         return None
+    analysis = json.loads(content)
+    print(f"\n{TermColors.STATUS_INFO}Analyzing: {email.subject}{TermColors.RESET}")
+    print(f"Analysis result: {json.dumps(analysis, indent=2)}")
+    return EmailAnalysis(**analysis)
+
+def rule_analysis(email):
+    """Classifies emails recognised by the header rules as 'other' without asking the AI."""
+    verdict = get_rule_engine().classify(email.sender, email.subject, email.label_ids, categories=RULE_OTHER_CATEGORIES)
+    if verdict is None:
+        return None
+    return EmailAnalysis(category="other", confidence=1.0, reason=f"Matched rule '{verdict.rule}' ({verdict.category}).")
+
+def analysis_error(email, error):
+    print(f"{TermColors.STATUS_ERROR}Error analyzing email: {error}{TermColors.RESET}")
+    print(f"Failed email subject: {email.subject}")
+    return None
 
-def run_opportunity_categorization_step1(gmail_service, openai_client): # Renamed and added parameters
-    """Fetches and performs initial categorization of emails."""
+def analyze_emails(client, emails):
+    """
+    Analyzes many emails concurrently (see email_llm_pipeline.classify_all).
+    Returns a list of EmailAnalysis (or None where analysis failed), in the same order as emails.
+    """
+    return classify_all(
+        client, emails, analysis_messages, parse_analysis,
+        ANALYSIS_MODEL, ANALYSIS_PROMPT_VERSION, EmailAnalysis,
+        on_error=analysis_error, pre_classify=rule_analysis
+    )
+
+def analyze_email(client, email):
+    """Analyze a single email using OpenAI API with Structured Outputs"""
+    return analyze_emails(client, [email])[0]
+
+def run_opportunity_categorization_step1(gmail_service, openai_client, hours=72, max_emails=MAX_EMAILS_TO_PROCESS): # Renamed and added parameters
+    """
+    Fetches and performs initial categorization of emails from the last hours hours (up to max_emails).
+    Returns:
+        dict: Counts of fetched emails and of each category.
+    """
     print(f"{TermColors.STATUS_INFO}Fetching new emails for opportunity categorization...{TermColors.RESET}")
-    get_emails(service=gmail_service, hours=72) # Pass gmail_service
-    
-    # client = OpenAI() # Use passed-in openai_client
-    emails = read_emails()
+    emails = get_emails(service=gmail_service, hours=hours, max_emails=max_emails) # EmailRecords go straight to analysis
     
     sponsorship_emails, business_emails, other_emails = [], [], []
     
-    for email in emails:
-        analysis = analyze_email(openai_client, email) # Pass openai_client
+    # Emails are analyzed concurrently; results come back in the same order as emails
+    analyses = analyze_emails(openai_client, emails)
+
+    for email, analysis in zip(emails, analyses):
         if analysis:
             email_data = {
-                "subject": email["subject"], "from": email["from"],
-                "received": email.get("received", datetime.now().isoformat()),
-                "body": email["body"], "analysis": analysis.model_dump()
+                "subject": email.subject, "from": email.sender,
+                "received": email.received or datetime.now().isoformat(),
+                "body": email.body, "analysis": analysis.model_dump()
             }
             if analysis.category == "sponsorship": sponsorship_emails.append(email_data)
             elif analysis.category == "business_inquiry": business_emails.append(email_data)
@@ -227,6 +206,9 @@ def run_opportunity_categorization_step1(gmail_service, openai_client): # Rename
     print(f"{TermColors.SUMMARY_KEY}Sponsorship requests:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{len(sponsorship_emails)}{TermColors.RESET}")
     print(f"{TermColors.SUMMARY_KEY}Business inquiries:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{len(business_emails)}{TermColors.RESET}")
     print(f"{TermColors.SUMMARY_KEY}Other emails:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{len(other_emails)}{TermColors.RESET}")
+    get_llm_cache().report()
+    get_rule_engine().report()
+    get_body_preparer().report()
     print(f"\n{TermColors.STATUS_INFO}Detailed results saved to: {os.path.basename(CATEGORIZED_EMAILS_JSON)} (in the project directory){TermColors.RESET}")
     
     print(f"\n{TermColors.SUMMARY_HEADER}High Confidence Business/Sponsorship Emails (>0.8):{TermColors.RESET}")
@@ -238,7 +220,10 @@ def run_opportunity_categorization_step1(gmail_service, openai_client): # Rename
             if email["analysis"]["company_name"]: print(f"Company: {email['analysis']['company_name']}")
             if email["analysis"]["topic"]: print(f"Topic: {email['analysis']['topic']}")
             print(f"Reason: {email['analysis']['reason']}\n" + "-" * 50)
-    return True # Indicate success or that the process ran
+    return {
+        "emails_fetched": len(emails), "sponsorship": len(sponsorship_emails),
+        "business_inquiries": len(business_emails), "other": len(other_emails)
+    }
 
 def run_opportunity_categorization_step2(openai_client, categorized_emails_path=CATEGORIZED_EMAILS_JSON): # Added openai_client
     """Generate a structured report highlighting valuable business opportunities"""
@@ -250,7 +235,7 @@ def run_opportunity_categorization_step2(openai_client, categorized_emails_path=
         
         if not all_relevant_emails:
             print(f"{TermColors.YELLOW}No business or sponsorship emails found to analyze for the report.{TermColors.RESET}")
-            return
+            return False
             
         # client = OpenAI() # Use passed-in openai_client
         print(f"\n{TermColors.STATUS_INFO}Analyzing business and sponsorship emails for quality opportunities report...{TermColors.RESET}")
@@ -276,7 +261,7 @@ def run_opportunity_categorization_step2(openai_client, categorized_emails_path=
         5. Specificity (clear request/opportunity with details, not vague)
         Format your report with clear sections and prioritize opportunities that seem unique, personalized, and valuable.
         """
-        response = client.chat.completions.create(
+        response = openai_client.chat.completions.create(
             model="gpt-4",
             messages=[
                 {"role": "system", "content": "You are an executive assistant who helps identify high-quality opportunities from business emails. You excel at distinguishing personalized offers from mass marketing campaigns."},
@@ -291,25 +276,42 @@ def run_opportunity_categorization_step2(openai_client, categorized_emails_path=
         with open(OPPORTUNITY_REPORT, "w", encoding="utf-8") as f:
             f.write(f"# BUSINESS AND SPONSORSHIP OPPORTUNITY REPORT\n\n{report_content}")
         print(f"\n{TermColors.STATUS_SUCCESS}Report saved to {os.path.basename(OPPORTUNITY_REPORT)} (in the project directory){TermColors.RESET}")
+        return True
             
     except FileNotFoundError:
         print(f"{TermColors.STATUS_ERROR}Error: File {categorized_emails_path} not found. Please run sort_emails() first.{TermColors.RESET}")
     except Exception as e:
         print(f"{TermColors.STATUS_ERROR}Error generating opportunity report: {e}{TermColors.RESET}")
+    return False
 
-def run_opportunity_categorization(gmail_service, openai_client):
-    """Main orchestrator for opportunity categorization."""
+def run_opportunity_categorization(gmail_service, openai_client, hours=72, max_emails=MAX_EMAILS_TO_PROCESS, estimate=False):
+    """
+    Main orchestrator for opportunity categorization (emails from the last hours hours, up to max_emails).
+    With estimate=True, only projects the cost and duration of step 1 from a sample (email_estimate); the
+    single report request of step 2 depends on step 1's results and is not included.
+    Returns:
+        dict: Run summary ('status' is 'ok' or 'error').
+    """
     print(f"{TermColors.BOLD}Starting Email Opportunity Categorization...{TermColors.RESET}")
-    step1_success = run_opportunity_categorization_step1(gmail_service, openai_client)
-    if step1_success:
-        run_opportunity_categorization_step2(openai_client)
-    else:
-        print(f"{TermColors.YELLOW}Step 1 of opportunity categorization did not complete successfully. Skipping report generation.{TermColors.RESET}")
+    if estimate and gmail_service:
+        return estimate_run(
+            "opportunity categorization", gmail_service, opportunity_query(hours), OPPORTUNITY_FETCH_PROFILE,
+            email_record_from_message, analysis_messages, ANALYSIS_MODEL, (ANALYSIS_PROMPT_VERSION,), EmailAnalysis,
+            max_emails=max_emails, pre_classify=rule_analysis
+        )
+    if not gmail_service or not openai_client:
+        print(f"{TermColors.STATUS_ERROR}Gmail service or OpenAI client not available for opportunity categorization. Exiting.{TermColors.RESET}")
+        return {"status": "error", "error": "Gmail service or OpenAI client not available"}
+    step1_summary = run_opportunity_categorization_step1(gmail_service, openai_client, hours=hours, max_emails=max_emails)
+    summary = {"status": "ok", "hours": hours, **step1_summary}
+    summary["report_written"] = run_opportunity_categorization_step2(openai_client)
     print(f"{TermColors.BOLD}Email Opportunity Categorization finished.{TermColors.RESET}")
+    return summary
 
 
 if __name__ == "__main__":
     print(f"{TermColors.BOLD}Running Email Opportunity Categorization Standalone...{TermColors.RESET}")
+    load_dotenv(override=True) # Load environment variables (cli.py loads them once for every tool)
     standalone_gmail_service = get_gmail_service(TOKEN_FILE, CREDENTIALS_FILE, SCOPES)
     if not standalone_gmail_service:
         print(f"{TermColors.STATUS_ERROR}Failed to initialize Gmail service for standalone run. Exiting.{TermColors.RESET}")
@@ -322,4 +324,4 @@ if __name__ == "__main__":
         print(f"{TermColors.STATUS_ERROR}Failed to initialize OpenAI client for standalone run: {e}{TermColors.RESET}")
         sys.exit(1)
 
-    run_opportunity_categorization(standalone_gmail_service, standalone_openai_client)
+    run_opportunity_categorization(standalone_gmail_service, standalone_openai_client, estimate="--estimate" in sys.argv[1:])
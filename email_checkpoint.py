@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+# Import utilities
+from email_utils import TermColors
+
+# Determine the absolute path to THIS script's directory
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CHECKPOINT_FILE = os.path.join(SCRIPT_DIR, "checkpoints.sqlite3")
+
+# --- Configuration ---
+# Stored results read per query when streaming them back
+RESULTS_PAGE_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job TEXT PRIMARY KEY,
+    params TEXT NOT NULL,
+    finished INTEGER NOT NULL DEFAULT 0,
+    started_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_messages (
+    job TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_job_messages_position ON job_messages(job, position);
+"""
+
+# Per-message states: listed but not classified yet, classified, or classification failed
+PENDING, DONE, FAILED = "pending", "done", "failed"
+
+
+class CheckpointStore:
+    """
+    SQLite record of the per-message progress of long-running jobs (triage, cleanup planning, general
+    categorization). Each job name holds one run: its parameters, the messages it covers in listing order,
+    and for each message whether it is pending, done (with its result as JSON) or failed. Every update is
+    committed immediately, so a run stopped by Ctrl-C or a network error can be resumed: done messages
+    are skipped and only pending and failed ones are classified again.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def start_job(self, job: str, params: dict = None, message_ids=()):
+        """Starts a new run of job, discarding the checkpoint of any previous run."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM job_messages WHERE job = ?", (job,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (job, params, finished, started_at, updated_at) VALUES (?, ?, 0, ?, ?)",
+                (job, json.dumps(params or {}), now, now)
+            )
+            self._conn.commit()
+        self.add_messages(job, message_ids)
+
+    def add_messages(self, job: str, message_ids):
+        """Adds messages to a running job as pending (messages it already covers keep their state)."""
+        message_ids = list(message_ids)
+        if not message_ids:
+            return
+        now = time.time()
+        with self._lock:
+            start = self._conn.execute("SELECT COUNT(*) FROM job_messages WHERE job = ?", (job,)).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO job_messages (job, message_id, position, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(job, message_id, start + i, PENDING, now) for i, message_id in enumerate(message_ids)]
+            )
+            self._conn.commit()
+
+    def remove_messages(self, job: str, message_ids):
+        """Drops messages from a job (e.g. messages deleted from Gmail before an interrupted run was resumed)."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM job_messages WHERE job = ? AND message_id = ?", [(job, message_id) for message_id in message_ids])
+            self._conn.commit()
+
+    def update_params(self, job: str, **params):
+        """Merges params into the stored parameters of job (e.g. a history ID known only after fetching)."""
+        with self._lock:
+            row = self._conn.execute("SELECT params FROM jobs WHERE job = ?", (job,)).fetchone()
+            if row is None:
+                return
+            merged = {**json.loads(row["params"]), **params}
+            self._conn.execute("UPDATE jobs SET params = ?, updated_at = ? WHERE job = ?", (json.dumps(merged), time.time(), job))
+            self._conn.commit()
+
+    def mark_done(self, job: str, message_id: str, result: dict):
+        self._set_status(job, message_id, DONE, result=json.dumps(result, ensure_ascii=False))
+
+    def mark_many_done(self, job: str, message_ids, result: dict = None):
+        """Marks messages of job done with the same result in one transaction (e.g. a whole batchModify chunk)."""
+        now = time.time()
+        encoded = json.dumps(result or {}, ensure_ascii=False)
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE job_messages SET status = ?, result = ?, error = NULL, updated_at = ? WHERE job = ? AND message_id = ?",
+                [(DONE, encoded, now, job, message_id) for message_id in message_ids]
+            )
+            self._conn.execute("UPDATE jobs SET updated_at = ? WHERE job = ?", (now, job))
+            self._conn.commit()
+
+    def mark_many_failed(self, job: str, message_ids, error):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE job_messages SET status = ?, error = ?, updated_at = ? WHERE job = ? AND message_id = ?",
+                [(FAILED, str(error), now, job, message_id) for message_id in message_ids]
+            )
+            self._conn.execute("UPDATE jobs SET updated_at = ? WHERE job = ?", (now, job))
+            self._conn.commit()
+
+    def mark_failed(self, job: str, message_id: str, error):
+        self._set_status(job, message_id, FAILED, error=str(error))
+
+    def _set_status(self, job, message_id, status, result=None, error=None):
+        now = time.time()
+        with self._lock:
+            # Messages that were never added (e.g. found while resuming) are appended at the end
+            self._conn.execute(
+                "INSERT OR IGNORE INTO job_messages (job, message_id, position, status, updated_at) "
+                "VALUES (?, ?, (SELECT COUNT(*) FROM job_messages WHERE job = ?), ?, ?)",
+                (job, message_id, job, PENDING, now)
+            )
+            self._conn.execute(
+                "UPDATE job_messages SET status = ?, result = ?, error = ?, updated_at = ? WHERE job = ? AND message_id = ?",
+                (status, result, error, now, job, message_id)
+            )
+            self._conn.execute("UPDATE jobs SET updated_at = ? WHERE job = ?", (now, job))
+            self._conn.commit()
+
+    def finish_job(self, job: str):
+        """Marks the run of job complete; it is no longer offered for resuming."""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET finished = 1, updated_at = ? WHERE job = ?", (time.time(), job))
+            self._conn.commit()
+
+    def get_job(self, job: str):
+        """
+        Returns the checkpoint of the last run of job, or None.
+        Returns:
+            dict: 'params', 'finished' (bool), 'started_at' (ISO string) and 'counts' ({status: message count}).
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job = ?", (job,)).fetchone()
+            if row is None:
+                return None
+            counts = {PENDING: 0, DONE: 0, FAILED: 0}
+            for status, count in self._conn.execute(
+                    "SELECT status, COUNT(*) FROM job_messages WHERE job = ? GROUP BY status", (job,)):
+                counts[status] = count
+        return {
+            "params": json.loads(row["params"]), "finished": bool(row["finished"]),
+            "started_at": datetime.fromtimestamp(row["started_at"]).isoformat(timespec="seconds"), "counts": counts
+        }
+
+    def unfinished_job(self, job: str):
+        """Returns get_job(job) if its last run was interrupted, else None."""
+        state = self.get_job(job)
+        return state if state and not state["finished"] else None
+
+    def pending_ids(self, job: str) -> list:
+        """IDs of the messages of job that still need classifying (pending or failed), in listing order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message_id FROM job_messages WHERE job = ? AND status != ? ORDER BY position", (job, DONE)
+            ).fetchall()
+        return [row["message_id"] for row in rows]
+
+    def done_ids(self, job: str) -> set:
+        """IDs of the messages of job that were classified successfully."""
+        with self._lock:
+            rows = self._conn.execute("SELECT message_id FROM job_messages WHERE job = ? AND status = ?", (job, DONE)).fetchall()
+        return {row["message_id"] for row in rows}
+
+    def iter_results(self, job: str):
+        """Streams the stored results (dicts) of the done messages of job, in listing order, RESULTS_PAGE_SIZE rows at a time."""
+        position = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT position, result FROM job_messages WHERE job = ? AND status = ? AND position > ? "
+                    "ORDER BY position LIMIT ?", (job, DONE, position, RESULTS_PAGE_SIZE)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield json.loads(row["result"])
+            position = rows[-1]["position"]
+
+    def describe(self, job: str) -> str:
+        """One-line progress summary of the last run of job."""
+        state = self.get_job(job)
+        if state is None:
+            return f"no {job} run recorded"
+        counts = state["counts"]
+        return (f"{job} run started {state['started_at']}: {counts[DONE]} done, {counts[FAILED]} failed, "
+                f"{counts[PENDING]} pending")
+
+    def report(self, job: str):
+        print(f"{TermColors.SUMMARY_KEY}Checkpoint:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{self.describe(job)}{TermColors.RESET}")
+
+
+_default_store = None
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    """Returns the process-wide CheckpointStore at CHECKPOINT_FILE, opening it on first use."""
+    global _default_store
+    if _default_store is None:
+        _default_store = CheckpointStore(CHECKPOINT_FILE)
+    return _default_store
+
+
+def confirm_resume(job: str, label: str) -> bool:
+    """
+    If the last run of job was interrupted, asks whether to resume it (interactive runs without --resume).
+    Returns:
+        bool: True if the user chose to resume.
+    """
+    store = get_checkpoint_store()
+    if store.unfinished_job(job) is None:
+        return False
+    answer = input(f"An interrupted {label} run can be resumed ({store.describe(job)}). Resume it? (y/n) [y]: ").lower().strip()
+    return answer != 'n'
@@ -9,8 +9,6 @@ from datetime import datetime # Ensure datetime is imported at the top
 from email_utils import send_email, get_gmail_service, TermColors 
 import sys # For sys.exit in standalone mode
 
-# Load environment variables
-load_dotenv(override=True)
 
 # --- Configuration ---
 SCOPES = ['https://www.googleapis.com/auth/gmail.send', 'https://www.googleapis.com/auth/gmail.readonly'] # Readonly might be useful if script evolves
@@ -240,6 +238,7 @@ def run_reply_drafting(gmail_service, openai_client): # Renamed and added parame
 
 if __name__ == "__main__":
     print(f"{TermColors.BOLD}Running Email Reply Drafting Standalone...{TermColors.RESET}")
+    load_dotenv(override=True) # Load environment variables (cli.py loads them once for every tool)
     # Initialize services for standalone run
     standalone_gmail_service = get_gmail_service(TOKEN_FILE, CREDENTIALS_FILE, SCOPES)
     if not standalone_gmail_service:
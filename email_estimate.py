@@ -0,0 +1,159 @@
+import math
+import time
+import random
+
+from googleapiclient.errors import HttpError
+
+# Import utilities
+from email_utils import TermColors
+from email_fetch import iter_message_ids, fetch_messages, LIST_PAGE_SIZE
+from email_llm_cache import get_llm_cache
+from email_llm_pipeline import LLM_CONCURRENCY, LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_EXPECTED_OUTPUT_TOKENS
+from email_prompt_prep import count_tokens
+
+# --- Configuration ---
+# Emails fetched and rendered into prompts to measure a run (picked at random from the listed emails)
+ESTIMATE_SAMPLE_SIZE = 30
+# Gmail API quota units per call; batched sub-requests are charged like separate calls
+GMAIL_QUOTA_UNITS = {
+    "messages.list": 5, "messages.get": 5, "threads.get": 10, "messages.batchModify": 50,
+    "labels.list": 1, "labels.create": 5,
+}
+# Gmail API quota units a user may spend per second
+GMAIL_QUOTA_UNITS_PER_SECOND = 250
+# USD per million (input, output) tokens. Runs on models missing here are estimated without a cost.
+MODEL_PRICES_PER_MILLION = {
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4": (30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+# Price factor of the OpenAI Batch API (half the synchronous price)
+BATCH_API_PRICE_FACTOR = 0.5
+# Completion tokens per email in a packed request (one short JSON entry); single-email requests are
+# projected at the pipeline's LLM_EXPECTED_OUTPUT_TOKENS reserve, an upper bound
+PACKED_OUTPUT_TOKENS_PER_EMAIL = 60
+# Assumed completion time of one chat request (seconds); LLM_CONCURRENCY requests run at once
+LLM_REQUEST_SECONDS = 4.0
+
+
+def prompt_tokens(messages, model) -> int:
+    """Input tokens of a chat request (see email_prompt_prep.count_tokens)."""
+    return sum(count_tokens(m.get('content') or '', model) for m in messages)
+
+
+def request_cost(model, input_tokens, output_tokens):
+    """USD cost of the given token counts on model, or None if MODEL_PRICES_PER_MILLION does not list it."""
+    prices = MODEL_PRICES_PER_MILLION.get(model)
+    if prices is None:
+        return None
+    return (input_tokens * prices[0] + output_tokens * prices[1]) / 1e6
+
+
+def estimate_run(label, gmail_service, query, fetch_profile, to_item, build_messages, model, prompt_versions, result_type,
+                 max_emails=None, pre_classify=None, pack_size=1, build_packed_messages=None,
+                 gmail_units_per_email=0, fixed_gmail_units=0, batch_api=False, sample_size=ESTIMATE_SAMPLE_SIZE) -> dict:
+    """
+    Projects the cost of a classification run without doing it. The run's query is listed in full (IDs
+    only), a random sample of the listed emails is fetched with the run's fetch profile, and each sampled
+    email goes through the run's rules, the LLM result cache and the real prompt template. The sample's
+    shares and average prompt tokens are scaled up to every listed email.
+    Args:
+        label: Name of the run in the printed estimate.
+        query / max_emails: What the run would list.
+        fetch_profile / to_item: How the run fetches a message and converts it for classification.
+        build_messages / model / prompt_versions / result_type: The run's prompt builder, model, prompt versions
+            (any of which may hold cached results) and result type.
+        pre_classify: The run's rule classifier (item -> result or None).
+        pack_size / build_packed_messages: Emails per request, and the prompt builder for a list of emails, when the run packs prompts.
+        gmail_units_per_email / fixed_gmail_units: Gmail quota the run spends beyond listing and fetching.
+        batch_api: Also report the OpenAI Batch API cost (runs that can use it).
+    Returns:
+        dict: Run summary with 'status' ('ok' or 'error') and 'estimate': True, plus the projected 'emails',
+        'llm_emails', 'requests', 'input_tokens', 'output_tokens', 'cost_usd', 'gmail_quota_units' and 'minutes'.
+    """
+    print(f"{TermColors.STATUS_INFO}Estimating {label}: listing emails with query '{query}'...{TermColors.RESET}")
+    try:
+        started = time.monotonic()
+        message_ids = [stub['id'] for stub in iter_message_ids(gmail_service, query, max_results=max_emails)]
+        list_seconds = time.monotonic() - started
+        total = len(message_ids)
+        summary = {"status": "ok", "estimate": True, "query": query, "emails": total}
+        if not total:
+            print(f"{TermColors.YELLOW}No emails match; the run would have nothing to do.{TermColors.RESET}")
+            return {**summary, "llm_emails": 0, "requests": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0,
+                    "gmail_quota_units": GMAIL_QUOTA_UNITS["messages.list"], "minutes": round(list_seconds / 60, 1)}
+
+        sample_ids = random.sample(message_ids, min(sample_size, total))
+        started = time.monotonic()
+        messages = [msg for msg in fetch_messages(gmail_service, sample_ids, profile=fetch_profile) if msg is not None]
+        fetch_seconds_per_email = (time.monotonic() - started) / len(sample_ids)
+    except HttpError as error:
+        print(f"{TermColors.STATUS_ERROR}An error occurred while sampling emails: {error}{TermColors.RESET}")
+        return {"status": "error", "estimate": True, "error": f"sampling emails failed: {error}"}
+    if not messages:
+        return {"status": "error", "estimate": True, "error": "no sampled email could be fetched"}
+
+    # Classify the sample the way the run would, without calling the model
+    cache = get_llm_cache()
+    items = [to_item(msg) for msg in messages]
+    model_items = [item for item in items if pre_classify is None or pre_classify(item) is None]
+    rule_count = len(items) - len(model_items)
+    llm_items = []
+    for item in model_items:
+        item_messages = build_messages(item)
+        if not any(cache.get(cache.make_key(model, version, item_messages), result_type, count_miss=False) for version in prompt_versions):
+            llm_items.append(item)
+    measured = llm_items or model_items # Token size of a cached email stands in when the whole sample is cached
+    if not measured:
+        tokens_per_email = 0
+    elif pack_size > 1 and build_packed_messages:
+        packs = [measured[i:i + pack_size] for i in range(0, len(measured), pack_size)]
+        tokens_per_email = sum(prompt_tokens(build_packed_messages(pack), model) for pack in packs) / len(measured)
+    else:
+        tokens_per_email = sum(prompt_tokens(build_messages(item), model) for item in measured) / len(measured)
+
+    # Scale the sample up to every listed email
+    llm_emails = round(total * len(llm_items) / len(items))
+    requests = math.ceil(llm_emails / max(1, pack_size))
+    input_tokens = round(llm_emails * tokens_per_email)
+    output_tokens = llm_emails * (PACKED_OUTPUT_TOKENS_PER_EMAIL if pack_size > 1 else LLM_EXPECTED_OUTPUT_TOKENS)
+    cost = request_cost(model, input_tokens, output_tokens)
+    gmail_units = round(math.ceil(total / LIST_PAGE_SIZE) * GMAIL_QUOTA_UNITS["messages.list"]
+                        + total * (GMAIL_QUOTA_UNITS["messages.get"] + gmail_units_per_email) + fixed_gmail_units)
+    gmail_seconds = max(total * fetch_seconds_per_email, gmail_units / GMAIL_QUOTA_UNITS_PER_SECOND)
+    llm_seconds = max(
+        requests * LLM_REQUEST_SECONDS / max(1, LLM_CONCURRENCY),
+        requests / LLM_REQUESTS_PER_MINUTE * 60 if LLM_REQUESTS_PER_MINUTE else 0,
+        (input_tokens + output_tokens) / LLM_TOKENS_PER_MINUTE * 60 if LLM_TOKENS_PER_MINUTE else 0,
+    )
+    minutes = (list_seconds + gmail_seconds + llm_seconds) / 60
+
+    summary.update({
+        "sampled": len(items), "rule_share": round(rule_count / len(items), 2),
+        "cached_share": round((len(model_items) - len(llm_items)) / len(items), 2),
+        "llm_emails": llm_emails, "requests": requests, "prompt_tokens_per_email": round(tokens_per_email),
+        "input_tokens": input_tokens, "output_tokens": output_tokens, "model": model,
+        "cost_usd": round(cost, 4) if cost is not None else None,
+        "gmail_quota_units": gmail_units, "minutes": round(minutes, 1)
+    })
+    if batch_api and cost is not None:
+        summary["batch_api_cost_usd"] = round(cost * BATCH_API_PRICE_FACTOR, 4)
+
+    print(f"\n{TermColors.SUMMARY_HEADER}Estimate for {label} (sampled {len(items)} of {total} emails):{TermColors.RESET}")
+    rows = [
+        ("Emails listed", f"{total}"),
+        ("Decided by rules / cached", f"{summary['rule_share']:.0%} / {summary['cached_share']:.0%}"),
+        (f"Emails sent to {model}", f"{llm_emails} in {requests} requests ({summary['prompt_tokens_per_email']} prompt tokens per email)"),
+        ("Tokens", f"{input_tokens} input + up to {output_tokens} output"),
+        ("Cost", f"${cost:.2f}" if cost is not None else f"unknown (no price for {model} in MODEL_PRICES_PER_MILLION)"),
+        ("Gmail quota units", f"{gmail_units}"),
+        ("Wall time", f"about {minutes:.1f} minutes"),
+    ]
+    if "batch_api_cost_usd" in summary:
+        rows.insert(5, ("Cost with the Batch API", f"${summary['batch_api_cost_usd']:.2f}"))
+    for key, value in rows:
+        print(f"{TermColors.SUMMARY_KEY}{key}:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{value}{TermColors.RESET}")
+    return summary
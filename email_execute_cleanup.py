@@ -1,12 +1,15 @@
 import os
 import json
 from datetime import datetime, timezone
-import base64
 import re
-import requests # For visiting HTTP unsubscribe links
 
 # Import utilities
-from email_utils import get_gmail_service, TermColors, send_email # send_email is not directly used but good to have if needed
+from email_utils import get_gmail_service, granted_scopes, TermColors, send_email # send_email is not directly used but good to have if needed
+from email_unsubscribe import (
+    HttpUnsubscriber, MailtoUnsubscriber, get_unsubscribe_ledger, list_identity, sender_domain, unsubscribe_target,
+    UNSUBSCRIBE_LEDGER_FILE, MAILTO_SENDS_PER_SECOND, NEEDS_MANUAL, FAILED
+)
+from email_fetch import is_retryable_error
 import sys # For sys.exit in standalone mode
 
 # Removed Google specific imports as they are in email_utils
@@ -15,12 +18,9 @@ import sys # For sys.exit in standalone mode
 # from google.oauth2.credentials import Credentials
 # from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError # Keep for local error handling
-from email.mime.text import MIMEText # Keep for send_unsubscribe_email_action
 
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv(override=True)
 
 # TermColors class is now imported from email_utils
 
@@ -36,6 +36,12 @@ CREDENTIALS_FILE = os.path.join(SCRIPT_DIR, "credentials.json")
 
 DELETION_CANDIDATES_JSON_FILE = os.path.join(SCRIPT_DIR, "deletion_candidates.json")
 ACTION_LOG_FILE = os.path.join(SCRIPT_DIR, "cline/action_executor_log.txt")
+# IDs per batchModify / batchDelete call (the Gmail API maximum)
+BULK_CHUNK_SIZE = 1000
+# Permanent deletion (batchDelete / messages.delete) needs full mailbox access; gmail.modify only allows trashing
+PERMANENT_DELETE_SCOPE = 'https://mail.google.com/'
+# Subjects shown per sender group in grouped review
+GROUP_SAMPLE_SUBJECTS = 3
 
 # get_gmail_service function is now imported from email_utils
 
@@ -51,56 +57,46 @@ def log_action(action_details):
     print(action_details)
 
 
-def send_unsubscribe_email_action(service, to_address, original_subject):
-    try:
-        email_body = (
-            f"This is an automated unsubscribe request regarding emails with subjects similar to: \"{original_subject}\".\n\n"
-            "Please remove this email address from your mailing list.\n\n"
-            "If this is an error, please ignore this message.\n"
-            "(This email was sent by an automated script based on user direction.)"
-        )
-        message = MIMEText(email_body)
-        message['to'] = to_address
-        message['subject'] = f"Automated Unsubscribe Request" 
-        
-        create_message = {'raw': base64.urlsafe_b64encode(message.as_bytes()).decode()}
-        sent_message = service.users().messages().send(userId="me", body=create_message).execute()
-        log_action(f"{TermColors.GREEN}SUCCESS: Sent unsubscribe email to {to_address}. Message ID: {sent_message['id']}{TermColors.RESET}")
-        return True
-    except HttpError as error:
-        log_action(f"{TermColors.RED}ERROR sending unsubscribe email to {to_address}: {error}{TermColors.RESET}")
-        return False
-    except Exception as e:
-        log_action(f"{TermColors.RED}UNEXPECTED ERROR sending unsubscribe email to {to_address}: {e}{TermColors.RESET}")
-        return False
+def unsubscribe_mailto_action(service, candidates=()):
+    """
+    Queues unsubscribe emails for the mailing lists of candidates (email_unsubscribe.MailtoUnsubscriber:
+    one email per unsubscribe address, lists already in the ledger skipped) and sends everything queued,
+    including emails left over from earlier runs, within Gmail's send quota.
+    Returns:
+        dict: MailtoUnsubscriber.send summary (plus 'queued'), or None if there was nothing to send.
+    """
+    def log_outcome(address, outcome, detail):
+        color = TermColors.RED if outcome == FAILED else TermColors.GREEN
+        log_action(f"{color}{outcome.upper()}: Unsubscribe email to {address}: {detail}{TermColors.RESET}")
 
-def visit_unsubscribe_link_action(url):
-    try:
-        headers = { 
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10, allow_redirects=True)
-        response.raise_for_status() 
-        
-        if response.status_code == 200:
-            log_action(f"{TermColors.GREEN}SUCCESS: Visited unsubscribe link {url}. Status: {response.status_code}.{TermColors.RESET}")
-            content_sample = response.text[:1024].lower()
-            success_keywords = ["unsubscribed", "removed", "success", "no longer receive", "manage your preferences"]
-            if any(keyword in content_sample for keyword in success_keywords):
-                log_action(f"{TermColors.GREEN}INFO: Unsubscribe page for {url} seems to indicate success.{TermColors.RESET}")
-            else:
-                log_action(f"{TermColors.YELLOW}WARNING: Visited {url}, but success message not detected. Manual check might be needed.{TermColors.RESET}")
-            return True
-        else:
-            log_action(f"{TermColors.YELLOW}INFO: Visited unsubscribe link {url}. Status: {response.status_code}. Might not be a direct unsubscribe.{TermColors.RESET}")
-            return False
-            
-    except requests.exceptions.RequestException as e:
-        log_action(f"{TermColors.RED}ERROR visiting unsubscribe link {url}: {e}{TermColors.RESET}")
-        return False
-    except Exception as e:
-        log_action(f"{TermColors.RED}UNEXPECTED ERROR visiting unsubscribe link {url}: {e}{TermColors.RESET}")
-        return False
+    unsubscriber = MailtoUnsubscriber(service)
+    queued = unsubscriber.enqueue(candidates)
+    if not unsubscriber.pending():
+        return None
+    print(f"\n{TermColors.STATUS_INFO}Sending {unsubscriber.pending()} queued unsubscribe emails "
+          f"(at most {MAILTO_SENDS_PER_SECOND:g} per second)...{TermColors.RESET}")
+    summary = {"queued": queued, **unsubscriber.send(on_outcome=log_outcome)}
+    if summary["stopped"]:
+        log_action(f"{TermColors.YELLOW}Stopped sending unsubscribe emails: {summary['stopped']}. "
+                   f"{summary['remaining']} stay queued for the next run.{TermColors.RESET}")
+    return summary
+
+def unsubscribe_http_action(candidates):
+    """
+    Unsubscribes from the mailing lists of candidates through their HTTP links (email_unsubscribe): once
+    per list, several lists in parallel, one-click where advertised, skipping lists already in the ledger.
+    Returns:
+        dict: HttpUnsubscriber.unsubscribe summary.
+    """
+    def log_outcome(list_key, url, outcome, detail):
+        color = TermColors.RED if outcome == FAILED else TermColors.YELLOW if outcome == NEEDS_MANUAL else TermColors.GREEN
+        log_action(f"{color}{outcome.upper()}: Unsubscribe link {url} ({list_key}): {detail}{TermColors.RESET}")
+
+    summary = HttpUnsubscriber().unsubscribe(candidates, on_outcome=log_outcome)
+    if summary["skipped"]:
+        log_action(f"INFO: Skipped {summary['skipped']} lists already unsubscribed (see {os.path.basename(UNSUBSCRIBE_LEDGER_FILE)}).")
+    get_unsubscribe_ledger().report()
+    return summary
 
 def delete_email_message_action(service, message_id):
     try:
@@ -114,8 +110,183 @@ def delete_email_message_action(service, message_id):
         log_action(f"{TermColors.RED}UNEXPECTED ERROR trashing email ID {message_id}: {e}{TermColors.RESET}")
         return False
 
+def permanently_delete_email_message_action(service, message_id):
+    try:
+        service.users().messages().delete(userId='me', id=message_id).execute()
+        log_action(f"{TermColors.GREEN}SUCCESS: Permanently deleted email ID {message_id}.{TermColors.RESET}")
+        return True
+    except HttpError as error:
+        log_action(f"{TermColors.RED}ERROR deleting email ID {message_id}: {error}{TermColors.RESET}")
+        return False
+    except Exception as e:
+        log_action(f"{TermColors.RED}UNEXPECTED ERROR deleting email ID {message_id}: {e}{TermColors.RESET}")
+        return False
+
+def bulk_delete_email_messages_action(service, message_ids, permanent=False, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Moves emails to trash (batchModify adding TRASH) or, with permanent, deletes them (batchDelete), one
+    API call per chunk of chunk_size IDs. Only a chunk whose bulk call fails is retried with one call per ID,
+    and only for failures one call per ID can get past (an invalid ID, a transient error). After a 401/403
+    that is not a rate limit (e.g. missing scope) every call would fail the same way, so the run stops there.
+    Returns:
+        dict: 'requested', 'succeeded' and 'failed' counts, 'failed_ids', and 'fallback_chunks' (chunks retried per ID).
+    """
+    message_ids = list(dict.fromkeys(message_ids)) # Approving the same email twice must not count it twice
+    verb = "deleted" if permanent else "moved to trash"
+    failed_ids = []
+    fallback_chunks = 0
+    chunk_count = (len(message_ids) + chunk_size - 1) // chunk_size
+    for chunk_number, start in enumerate(range(0, len(message_ids), chunk_size), start=1):
+        chunk = message_ids[start:start + chunk_size]
+        try:
+            if permanent:
+                service.users().messages().batchDelete(userId='me', body={'ids': chunk}).execute()
+            else:
+                service.users().messages().batchModify(userId='me', body={'ids': chunk, 'addLabelIds': ['TRASH']}).execute()
+            log_action(f"{TermColors.GREEN}SUCCESS: Chunk {chunk_number}/{chunk_count}: {len(chunk)} emails {verb}.{TermColors.RESET}")
+            continue
+        except HttpError as error:
+            if error.resp.status in (401, 403) and not is_retryable_error(error):
+                failed_ids.extend(message_ids[start:])
+                log_action(f"{TermColors.RED}ERROR: Chunk {chunk_number}/{chunk_count} was refused ({error}). "
+                           f"Not retrying; {len(message_ids) - start} emails left unchanged.{TermColors.RESET}")
+                break
+            log_action(f"{TermColors.YELLOW}WARNING: Chunk {chunk_number}/{chunk_count} failed ({error}). Retrying its {len(chunk)} emails one at a time...{TermColors.RESET}")
+        fallback_chunks += 1
+        action = permanently_delete_email_message_action if permanent else delete_email_message_action
+        chunk_failed = [message_id for message_id in chunk if not action(service, message_id)]
+        failed_ids.extend(chunk_failed)
+        log_action(f"INFO: Chunk {chunk_number}/{chunk_count}: {len(chunk) - len(chunk_failed)} of {len(chunk)} emails {verb} individually.")
+    return {
+        "requested": len(message_ids), "succeeded": len(message_ids) - len(failed_ids), "failed": len(failed_ids),
+        "failed_ids": failed_ids, "fallback_chunks": fallback_chunks
+    }
+
+def run_bulk_cleanup(gmail_service, candidates, permanent=False, unsubscribe=False):
+    """
+    Applies the cleanup plan without per-email prompts: every candidate is trashed (or, with permanent,
+    deleted) through bulk_delete_email_messages_action. With unsubscribe, the candidates' lists are
+    unsubscribed from first: through their HTTP link where they have one (unsubscribe_http_action), else by
+    email (unsubscribe_mailto_action).
+    """
+    mailto_summary = None
+    if unsubscribe:
+        http_candidates = [candidate for candidate in candidates if candidate.get("list_unsubscribe_http")]
+        if http_candidates:
+            unsubscribe_http_action(http_candidates)
+        mailto_summary = unsubscribe_mailto_action(gmail_service, [candidate for candidate in candidates if not candidate.get("list_unsubscribe_http")])
+    message_ids = [candidate['email_id'] for candidate in candidates]
+    log_action(f"Bulk cleanup: {'permanently deleting' if permanent else 'trashing'} {len(message_ids)} emails in chunks of {BULK_CHUNK_SIZE}.")
+    result = bulk_delete_email_messages_action(gmail_service, message_ids, permanent=permanent)
+    log_action(f"Bulk cleanup finished: {result['succeeded']} of {result['requested']} emails {'deleted' if permanent else 'moved to trash'}, "
+               f"{result['failed']} failed ({result['fallback_chunks']} chunks retried per email).")
+    result["unsubscribe_emails_remaining"] = mailto_summary["remaining"] if mailto_summary else 0
+    return result
+
+# --- Grouped Review ---
+def group_candidates(candidates):
+    """
+    Groups deletion candidates by sender domain and List-Unsubscribe target, largest group first.
+    Returns:
+        list: Dicts with 'domain', 'unsubscribe_target', 'candidates', 'strong' (count), 'sample_subjects',
+        and one 'list_unsubscribe_mailto'/'list_unsubscribe_http' to unsubscribe the whole group with.
+    """
+    groups = {}
+    for candidate in candidates:
+        key = (sender_domain(candidate.get('sender')), unsubscribe_target(candidate))
+        group = groups.setdefault(key, {
+            "domain": key[0], "unsubscribe_target": key[1], "candidates": [], "strong": 0, "sample_subjects": [],
+            "list_unsubscribe_mailto": None, "list_unsubscribe_http": None
+        })
+        group["candidates"].append(candidate)
+        if candidate.get("suggestion") == "strong_candidate":
+            group["strong"] += 1
+        subject = candidate.get("subject") or "No Subject"
+        if len(group["sample_subjects"]) < GROUP_SAMPLE_SUBJECTS and subject not in group["sample_subjects"]:
+            group["sample_subjects"].append(subject)
+        for field in ("list_unsubscribe_mailto", "list_unsubscribe_http"):
+            group[field] = group[field] or candidate.get(field)
+    return sorted(groups.values(), key=lambda group: len(group["candidates"]), reverse=True)
+
+
+def run_grouped_review(gmail_service, candidates):
+    """
+    Reviews candidates per sender group (group_candidates): one decision per group, applied to all its
+    emails with a single bulk operation (bulk_delete_email_messages_action). Unsubscribes are collected
+    during the review and sent together at the end (unsubscribe_http_action, unsubscribe_mailto_action).
+    Returns:
+        dict: 'groups', 'groups_deleted', 'unsubscribed', 'deleted', 'failed' and 'unsubscribe_emails_remaining' counts.
+    """
+    groups = group_candidates(candidates)
+    print(f"{TermColors.STATUS_INFO}{len(candidates)} candidates from {len(groups)} sender groups.{TermColors.RESET}")
+    summary = {"groups": len(groups), "groups_deleted": 0, "unsubscribed": 0, "deleted": 0, "failed": 0, "unsubscribe_emails_remaining": 0}
+    http_unsubscribes = []
+    mailto_unsubscribes = []
+    for i, group in enumerate(groups):
+        count = len(group["candidates"])
+        print(f"\n--- Sender Group {i+1}/{len(groups)}: {count} emails ({group['strong']} strong) ---")
+        print(f"{TermColors.CANDIDATE_INFO}Domain: {group['domain']}{TermColors.RESET}")
+        if group["unsubscribe_target"]:
+            print(f"{TermColors.CANDIDATE_INFO}List-Unsubscribe: {group['unsubscribe_target']}{TermColors.RESET}")
+        for subject in group["sample_subjects"]:
+            print(f"  - {subject}")
+
+        # A sender group can span several lists (e.g. different List-Id headers behind one unsubscribe host)
+        identities = {list_identity(candidate) for candidate in group["candidates"]
+                      if candidate.get("list_unsubscribe_http") or candidate.get("list_unsubscribe_mailto")}
+        pending_identities = {identity for identity in identities if not get_unsubscribe_ledger().is_handled(identity)}
+        can_unsubscribe = bool(pending_identities)
+        if identities and not pending_identities:
+            print(f"{TermColors.STATUS_INFO}  Already unsubscribed from {'this list' if len(identities) == 1 else f'all {len(identities)} lists of this group'}.{TermColors.RESET}")
+        elif len(pending_identities) < len(identities):
+            print(f"{TermColors.STATUS_INFO}  Already unsubscribed from {len(identities) - len(pending_identities)} of the {len(identities)} lists of this group.{TermColors.RESET}")
+        options = "d=delete all, u=unsubscribe and delete all, k=keep, q=stop reviewing" if can_unsubscribe else "d=delete all, k=keep, q=stop reviewing"
+        while True:
+            choice = input(f"{TermColors.PROMPT_DELETE}  Action for these {count} emails? ({options}) [k]: {TermColors.RESET}").lower().strip() or 'k'
+            if choice in ('d', 'k', 'q') or (choice == 'u' and can_unsubscribe):
+                break
+            print("  Invalid input.")
+        if choice == 'q':
+            log_action(f"User stopped grouped review before group {i+1}/{len(groups)}.")
+            break
+        if choice == 'k':
+            log_action(f"User kept {count} emails from {group['domain']}.")
+            continue
+        if choice == 'u':
+            to_unsubscribe = [candidate for candidate in group["candidates"] if list_identity(candidate) in pending_identities]
+            if group["list_unsubscribe_http"]:
+                http_unsubscribes.extend(candidate for candidate in to_unsubscribe if candidate.get("list_unsubscribe_http"))
+            else:
+                mailto_unsubscribes.extend(candidate for candidate in to_unsubscribe if candidate.get("list_unsubscribe_mailto"))
+        result = bulk_delete_email_messages_action(gmail_service, [candidate['email_id'] for candidate in group["candidates"]])
+        summary["groups_deleted"] += 1
+        summary["deleted"] += result["succeeded"]
+        summary["failed"] += result["failed"]
+    if http_unsubscribes:
+        print(f"\n{TermColors.STATUS_INFO}Visiting unsubscribe links...{TermColors.RESET}")
+        unsubscribe_summary = unsubscribe_http_action(http_unsubscribes)
+        summary["unsubscribed"] += unsubscribe_summary["lists"] - unsubscribe_summary[FAILED]
+    mailto_summary = unsubscribe_mailto_action(gmail_service, mailto_unsubscribes)
+    if mailto_summary:
+        summary["unsubscribed"] += mailto_summary["sent"]
+        summary["unsubscribe_emails_remaining"] = mailto_summary["remaining"]
+    return summary
+
 # --- Main Orchestration ---
-def run_cleanup_execution(gmail_service): # Renamed and added parameter
+def run_cleanup_execution(gmail_service, mode=None, include_possible=None, permanent=None, unsubscribe=None): # Renamed and added parameter
+    """
+    Executes the cleanup plan in DELETION_CANDIDATES_JSON_FILE.
+    Args:
+        mode: 'grouped' reviews candidates per sender group (run_grouped_review), 'individual' one email at a
+            time, and 'bulk' applies the plan without prompts (run_bulk_cleanup).
+        include_possible: In bulk mode, also delete the possible candidates (not just the strong ones).
+        permanent: In bulk mode, delete permanently instead of moving to trash (needs PERMANENT_DELETE_SCOPE).
+        unsubscribe: In bulk mode, also unsubscribe from the candidates' lists (HTTP link, else email).
+        Parameters left as None are asked for interactively.
+    Returns:
+        dict: Run summary ('status' is 'ok', 'incomplete' when some deletions failed or unsubscribe emails are
+        still queued, or 'error').
+    """
     print(f"{TermColors.BOLD}Starting Email Action Executor...{TermColors.RESET}")
     log_action("Executor script started.")
 
@@ -123,7 +294,7 @@ def run_cleanup_execution(gmail_service): # Renamed and added parameter
         print(f"{TermColors.RED}ERROR: Deletion plan file not found: {os.path.basename(DELETION_CANDIDATES_JSON_FILE)} (expected in project directory){TermColors.RESET}")
         print(f"Please run the planner script ({TermColors.CYAN}email_plan_cleanup.py{TermColors.RESET}) first.")
         log_action(f"CRITICAL: {os.path.basename(DELETION_CANDIDATES_JSON_FILE)} not found. Exiting.")
-        return
+        return {"status": "error", "error": "deletion plan file not found"}
 
     with open(DELETION_CANDIDATES_JSON_FILE, "r", encoding="utf-8") as f:
         plan = json.load(f)
@@ -135,16 +306,62 @@ def run_cleanup_execution(gmail_service): # Renamed and added parameter
     if not all_candidates:
         print("No deletion candidates found in the plan file.")
         log_action("No candidates in plan file. Exiting.")
-        return
+        return {"status": "ok", "candidates": 0, "deleted": 0, "failed": 0}
 
     print(f"Loaded {len(strong_candidates)} strong and {len(possible_candidates)} possible candidates.")
+    leftover_emails = MailtoUnsubscriber(gmail_service).pending() if gmail_service else 0
+    if leftover_emails:
+        print(f"{TermColors.STATUS_INFO}{leftover_emails} unsubscribe emails queued by an earlier run will be sent at the end of this run.{TermColors.RESET}")
     
     if not gmail_service:
         print(f"{TermColors.STATUS_ERROR}Gmail service not available for cleanup execution. Exiting.{TermColors.RESET}")
         log_action("CRITICAL: Gmail service not provided to run_cleanup_execution. Exiting.")
-        return
+        return {"status": "error", "error": "Gmail service not available"}
+
+    if mode is None:
+        choice = input("Review candidates by sender group (g), one by one (i), or trash them all in bulk without prompts (b)? [g]: ").lower().strip()
+        mode = {'i': 'individual', 'b': 'bulk'}.get(choice, 'grouped')
+    if mode == 'grouped':
+        summary = run_grouped_review(gmail_service, all_candidates)
+        log_action(f"Executor script finished. Deleted {summary['deleted']} emails from {summary['groups_deleted']} of {summary['groups']} sender groups.")
+        print(f"\n{TermColors.BOLD}Email Action Executor finished.{TermColors.RESET}")
+        incomplete = summary["failed"] or summary["unsubscribe_emails_remaining"]
+        return {"status": "incomplete" if incomplete else "ok", "mode": "grouped", "candidates": len(all_candidates), **summary}
+    if mode == 'bulk':
+        asked = include_possible is None or permanent is None or unsubscribe is None
+        if include_possible is None:
+            include_possible = bool(possible_candidates) and input(f"Include the {len(possible_candidates)} possible candidates too? (y/n) [n]: ").lower().strip() == 'y'
+        if permanent is None:
+            scopes = granted_scopes(TOKEN_FILE) or set(SCOPES)
+            if PERMANENT_DELETE_SCOPE not in scopes: # Without it batchDelete only produces 403s; gmail.modify allows trashing
+                print(f"{TermColors.STATUS_INFO}Emails will be moved to trash. Deleting permanently needs full mailbox access, "
+                      f"which the current token does not have.{TermColors.RESET}")
+                if input("Grant full mailbox access now (opens the browser)? (y/n) [n]: ").lower().strip() == 'y':
+                    # Keep every scope the token already has, so other modules do not have to re-authenticate
+                    gmail_service = get_gmail_service(TOKEN_FILE, CREDENTIALS_FILE, sorted(scopes | {PERMANENT_DELETE_SCOPE})) or gmail_service
+            if PERMANENT_DELETE_SCOPE in (granted_scopes(TOKEN_FILE) or ()):
+                permanent = input("Delete permanently instead of moving to trash (cannot be undone)? (y/n) [n]: ").lower().strip() == 'y'
+            else:
+                permanent = False
+        if unsubscribe is None:
+            unsubscribe = input("Also unsubscribe from their mailing lists (once per list)? (y/n) [n]: ").lower().strip() == 'y'
+        candidates = strong_candidates + possible_candidates if include_possible else strong_candidates
+        if asked and input(f"{TermColors.PROMPT_DELETE}{'Permanently delete' if permanent else 'Move to trash'} {len(candidates)} emails? (y/n): {TermColors.RESET}").lower().strip() != 'y':
+            log_action("User cancelled bulk cleanup.")
+            return {"status": "ok", "mode": "bulk", "candidates": len(candidates), "deleted": 0, "failed": 0}
+        result = run_bulk_cleanup(gmail_service, candidates, permanent=permanent, unsubscribe=unsubscribe)
+        print(f"\n{TermColors.BOLD}Email Action Executor finished.{TermColors.RESET}")
+        return {
+            "status": "incomplete" if result["failed"] or result["unsubscribe_emails_remaining"] else "ok", "mode": "bulk",
+            "permanent": permanent, "candidates": len(candidates), "deleted": result["succeeded"], "failed": result["failed"],
+            "fallback_chunks": result["fallback_chunks"], "unsubscribe_emails_remaining": result["unsubscribe_emails_remaining"]
+        }
 
     processed_count = 0
+    approved_ids = [] # Trashed together after the review, BULK_CHUNK_SIZE per API call
+    http_unsubscribes = [] # Unsubscribed together after the review, once per list
+    mailto_unsubscribes = [] # Queued and sent after the review, once per address
+    ledger = get_unsubscribe_ledger()
     for i, candidate in enumerate(all_candidates):
         print(f"\n--- Processing Candidate {i+1}/{len(all_candidates)} ---")
         print(f"{TermColors.CANDIDATE_INFO}Subject: {candidate['subject']}{TermColors.RESET}")
@@ -155,13 +372,16 @@ def run_cleanup_execution(gmail_service): # Renamed and added parameter
         email_id = candidate['email_id']
         actions_taken_for_this_email = False
 
-        if candidate.get("list_unsubscribe_mailto"):
+        list_key = list_identity(candidate)
+        if candidate.get("list_unsubscribe_mailto") and (ledger.is_handled(list_key) or any(list_identity(c) == list_key for c in mailto_unsubscribes)):
+            print(f"{TermColors.STATUS_INFO}  Already unsubscribed from this list by email (or queued).{TermColors.RESET}")
+        elif candidate.get("list_unsubscribe_mailto"):
             mailto_url = candidate["list_unsubscribe_mailto"]
             prompt_text = f"{TermColors.PROMPT_UNSUB_MAIL}  Action: Send unsubscribe email to {mailto_url}? (y/n/s=skip email): {TermColors.RESET}"
             while True:
                 choice = input(prompt_text).lower()
                 if choice == 'y':
-                    send_unsubscribe_email_action(gmail_service, mailto_url, candidate['subject'])
+                    mailto_unsubscribes.append(candidate)
                     actions_taken_for_this_email = True
                     break
                 elif choice == 'n': break
@@ -171,13 +391,15 @@ def run_cleanup_execution(gmail_service): # Renamed and added parameter
                 else: print("  Invalid input. Please enter y, n, or s.")
             if choice == 's': continue
 
-        if candidate.get("list_unsubscribe_http"):
+        if candidate.get("list_unsubscribe_http") and (ledger.is_handled(list_key) or any(list_identity(c) == list_key for c in http_unsubscribes)):
+            print(f"{TermColors.STATUS_INFO}  Already unsubscribed from this list (or queued).{TermColors.RESET}")
+        elif candidate.get("list_unsubscribe_http"):
             http_url = candidate["list_unsubscribe_http"]
             prompt_text = f"{TermColors.PROMPT_UNSUB_HTTP}  Action: Attempt to visit unsubscribe link {http_url}? (y/n/s=skip email): {TermColors.RESET}"
             while True:
                 choice = input(prompt_text).lower()
                 if choice == 'y':
-                    visit_unsubscribe_link_action(http_url)
+                    http_unsubscribes.append(candidate)
                     actions_taken_for_this_email = True
                     break
                 elif choice == 'n': break
@@ -191,7 +413,8 @@ def run_cleanup_execution(gmail_service): # Renamed and added parameter
         while True:
             choice = input(prompt_text).lower()
             if choice == 'y':
-                delete_email_message_action(gmail_service, email_id)
+                approved_ids.append(email_id)
+                log_action(f"Email ID {email_id} approved for deletion.")
                 actions_taken_for_this_email = True
                 break
             elif choice == 'n':
@@ -206,11 +429,26 @@ def run_cleanup_execution(gmail_service): # Renamed and added parameter
 
         processed_count +=1
 
-    log_action(f"Executor script finished. Processed {processed_count} candidates.")
+    if http_unsubscribes:
+        print(f"\n{TermColors.STATUS_INFO}Visiting {len(http_unsubscribes)} approved unsubscribe links...{TermColors.RESET}")
+        unsubscribe_http_action(http_unsubscribes)
+    mailto_summary = unsubscribe_mailto_action(gmail_service, mailto_unsubscribes)
+    result = {"succeeded": 0, "failed": 0}
+    if approved_ids:
+        print(f"\n{TermColors.STATUS_INFO}Moving {len(approved_ids)} approved emails to trash...{TermColors.RESET}")
+        result = bulk_delete_email_messages_action(gmail_service, approved_ids)
+    log_action(f"Executor script finished. Processed {processed_count} candidates, moved {result['succeeded']} emails to trash.")
     print(f"\n{TermColors.BOLD}Email Action Executor finished.{TermColors.RESET}")
+    unsubscribe_emails_remaining = mailto_summary["remaining"] if mailto_summary else 0
+    return {
+        "status": "incomplete" if result["failed"] or unsubscribe_emails_remaining else "ok", "mode": "individual",
+        "candidates": len(all_candidates), "processed": processed_count, "deleted": result["succeeded"], "failed": result["failed"],
+        "unsubscribe_emails_remaining": unsubscribe_emails_remaining
+    }
 
 if __name__ == "__main__":
     print(f"{TermColors.BOLD}Running Email Action Executor Standalone...{TermColors.RESET}")
+    load_dotenv(override=True) # Load environment variables (cli.py loads them once for every tool)
     standalone_gmail_service = get_gmail_service(TOKEN_FILE, CREDENTIALS_FILE, SCOPES)
     if not standalone_gmail_service:
         print(f"{TermColors.STATUS_ERROR}Failed to initialize Gmail service for standalone run. Exiting.{TermColors.RESET}")
@@ -0,0 +1,399 @@
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal, Optional
+
+from googleapiclient.errors import HttpError
+from pydantic import BaseModel, ConfigDict
+
+# Import utilities
+from email_utils import TermColors, clone_gmail_service
+from email_store import FORMAT_RANK, field_paths
+
+# --- Configuration ---
+# Gmail accepts up to 100 calls in a single batch HTTP request
+BATCH_SIZE = 100
+# How many times sub-requests that failed with a retryable error are re-sent
+MAX_BATCH_RETRIES = 4
+# Base delay (seconds) for exponential backoff between retry rounds
+RETRY_BASE_DELAY = 1.0
+# Worker threads for per-message fetching. 0 keeps the batched path in fetch_messages.
+FETCH_WORKERS = 0
+# messages().list page size (the API maximum is 500)
+LIST_PAGE_SIZE = 500
+
+# Partial-response masks for message resources: everything the stages read, minus sizeEstimate (and,
+# for metadata, the body tree)
+MESSAGE_FULL_FIELDS = 'id,threadId,labelIds,snippet,historyId,internalDate,payload'
+MESSAGE_METADATA_FIELDS = 'id,threadId,labelIds,snippet,historyId,internalDate,payload/headers'
+# What a 'minimal' revalidation of a stored message reads (see revalidate_stored)
+MESSAGE_REVALIDATE_FIELDS = 'id,historyId,labelIds'
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+
+def is_retryable_error(error) -> bool:
+    """Returns True for errors worth retrying: 429/5xx and 403 rate-limit responses."""
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    if status in RETRYABLE_STATUS_CODES:
+        return True
+    if status == 403:
+        try:
+            reasons = {detail.get('reason') for detail in (error.error_details or []) if isinstance(detail, dict)}
+        except Exception:
+            reasons = set()
+        return bool(reasons & RATE_LIMIT_REASONS) or 'rateLimitExceeded' in str(error)
+    return False
+
+
+def backoff_delay(attempt: int, base_delay: float = RETRY_BASE_DELAY) -> float:
+    """Exponential backoff with full jitter for the given (1-based) retry attempt."""
+    return random.uniform(0, base_delay * (2 ** (attempt - 1)))
+
+
+def retry_after_seconds(error):
+    """Returns the Retry-After header of an HttpError in seconds, or None."""
+    try:
+        return float(error.resp.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class RateLimitGate:
+    """Shared pause point so that one rate-limited worker slows down the whole pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def wait(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+
+class FetchProfile(BaseModel):
+    """
+    What a stage needs from each message: the Gmail format, the headers to return in 'metadata' format
+    (None = all) and a partial-response `fields` mask (None = the whole resource). Each module declares
+    the profile of its stage and passes it to fetch_messages / iter_fetched_messages.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    format: Literal['minimal', 'metadata', 'full', 'raw'] = 'full'
+    metadata_headers: Optional[tuple] = None
+    fields: Optional[str] = None
+
+    def get_kwargs(self) -> dict:
+        """Arguments for messages().get / threads().get."""
+        kwargs = {'userId': 'me', 'format': self.format}
+        if self.metadata_headers and self.format == 'metadata':
+            kwargs['metadataHeaders'] = list(self.metadata_headers)
+        if self.fields:
+            kwargs['fields'] = self.fields
+        return kwargs
+
+    def merged_with(self, other: 'FetchProfile') -> 'FetchProfile':
+        """
+        Smallest profile covering both, used to upgrade a cached record that does not satisfy a request
+        without losing what the earlier stage fetched. 'raw' does not combine with parsed formats.
+        """
+        if 'raw' in (self.format, other.format):
+            return self
+        format = max(self.format, other.format, key=FORMAT_RANK.get)
+        headers = None
+        if format == 'metadata' and self.metadata_headers and other.metadata_headers:
+            headers = tuple(dict.fromkeys(self.metadata_headers + other.metadata_headers))
+        fields = None
+        if self.fields and other.fields:
+            paths = field_paths(self.fields) | field_paths(other.fields)
+            fields = ','.join(sorted(p for p in paths if not any(p.startswith(c + '/') for c in paths)))
+        return FetchProfile(format=format, metadata_headers=headers, fields=fields)
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def iter_message_pages(service, query, max_results=None, page_size=LIST_PAGE_SIZE, label_ids=None):
+    """
+    Lists messages matching a query, following nextPageToken, and yields one page at a time.
+    Args:
+        service: Authorized Gmail API service instance.
+        query: Gmail search query.
+        max_results: Stop after this many message stubs (None = list everything).
+        page_size: Messages requested per page (max 500).
+        label_ids: Optional label IDs the messages must carry.
+    Yields:
+        list: Message stubs ({'id': ..., 'threadId': ...}) of one page.
+    """
+    page_token = None
+    remaining = max_results
+    while remaining is None or remaining > 0:
+        list_kwargs = {'userId': 'me', 'q': query, 'maxResults': page_size if remaining is None else min(page_size, remaining)}
+        if page_token:
+            list_kwargs['pageToken'] = page_token
+        if label_ids:
+            list_kwargs['labelIds'] = list(label_ids)
+        response = service.users().messages().list(**list_kwargs).execute()
+        messages = response.get('messages', [])
+        if remaining is not None:
+            messages = messages[:remaining]
+            remaining -= len(messages)
+        if messages:
+            yield messages
+        page_token = response.get('nextPageToken')
+        if not page_token or not messages:
+            break
+
+
+def iter_message_ids(service, query, max_results=None, page_size=LIST_PAGE_SIZE, label_ids=None):
+    """Yields message stubs matching a query one by one, page by page (see iter_message_pages)."""
+    for page in iter_message_pages(service, query, max_results=max_results, page_size=page_size, label_ids=label_ids):
+        yield from page
+
+
+def iter_fetched_messages(service, message_stubs, chunk_size=BATCH_SIZE, **fetch_kwargs):
+    """
+    Hydrates a stream of message stubs (or IDs) chunk by chunk, so fetching starts before listing finishes.
+    Only one chunk is held in memory at a time. Messages that could not be fetched are skipped.
+    With workers (or FETCH_WORKERS) above 0, one MessageFetchPool serves every chunk of the stream, so the
+    worker threads and their service objects are created once rather than per chunk.
+    Yields:
+        dict: Message resources, in listing order.
+    """
+    workers = fetch_kwargs.get('workers')
+    workers = FETCH_WORKERS if workers is None else workers
+    own_pool = None
+    if workers > 0 and fetch_kwargs.get('pool') is None:
+        own_pool = fetch_kwargs['pool'] = MessageFetchPool(service, workers)
+    try:
+        chunk = []
+        for stub in message_stubs:
+            chunk.append(stub['id'] if isinstance(stub, dict) else stub)
+            if len(chunk) >= chunk_size:
+                yield from (msg for msg in fetch_messages(service, chunk, **fetch_kwargs) if msg is not None)
+                chunk = []
+        if chunk:
+            yield from (msg for msg in fetch_messages(service, chunk, **fetch_kwargs) if msg is not None)
+    finally:
+        if own_pool is not None:
+            own_pool.close()
+
+
+def fetch_messages(service, message_ids, format='full', metadata_headers=None, fields=None, profile=None,
+                   batch_size=BATCH_SIZE, max_retries=MAX_BATCH_RETRIES, workers=None, store=None, pool=None):
+    """
+    Fetches Gmail messages by ID using batch HTTP requests.
+    Args:
+        service: Authorized Gmail API service instance.
+        message_ids: Message IDs to fetch.
+        format: Gmail message format ('full', 'metadata', 'minimal' or 'raw').
+        metadata_headers: Headers to include when format is 'metadata'.
+        fields: Partial-response mask (e.g. MESSAGE_METADATA_FIELDS).
+        profile: A FetchProfile; replaces format, metadata_headers and fields.
+        batch_size: Number of calls per batch request (max 100).
+        max_retries: How many times to re-send sub-requests that failed with a retryable error.
+        workers: If greater than 0, fetch one message per call on a pool of this many threads instead
+            of batching (see fetch_messages_concurrently). Defaults to FETCH_WORKERS.
+        pool: A MessageFetchPool to run those per-message fetches on (implies the concurrent path).
+        store: Optional email_store.MessageStore. Cached messages are served from it and only
+            missing ones are requested from the API (and then written back). Messages cached with a
+            smaller profile are refetched with the profile covering both, so the store only grows.
+            Cached messages whose labels were last confirmed more than LABELS_FRESH_SECONDS ago are
+            revalidated first (see revalidate_stored).
+    Returns:
+        list: Message resources in the same order as message_ids; None for messages that could not be fetched.
+    """
+    if profile is None:
+        profile = FetchProfile(format=format, metadata_headers=tuple(metadata_headers) if metadata_headers else None, fields=fields)
+    message_ids = list(message_ids)
+    if store is not None:
+        cached = store.get_many(message_ids, format=profile.format, metadata_headers=profile.metadata_headers, fields=profile.fields)
+        changed = revalidate_stored(service, store, store.unconfirmed_ids(list(cached)),
+                                    batch_size=batch_size, max_retries=max_retries, workers=workers, pool=pool)
+        if changed:
+            cached.update(store.get_many(changed, format=profile.format, metadata_headers=profile.metadata_headers, fields=profile.fields))
+        missing = [msg_id for msg_id in message_ids if msg_id not in cached]
+        groups = {} # Profile to fetch with -> IDs
+        stored_profiles = store.get_profiles(missing) if missing else {}
+        for msg_id in missing:
+            stored = stored_profiles.get(msg_id)
+            groups.setdefault(profile.merged_with(FetchProfile(**stored)) if stored else profile, []).append(msg_id)
+        for fetch_profile, ids in groups.items():
+            fetched = fetch_messages(service, ids, profile=fetch_profile,
+                                     batch_size=batch_size, max_retries=max_retries, workers=workers, pool=pool)
+            store.put_many(fetched, format=fetch_profile.format, metadata_headers=fetch_profile.metadata_headers,
+                           fields=fetch_profile.fields)
+            cached.update((msg_id, msg) for msg_id, msg in zip(ids, fetched) if msg is not None)
+        return [cached.get(msg_id) for msg_id in message_ids]
+
+    workers = FETCH_WORKERS if workers is None else workers
+    if pool is not None or workers > 0:
+        return fetch_messages_concurrently(service, message_ids, profile=profile, workers=workers, max_retries=max_retries, pool=pool)
+
+    get_kwargs = profile.get_kwargs()
+    return _batch_get(service, lambda msg_id: service.users().messages().get(id=msg_id, **get_kwargs),
+                      message_ids, 'message', batch_size=batch_size, max_retries=max_retries)
+
+
+def revalidate_stored(service, store, message_ids, **fetch_kwargs) -> list:
+    """
+    Brings the labels of stored messages up to date before they are served, so rules and reports never see
+    labels older than email_store.LABELS_FRESH_SECONDS. Each message is re-read in 'minimal' format (ID, historyId and labels) and
+    updated when its historyId moved, as email_sync.full_resync does. Messages that could not be checked
+    are served as stored.
+    Returns:
+        list: IDs whose stored labels changed.
+    """
+    if not message_ids:
+        return []
+    known = store.get_history_ids(message_ids)
+    current = fetch_messages(service, message_ids, profile=FetchProfile(format='minimal', fields=MESSAGE_REVALIDATE_FIELDS), **fetch_kwargs)
+    changed = []
+    for msg in current:
+        if msg is None:
+            continue
+        if int(msg.get('historyId', 0)) != known.get(msg['id']):
+            store.update_labels(msg['id'], msg.get('labelIds', []), msg.get('historyId'))
+            changed.append(msg['id'])
+    store.mark_current(msg['id'] for msg in current if msg is not None)
+    return changed
+
+
+def fetch_threads(service, thread_ids, format='metadata', metadata_headers=None, fields=None,
+                  batch_size=BATCH_SIZE, max_retries=MAX_BATCH_RETRIES):
+    """
+    Fetches Gmail threads by ID using batch HTTP requests (see fetch_messages).
+    Returns:
+        list: Thread resources in the same order as thread_ids; None for threads that could not be fetched.
+    """
+    get_kwargs = FetchProfile(format=format, metadata_headers=tuple(metadata_headers) if metadata_headers else None,
+                              fields=fields).get_kwargs()
+    return _batch_get(service, lambda thread_id: service.users().threads().get(id=thread_id, **get_kwargs),
+                      list(thread_ids), 'thread', batch_size=batch_size, max_retries=max_retries)
+
+
+def _batch_get(service, make_request, ids, kind, batch_size=BATCH_SIZE, max_retries=MAX_BATCH_RETRIES):
+    """
+    Runs make_request(id) for every ID in batch HTTP requests, re-sending sub-requests that fail with a
+    retryable error after a backoff. Returns results aligned with ids (None where the request failed).
+    """
+    results = {}
+    pending = list(dict.fromkeys(ids)) # De-duplicate while keeping order
+    attempt = 0
+
+    while pending:
+        if attempt:
+            time.sleep(backoff_delay(attempt))
+        retry_ids = []
+
+        for chunk in _chunks(pending, batch_size):
+            errors = {}
+
+            def callback(request_id, response, exception, errors=errors):
+                if exception is not None:
+                    errors[request_id] = exception
+                else:
+                    results[request_id] = response
+
+            batch = service.new_batch_http_request(callback=callback)
+            for item_id in chunk:
+                batch.add(make_request(item_id), request_id=item_id)
+
+            try:
+                batch.execute()
+            except HttpError as error:
+                if is_retryable_error(error):
+                    retry_ids.extend(chunk)
+                else:
+                    print(f"{TermColors.STATUS_ERROR}Batch request for {len(chunk)} {kind}s failed: {error}{TermColors.RESET}")
+                continue
+
+            for item_id, error in errors.items():
+                if is_retryable_error(error):
+                    retry_ids.append(item_id)
+                else:
+                    print(f"{TermColors.STATUS_ERROR}Error fetching {kind} ID {item_id}: {error}{TermColors.RESET}")
+
+        attempt += 1
+        if retry_ids and attempt > max_retries:
+            print(f"{TermColors.STATUS_ERROR}Giving up on {len(retry_ids)} {kind}s after {max_retries} retries.{TermColors.RESET}")
+            break
+        pending = retry_ids
+
+    return [results.get(item_id) for item_id in ids]
+
+
+def fetch_messages_concurrently(service, message_ids, format='full', metadata_headers=None, fields=None, profile=None,
+                                workers=8, max_retries=MAX_BATCH_RETRIES, pool=None):
+    """
+    Fetches Gmail messages one call per message on a bounded thread pool.
+    Each worker thread builds its own service object from the credentials of `service`. Rate-limit
+    responses (429, 403 rateLimitExceeded) pause the whole pool, honouring Retry-After when present.
+    Pass a MessageFetchPool as pool to reuse its threads and services across calls; otherwise one is
+    created for this call.
+    Returns:
+        list: Message resources in the same order as message_ids; None for messages that could not be fetched.
+    """
+    if profile is None:
+        profile = FetchProfile(format=format, metadata_headers=tuple(metadata_headers) if metadata_headers else None, fields=fields)
+    if pool is not None:
+        return pool.fetch(message_ids, profile, max_retries=max_retries)
+    with MessageFetchPool(service, workers) as pool:
+        return pool.fetch(message_ids, profile, max_retries=max_retries)
+
+
+class MessageFetchPool:
+    """
+    Worker threads for fetch_messages_concurrently that live for a whole run. Each thread clones the
+    Gmail service once, and all threads share one RateLimitGate, however many fetch calls the run makes.
+    Use as a context manager, or call close().
+    """
+
+    def __init__(self, service, workers=8):
+        self._service = service
+        self._local = threading.local()
+        self._gate = RateLimitGate()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def fetch(self, message_ids, profile, max_retries=MAX_BATCH_RETRIES) -> list:
+        """Fetches message_ids with profile. Returns resources aligned with message_ids (None where the fetch failed)."""
+        get_kwargs = profile.get_kwargs()
+        return list(self._executor.map(lambda msg_id: self._fetch_one(msg_id, get_kwargs, max_retries), list(message_ids)))
+
+    def _fetch_one(self, msg_id, get_kwargs, max_retries):
+        if not hasattr(self._local, 'service'):
+            self._local.service = clone_gmail_service(self._service)
+        for attempt in range(max_retries + 1):
+            self._gate.wait()
+            try:
+                return self._local.service.users().messages().get(id=msg_id, **get_kwargs).execute()
+            except HttpError as error:
+                if not is_retryable_error(error) or attempt == max_retries:
+                    print(f"{TermColors.STATUS_ERROR}Error fetching message ID {msg_id}: {error}{TermColors.RESET}")
+                    return None
+                delay = retry_after_seconds(error) or backoff_delay(attempt + 1)
+                if error.resp.status in (429, 403):
+                    self._gate.pause(delay)
+                else:
+                    time.sleep(delay)
+        return None
@@ -4,18 +4,24 @@ from datetime import datetime, timedelta, timezone
 from openai import OpenAI
 from pydantic import BaseModel, Field
 from typing import List, Optional, Literal
-import base64
 import re
 
 # Import utilities
 from email_utils import get_gmail_service, TermColors
+from email_fetch import iter_fetched_messages, iter_message_ids, FetchProfile, MESSAGE_METADATA_FIELDS
+from email_store import get_message_store
+from email_sync import get_new_messages, commit_cursor, last_run_time
+from email_llm_cache import get_llm_cache
+from email_llm_pipeline import classify_all, run_chat_completions
+from email_rules import get_rule_engine
+from email_checkpoint import get_checkpoint_store
+from email_estimate import estimate_run, GMAIL_QUOTA_UNITS
 import sys # For sys.exit in standalone mode
 
 from googleapiclient.errors import HttpError
 
 # Load environment variables
 from dotenv import load_dotenv
-load_dotenv(override=True)
 
 # --- Configuration ---
 # Gmail API Scopes needed by THIS script
@@ -58,6 +64,24 @@ MAX_EMAILS_TO_PROCESS = 100 # Increased default slightly
 CATEGORIZATION_REPORT_FILE = os.path.join(SCRIPT_DIR, "categorization_report.md") # Changed to .md
 CATEGORIZED_EMAILS_JSON_FILE = os.path.join(SCRIPT_DIR, "categorized_emails_general.json")
 
+# Cursor name used by incremental (history-based) categorization runs
+CATEGORIZER_SYNC_CONSUMER = "general_categorizer"
+# Checkpoint job name of categorization runs (see email_checkpoint.py)
+CATEGORIZER_CHECKPOINT_JOB = "general_categorizer"
+# Categorization reads only headers, labels and the snippet (which stands in for the body),
+# so messages are fetched in 'metadata' format with a partial-response mask
+CATEGORIZER_FETCH_PROFILE = FetchProfile(
+    format='metadata', metadata_headers=('Subject', 'From', 'List-Unsubscribe'), fields=MESSAGE_METADATA_FIELDS
+)
+
+# Model used for categorization. Bump the prompt version whenever the prompt or parsing changes,
+# so results cached for the old prompt are no longer served.
+CATEGORIZATION_MODEL = "gpt-3.5-turbo" # Cheaper model for bulk analysis
+CATEGORIZATION_PROMPT_VERSION = "categorization-v2"
+# Emails categorized per request in packed mode (1 = one request per email)
+PACKED_PROMPT_SIZE = 10
+CATEGORIZATION_PACKED_PROMPT_VERSION = "categorization-packed-v2"
+
 
 # --- Pydantic Models ---
 class EmailCategorization(BaseModel):
@@ -77,20 +101,261 @@ class EmailDetails(BaseModel):
     sender: str
     received_date: datetime
     snippet: str
-    body_plain: Optional[str] = None
+    label_ids: List[str] = []
+    has_list_unsubscribe: bool = False
+
+
+# --- Email Parsing ---
+def email_details_from_message(msg) -> EmailDetails:
+    """Builds EmailDetails from a full-format Gmail message resource."""
+    msg_id = msg['id']
+    thread_id = msg['threadId']
+    
+    payload = msg.get('payload', {})
+    headers = payload.get('headers', [])
+    
+    subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
+    sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown Sender')
+    
+    internal_date_ms = int(msg.get('internalDate', '0'))
+    received_dt = datetime.fromtimestamp(internal_date_ms / 1000, tz=timezone.utc)
+    
+    snippet = msg.get('snippet', '')
+    return EmailDetails(
+        id=msg_id, thread_id=thread_id, subject=subject, sender=sender,
+        received_date=received_dt, snippet=snippet,
+        label_ids=msg.get('labelIds', []),
+        has_list_unsubscribe=any(h['name'].lower() == 'list-unsubscribe' for h in headers)
+    )
+
+
+# --- AI Categorization ---
+def categorization_messages(email: EmailDetails) -> list:
+    """Builds the chat messages for the categorization of one email."""
+    prompt_text = f"""
+        Categorize the following email into one of these specific categories: {', '.join(CATEGORIES)}.
+        Email Details:
+        Subject: {email.subject}
+        From: {email.sender}
+        Date: {email.received_date.strftime('%Y-%m-%d')}
+        Snippet: {email.snippet}
+
+        Provide a JSON response with:
+        - "category": One of the specified categories.
+        - "reason": Brief explanation for the category.
+        - "confidence": Your confidence (0.0 to 1.0).
+        """
+    return [
+        {"role": "system", "content": f"You are an email categorizer. Classify emails into one of these categories: {', '.join(CATEGORIES)}."},
+        {"role": "user", "content": prompt_text}
+    ]
+
+def _categorization_identity(email: EmailDetails) -> dict:
+    return dict(
+        email_id=email.id, thread_id=email.thread_id, subject=email.subject, sender=email.sender,
+        received_date=email.received_date.isoformat()
+    )
+
+def parse_categorization(email: EmailDetails, content: str) -> EmailCategorization:
+    analysis_data = json.loads(content)
+
+    # Validate category against our list
+    predicted_category = analysis_data.get("category", "Other")
+    if predicted_category not in CATEGORIES:
+         print(f"{TermColors.YELLOW}Warning: AI returned unexpected category '{predicted_category}' for email '{email.subject}'. Defaulting to 'Other'.{TermColors.RESET}")
+         predicted_category = "Other"
+
+    return EmailCategorization(
+        **_categorization_identity(email),
+        category=predicted_category,
+        reason=analysis_data.get("reason", "AI categorization"),
+        confidence=analysis_data.get("confidence")
+    )
+
+def rule_categorization(email: EmailDetails) -> Optional[EmailCategorization]:
+    """Categorizes an email from its headers alone (see email_rules), or returns None to defer to the AI."""
+    verdict = get_rule_engine().classify(
+        email.sender, email.subject, label_ids=email.label_ids,
+        has_list_unsubscribe=email.has_list_unsubscribe, categories=CATEGORIES
+    )
+    if verdict is None:
+        return None
+    return EmailCategorization(
+        **_categorization_identity(email), category=verdict.category,
+        reason=f"Matched rule '{verdict.rule}'.", confidence=1.0
+    )
+
+def categorization_error(email: EmailDetails, error) -> EmailCategorization:
+    print(f"{TermColors.STATUS_ERROR}Error analyzing email ID {email.id} with AI: {error}{TermColors.RESET}")
+    # Keep the email in the report with 'Other' category on error
+    return EmailCategorization(**_categorization_identity(email), category="Other", reason=f"AI analysis failed: {error}")
+
+def packed_categorization_messages(emails: List[EmailDetails]) -> list:
+    """Builds one chat request that categorizes several emails; the instructions are sent only once."""
+    email_blocks = "\n".join(
+        f"""
+        ---
+        ID: {email.id}
+        Subject: {email.subject}
+        From: {email.sender}
+        Date: {email.received_date.strftime('%Y-%m-%d')}
+        Snippet: {email.snippet}"""
+        for email in emails
+    )
+    prompt_text = f"""
+        Categorize each of the following {len(emails)} emails into one of these specific categories: {', '.join(CATEGORIES)}.
+        {email_blocks}
+        ---
+
+        Provide a JSON object with a "results" array containing one entry per email, each with:
+        - "email_id": The ID of the email, exactly as given.
+        - "category": One of the specified categories.
+        - "reason": Brief explanation for the category.
+        - "confidence": Your confidence (0.0 to 1.0).
+        """
+    return [
+        {"role": "system", "content": f"You are an email categorizer. Classify emails into one of these categories: {', '.join(CATEGORIES)}."},
+        {"role": "user", "content": prompt_text}
+    ]
+
+def parse_packed_categorizations(content: str) -> dict:
+    """Returns {email_id: entry} from a packed categorization response (entries are not validated yet)."""
+    data = json.loads(content)
+    entries = data.get("results", []) if isinstance(data, dict) else data
+    return {str(entry.get("email_id")): entry for entry in entries if isinstance(entry, dict)}
+
+def categorize_emails(openai_client, emails: List[EmailDetails], pack_size: int = PACKED_PROMPT_SIZE,
+                      on_result=None, on_failure=None) -> List[EmailCategorization]:
+    """
+    Categorizes emails concurrently (see email_llm_pipeline).
+    With pack_size > 1, pack_size emails are categorized per request. Entries missing from a packed
+    response or failing EmailCategorization validation are re-queried one email per request.
+    on_result, if given, is called with (email, categorization) as soon as each categorization is known, and
+    on_failure with (email, error) for emails whose AI analysis failed (their categorization is the 'Other' fallback).
+    Returns one EmailCategorization per email, in the same order as emails.
+    """
+    rebind = lambda email, cached: cached.model_copy(update=_categorization_identity(email)) # Identical content may come from another message
+    if pack_size <= 1:
+        return classify_all(
+            openai_client, emails, categorization_messages, parse_categorization,
+            CATEGORIZATION_MODEL, CATEGORIZATION_PROMPT_VERSION, EmailCategorization,
+            on_error=categorization_error, rebind=rebind, pre_classify=rule_categorization,
+            on_result=on_result, on_failure=on_failure
+        )
+
+    cache = get_llm_cache()
+    results: List[Optional[EmailCategorization]] = [None] * len(emails)
+
+    def resolve(i, categorization):
+        results[i] = categorization
+        if on_result:
+            on_result(emails[i], categorization)
+
+    pending = [] # (index, cache_key)
+    for i, email in enumerate(emails):
+        categorization = rule_categorization(email)
+        if categorization is not None:
+            resolve(i, categorization)
+            continue
+        # Packed results are cached per email, under the single-email rendering of its content.
+        # Emails that were re-queried individually are cached under the single-email prompt version.
+        messages = categorization_messages(email)
+        cache_key = cache.make_key(CATEGORIZATION_MODEL, CATEGORIZATION_PACKED_PROMPT_VERSION, messages)
+        cached = (cache.get(cache.make_key(CATEGORIZATION_MODEL, CATEGORIZATION_PROMPT_VERSION, messages), EmailCategorization, count_miss=False)
+                  or cache.get(cache_key, EmailCategorization))
+        if cached:
+            resolve(i, rebind(email, cached))
+        else:
+            pending.append((i, cache_key))
+
+    groups = [pending[j:j + pack_size] for j in range(0, len(pending), pack_size)]
+    if groups:
+        print(f"{TermColors.STATUS_INFO}Sending {len(pending)} emails to {CATEGORIZATION_MODEL} in {len(groups)} packed requests ({len(emails) - len(pending)} resolved by rules or cache)...{TermColors.RESET}")
+    contents = run_chat_completions(openai_client, [
+        {'model': CATEGORIZATION_MODEL, 'messages': packed_categorization_messages([emails[i] for i, _ in group]),
+         'response_format': {"type": "json_object"}}
+        for group in groups
+    ])
+
+    requery = []
+    for group, content in zip(groups, contents):
+        try:
+            if isinstance(content, Exception):
+                raise content
+            entries = parse_packed_categorizations(content)
+        except Exception as e:
+            print(f"{TermColors.YELLOW}Packed categorization request failed ({e}). Re-querying its {len(group)} emails individually.{TermColors.RESET}")
+            entries = {}
+        for i, cache_key in group:
+            email = emails[i]
+            entry = entries.get(email.id)
+            try:
+                if entry is None:
+                    raise ValueError("missing from packed response")
+                categorization = EmailCategorization(
+                    **_categorization_identity(email),
+                    category=entry.get("category"), reason=entry.get("reason"), confidence=entry.get("confidence")
+                )
+            except (ValueError, TypeError): # pydantic's ValidationError is a ValueError
+                requery.append(i)
+                continue
+            cache.put(cache_key, categorization)
+            resolve(i, categorization)
+
+    if requery:
+        print(f"{TermColors.YELLOW}{len(requery)} packed entries were missing or invalid. Re-querying them individually...{TermColors.RESET}")
+        singles = classify_all(
+            openai_client, [emails[i] for i in requery], categorization_messages, parse_categorization,
+            CATEGORIZATION_MODEL, CATEGORIZATION_PROMPT_VERSION, EmailCategorization,
+            on_error=categorization_error, rebind=rebind, on_result=on_result, on_failure=on_failure
+        )
+        for i, categorization in zip(requery, singles):
+            results[i] = categorization
+    return results
 
 
 # --- Main Logic ---
-def run_general_categorization(gmail_service, openai_client): # Renamed and added parameters
+def categorization_query(hours):
+    """Gmail search query for emails received in the last hours hours, excluding Spam and Trash."""
+    cutoff_date = datetime.now(timezone.utc) - timedelta(hours=hours)
+    return f'after:{cutoff_date.strftime("%Y/%m/%d %H:%M")} -in:spam -in:trash' # Include time for more precision
+
+def run_general_categorization(gmail_service, openai_client, incremental=False, resume=False,
+                               hours=FETCH_TIMEFRAME_HOURS, max_emails=MAX_EMAILS_TO_PROCESS, estimate=False): # Renamed and added parameters
+    """
+    Categorizes and labels recent emails (the last hours hours, up to max_emails).
+    With incremental=True, only emails that arrived since the last incremental run are processed
+    (via the Gmail history API) instead, still at most max_emails of them.
+    With resume=True, continues the interrupted run recorded in the checkpoint database instead: emails it
+    already categorized keep their stored categories, and only failed and not-yet-categorized ones are sent again.
+    With estimate=True, only projects the run's cost and duration from a sample (email_estimate); nothing is
+    categorized or labeled and no OpenAI client is needed. Incremental runs are estimated over the time since the last run.
+    Returns:
+        dict: Run summary ('status' is 'ok', 'incomplete' when some emails failed, or 'error').
+    """
     print(f"{TermColors.BOLD}Starting Email General Categorizer...{TermColors.RESET}")
 
     if not gmail_service:
         print(f"{TermColors.STATUS_ERROR}Gmail service not available for general categorizer. Exiting.{TermColors.RESET}")
-        return
+        return {"status": "error", "error": "Gmail service not available"}
     
+    if estimate:
+        last_run = last_run_time(CATEGORIZER_SYNC_CONSUMER) if incremental else None
+        if last_run:
+            hours = max(1, int((datetime.now() - last_run).total_seconds() // 3600) + 1)
+        return estimate_run(
+            "general categorization", gmail_service, categorization_query(hours), CATEGORIZER_FETCH_PROFILE,
+            email_details_from_message, categorization_messages, CATEGORIZATION_MODEL,
+            (CATEGORIZATION_PROMPT_VERSION, CATEGORIZATION_PACKED_PROMPT_VERSION), EmailCategorization,
+            max_emails=max_emails, pre_classify=rule_categorization,
+            pack_size=PACKED_PROMPT_SIZE, build_packed_messages=packed_categorization_messages,
+            # Labels are applied with one batchModify call per 100 emails of a category
+            gmail_units_per_email=GMAIL_QUOTA_UNITS["messages.batchModify"] / 100, fixed_gmail_units=GMAIL_QUOTA_UNITS["labels.list"]
+        )
+
     if not openai_client:
         print(f"{TermColors.STATUS_ERROR}OpenAI client not available for general categorizer. Exiting.{TermColors.RESET}")
-        return
+        return {"status": "error", "error": "OpenAI client not available"}
 
     # openai_client = OpenAI() # Use passed-in client
 
@@ -113,159 +378,106 @@ def run_general_categorization(gmail_service, openai_client): # Renamed and adde
 
     except HttpError as error:
         print(f'{TermColors.STATUS_ERROR}An error occurred while getting or creating labels: {error}{TermColors.RESET}')
-        return
+        return {"status": "error", "error": f"getting or creating labels failed: {error}"}
     
     if len(label_ids) != len(LABELS_TO_APPLY):
          print(f"{TermColors.STATUS_ERROR}Could not find or create all required labels. Cannot proceed with labeling. Exiting.{TermColors.RESET}")
          # We could still proceed with just categorization report if desired, but for now, exit.
-         return
+         return {"status": "error", "error": "could not find or create all required labels"}
 
 
-    # 2. Fetch recent emails
+    # 2. Fetch recent emails (or, when resuming, the emails the interrupted run had not categorized yet)
+    store = get_checkpoint_store()
     fetched_emails: List[EmailDetails] = []
-    cutoff_date = datetime.now(timezone.utc) - timedelta(hours=FETCH_TIMEFRAME_HOURS)
-    # Fetch emails received after the cutoff date, excluding Spam and Trash
-    query = f'after:{cutoff_date.strftime("%Y/%m/%d %H:%M")} -in:spam -in:trash' # Include time for more precision
-
-    print(f"\n{TermColors.STATUS_INFO}Fetching emails with query: '{query}' (up to {MAX_EMAILS_TO_PROCESS} emails){TermColors.RESET}")
+    previous_categorizations: List[EmailCategorization] = []
+    sync_history_id = None
+    query = categorization_query(hours)
+
+    if resume:
+        checkpoint = store.unfinished_job(CATEGORIZER_CHECKPOINT_JOB)
+        if checkpoint is None:
+            print(f"{TermColors.YELLOW}No interrupted categorization run to resume.{TermColors.RESET}")
+            return {"status": "error", "error": "no interrupted categorization run to resume"}
+        sync_history_id = checkpoint["params"].get("sync_history_id")
+        message_ids = store.pending_ids(CATEGORIZER_CHECKPOINT_JOB)
+        print(f"\n{TermColors.STATUS_INFO}Resuming {store.describe(CATEGORIZER_CHECKPOINT_JOB)}. Fetching {len(message_ids)} emails...{TermColors.RESET}")
+        try:
+            for msg in iter_fetched_messages(gmail_service, message_ids, profile=CATEGORIZER_FETCH_PROFILE, store=get_message_store()):
+                fetched_emails.append(email_details_from_message(msg))
+        except HttpError as error:
+            print(f'{TermColors.STATUS_ERROR}An error occurred fetching emails: {error}{TermColors.RESET}')
+            return {"status": "error", "error": f"fetching emails failed: {error}"}
+        fetched_ids = {email.id for email in fetched_emails}
+        store.remove_messages(CATEGORIZER_CHECKPOINT_JOB, [message_id for message_id in message_ids if message_id not in fetched_ids]) # No longer in Gmail
+        previous_categorizations = [EmailCategorization(**result) for result in store.iter_results(CATEGORIZER_CHECKPOINT_JOB)]
+    elif incremental:
+        print(f"\n{TermColors.STATUS_INFO}Syncing emails that arrived since the last categorization run...{TermColors.RESET}")
+        try:
+            new_messages, sync_history_id = get_new_messages(gmail_service, CATEGORIZER_SYNC_CONSUMER, profile=CATEGORIZER_FETCH_PROFILE,
+                                                             max_messages=max_emails, first_run_hours=hours)
+            fetched_emails = [email_details_from_message(msg) for msg in new_messages]
+        except HttpError as error:
+            print(f'{TermColors.STATUS_ERROR}An error occurred syncing new emails: {error}{TermColors.RESET}')
+            generate_categorization_reports([], CATEGORIES, label_ids)
+            return {"status": "error", "error": f"syncing new emails failed: {error}"}
+    else:
+        print(f"\n{TermColors.STATUS_INFO}Fetching emails with query: '{query}' (up to {max_emails} emails){TermColors.RESET}")
 
-    try:
-        response = gmail_service.users().messages().list(
-            userId='me',
-            q=query,
-            maxResults=MAX_EMAILS_TO_PROCESS
-        ).execute()
-        
-        messages_info = response.get('messages', [])
+        try:
+            messages_info = list(iter_message_ids(gmail_service, query, max_results=max_emails)) # Follows pagination
         
-        if not messages_info:
-            print(f"{TermColors.YELLOW}No emails found matching the criteria.{TermColors.RESET}")
-            # Still generate empty reports
-            generate_categorization_reports([], CATEGORIES, label_ids)
-            return
+            if not messages_info:
+                print(f"{TermColors.YELLOW}No emails found matching the criteria.{TermColors.RESET}")
+                # Still generate empty reports
+                generate_categorization_reports([], CATEGORIES, label_ids)
+                return {"status": "ok", "analyzed": 0, "labeled": 0, "failed": 0}
 
-        print(f"{TermColors.STATUS_INFO}Found {len(messages_info)} email messages. Fetching details...{TermColors.RESET}")
+            print(f"{TermColors.STATUS_INFO}Found {len(messages_info)} email messages. Fetching details...{TermColors.RESET}")
         
-        for i, msg_info in enumerate(messages_info):
-            if i % 20 == 0 and i > 0:
-                print(f"{TermColors.STATUS_INFO}Fetched details for {i}/{len(messages_info)} emails...{TermColors.RESET}")
-
-            msg_id = msg_info['id']
-            thread_id = msg_info['threadId']
-            msg = gmail_service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-            
-            payload = msg.get('payload', {})
-            headers = payload.get('headers', [])
-            
-            subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-            sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown Sender')
-            
-            internal_date_ms = int(msg.get('internalDate', '0'))
-            received_dt = datetime.fromtimestamp(internal_date_ms / 1000, tz=timezone.utc)
-            
-            snippet = msg.get('snippet', '')
-            body_plain_content = ""
-
-            if 'parts' in payload:
-                for part in payload['parts']:
-                    if part['mimeType'] == 'text/plain':
-                        body_data = part['body'].get('data')
-                        if body_data:
-                            body_plain_content += base64.urlsafe_b64decode(body_data).decode('utf-8', errors='replace')
-                        break 
-            elif 'body' in payload and payload['body'].get('data') and payload.get('mimeType') == 'text/plain':
-                body_data = payload['body']['data']
-                body_plain_content = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='replace')
-
-            fetched_emails.append(EmailDetails(
-                id=msg_id, thread_id=thread_id, subject=subject, sender=sender,
-                received_date=received_dt, snippet=snippet,
-                body_plain=body_plain_content.strip() if body_plain_content else snippet
-            ))
-        print(f"{TermColors.STATUS_SUCCESS}Successfully fetched details for {len(fetched_emails)} emails.{TermColors.RESET}")
+            for msg in iter_fetched_messages(gmail_service, messages_info, profile=CATEGORIZER_FETCH_PROFILE, store=get_message_store()):
+                fetched_emails.append(email_details_from_message(msg))
+            print(f"{TermColors.STATUS_SUCCESS}Successfully fetched details for {len(fetched_emails)} emails.{TermColors.RESET}")
 
-    except HttpError as error:
-        print(f'{TermColors.STATUS_ERROR}An error occurred fetching emails: {error}{TermColors.RESET}')
-        # Still generate empty reports on error
-        generate_categorization_reports([], CATEGORIES, label_ids)
-        return
+        except HttpError as error:
+            print(f'{TermColors.STATUS_ERROR}An error occurred fetching emails: {error}{TermColors.RESET}')
+            # Still generate empty reports on error
+            generate_categorization_reports([], CATEGORIES, label_ids)
+            return {"status": "error", "error": f"fetching emails failed: {error}"}
     
-    if not fetched_emails:
+
+    if not fetched_emails and not previous_categorizations:
         print(f"{TermColors.YELLOW}No emails fetched for analysis. Exiting.{TermColors.RESET}")
         generate_categorization_reports([], CATEGORIES, label_ids)
-        return
+        store.finish_job(CATEGORIZER_CHECKPOINT_JOB)
+        if sync_history_id is not None:
+            commit_cursor(CATEGORIZER_SYNC_CONSUMER, sync_history_id)
+        return {"status": "ok", "analyzed": 0, "labeled": 0, "failed": 0}
+    if not resume:
+        store.start_job(CATEGORIZER_CHECKPOINT_JOB, {"sync_history_id": sync_history_id}, [email.id for email in fetched_emails])
 
 
     # 3. AI Categorization and Labeling
-    categorized_emails: List[EmailCategorization] = []
-    emails_to_label = {} # {label_id: [email_id, ...]}
+    emails_to_label = {} # {label_name: [email_id, ...]}
 
     print(f"\n{TermColors.STATUS_INFO}Analyzing {len(fetched_emails)} emails for categorization and applying labels...{TermColors.RESET}")
 
-    for i, email in enumerate(fetched_emails):
-        if i % 10 == 0 and i > 0:
-            print(f"{TermColors.STATUS_INFO}Analyzed {i}/{len(fetched_emails)} emails...{TermColors.RESET}")
-
-        # Send to AI for categorization
-        prompt_text = f"""
-        Categorize the following email into one of these specific categories: {', '.join(CATEGORIES)}.
-        Email Details:
-        Subject: {email.subject}
-        From: {email.sender}
-        Date: {email.received_date.strftime('%Y-%m-%d')}
-        Snippet: {email.snippet}
-        Body (first 200 chars): {email.body_plain[:200] if email.body_plain else ""}
-
-        Provide a JSON response with:
-        - "category": One of the specified categories.
-        - "reason": Brief explanation for the category.
-        - "confidence": Your confidence (0.0 to 1.0).
-        """
-        try:
-            response = openai_client.chat.completions.create(
-                model="gpt-3.5-turbo", # Cheaper model for bulk analysis
-                messages=[
-                    {"role": "system", "content": f"You are an email categorizer. Classify emails into one of these categories: {', '.join(CATEGORIES)}."},
-                    {"role": "user", "content": prompt_text}
-                ],
-                response_format={"type": "json_object"}
-            )
-            analysis_data = json.loads(response.choices[0].message.content)
-            
-            # Validate category against our list
-            predicted_category = analysis_data.get("category", "Other")
-            if predicted_category not in CATEGORIES:
-                 print(f"{TermColors.YELLOW}Warning: AI returned unexpected category '{predicted_category}' for email '{email.subject}'. Defaulting to 'Other'.{TermColors.RESET}")
-                 predicted_category = "Other"
-
-            categorization = EmailCategorization(
-                email_id=email.id, thread_id=email.thread_id, subject=email.subject, sender=email.sender,
-                received_date=email.received_date.isoformat(),
-                category=predicted_category,
-                reason=analysis_data.get("reason", "AI categorization"),
-                confidence=analysis_data.get("confidence")
-            )
-            categorized_emails.append(categorization)
-
-            # Prepare for labeling if the category is in our LABELS_TO_APPLY list
-            if predicted_category in LABELS_TO_APPLY:
-                label_id = label_ids.get(predicted_category)
-                if label_id:
-                    if label_id not in emails_to_label:
-                        emails_to_label[label_id] = []
-                    emails_to_label[label_id].append(email.id)
-                    # print(f"Prepared to label email {email.id} with '{predicted_category}' ({label_id})") # Debugging print
+    # Emails are categorized concurrently; each result is checkpointed as soon as it is known
+    record_categorization = lambda email, categorization: store.mark_done(CATEGORIZER_CHECKPOINT_JOB, email.id, categorization.model_dump(mode="json"))
+    record_failure = lambda email, error: store.mark_failed(CATEGORIZER_CHECKPOINT_JOB, email.id, error) # Retried by --resume
+    categorized_emails = previous_categorizations + categorize_emails(
+        openai_client, fetched_emails, on_result=record_categorization, on_failure=record_failure
+    )
 
-        except Exception as e:
-            print(f"{TermColors.STATUS_ERROR}Error analyzing email ID {email.id} with AI: {e}{TermColors.RESET}")
-            # Add to categorized_emails with 'Other' category on error
-            categorized_emails.append(EmailCategorization(
-                 email_id=email.id, thread_id=email.thread_id, subject=email.subject, sender=email.sender,
-                 received_date=email.received_date.isoformat(),
-                 category="Other", reason=f"AI analysis failed: {e}"
-            ))
+    for categorization in categorized_emails:
+        # Prepare for labeling if the category is in our LABELS_TO_APPLY list
+        if categorization.category in LABELS_TO_APPLY:
+            if label_ids.get(categorization.category):
+                emails_to_label.setdefault(categorization.category, []).append(categorization.email_id)
 
     print(f"{TermColors.STATUS_SUCCESS}AI categorization complete.{TermColors.RESET}")
+    get_llm_cache().report()
+    get_rule_engine().report()
+    store.report(CATEGORIZER_CHECKPOINT_JOB)
 
     # 4. Apply labels in batches
     print(f"\n{TermColors.STATUS_INFO}Applying labels to emails...{TermColors.RESET}")
@@ -303,8 +515,24 @@ def run_general_categorization(gmail_service, openai_client): # Renamed and adde
 
     # 5. Generate reports
     generate_categorization_reports(categorized_emails, CATEGORIES, label_ids)
+    category_counts = {category: 0 for category in CATEGORIES}
+    for categorization in categorized_emails:
+        category_counts[categorization.category] = category_counts.get(categorization.category, 0) + 1
+    summary = {
+        "status": "ok", "analyzed": len(categorized_emails), "labeled": total_labeled_count,
+        "categories": category_counts, "failed": len(store.pending_ids(CATEGORIZER_CHECKPOINT_JOB))
+    }
+
+    if summary["failed"]:
+        print(f"{TermColors.YELLOW}Some emails could not be categorized. Run general categorization with --resume to retry them.{TermColors.RESET}")
+        summary["status"] = "incomplete"
+    else:
+        store.finish_job(CATEGORIZER_CHECKPOINT_JOB)
+        if sync_history_id is not None:
+            commit_cursor(CATEGORIZER_SYNC_CONSUMER, sync_history_id) # Next incremental run starts after these emails
 
     print(f"\n{TermColors.BOLD}Email General Categorizer finished.{TermColors.RESET}")
+    return summary
 
 
 # --- Reporting ---
@@ -370,6 +598,7 @@ def generate_categorization_reports(categorized_emails: List[EmailCategorization
 
 if __name__ == "__main__":
     print(f"{TermColors.BOLD}Running Email General Categorizer Standalone...{TermColors.RESET}")
+    load_dotenv(override=True) # Load environment variables (cli.py loads them once for every tool)
     standalone_gmail_service = get_gmail_service(TOKEN_FILE, CREDENTIALS_FILE, SCOPES)
     if not standalone_gmail_service:
         print(f"{TermColors.STATUS_ERROR}Failed to initialize Gmail service for standalone run. Exiting.{TermColors.RESET}")
@@ -382,4 +611,5 @@ if __name__ == "__main__":
         print(f"{TermColors.STATUS_ERROR}Failed to initialize OpenAI client for standalone run: {e}{TermColors.RESET}")
         sys.exit(1)
         
-    run_general_categorization(standalone_gmail_service, standalone_openai_client)
+    run_general_categorization(standalone_gmail_service, standalone_openai_client, resume="--resume" in sys.argv[1:],
+                               estimate="--estimate" in sys.argv[1:])
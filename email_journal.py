@@ -0,0 +1,88 @@
+import os
+import json
+
+
+class ResultJournal:
+    """
+    Append-only JSONL journal of classification results. Each result is written (and flushed) as soon as
+    it is known, so an interrupted run keeps everything classified so far, and reports are rendered by
+    streaming the journal instead of holding every result in memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def reset(self):
+        """Starts a new, empty journal."""
+        open(self.path, "w", encoding="utf-8").close()
+
+    def append(self, entry: dict):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+
+    def extend(self, entries):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+
+    def _iter_lines(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                if not line.endswith(b"\n"):
+                    break # Partial last line of an interrupted write
+                if line.strip():
+                    yield offset, line
+
+    def __iter__(self):
+        """Streams the journal entries in the order they were appended."""
+        for _, line in self._iter_lines():
+            yield json.loads(line)
+
+    def __len__(self):
+        return sum(1 for _ in self._iter_lines())
+
+    def iter_sorted(self, key, where=None, reverse=False):
+        """
+        Streams entries ordered by key(entry), optionally only those where where(entry) is true. Only the
+        sort keys and file offsets are held in memory; entries are re-read one at a time.
+        """
+        index = []
+        for offset, line in self._iter_lines():
+            entry = json.loads(line)
+            if where is None or where(entry):
+                index.append((key(entry), offset))
+        index.sort(key=lambda pair: pair[0], reverse=reverse)
+        with open(self.path, "rb") as f:
+            for _, offset in index:
+                f.seek(offset)
+                yield json.loads(f.readline())
+
+
+def write_json_report(path: str, fields: dict, lists: dict):
+    """
+    Writes a JSON object with the scalar fields followed by one array per item of lists (name -> iterable
+    of entries), streaming each array so it never has to be built in memory.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{\n")
+        members = [f"  {json.dumps(name)}: {json.dumps(value)}" for name, value in fields.items()]
+        f.write(",\n".join(members))
+        separator = ",\n" if members else ""
+        for name, entries in lists.items():
+            f.write(f"{separator}  {json.dumps(name)}: [")
+            separator = ",\n"
+            first = True
+            for entry in entries:
+                f.write("\n" if first else ",\n")
+                f.write("    " + json.dumps(entry, indent=2, ensure_ascii=False).replace("\n", "\n    "))
+                first = False
+            f.write("]" if first else "\n  ]")
+        f.write("\n}\n")
@@ -0,0 +1,88 @@
+import json
+import time
+
+# Import utilities
+from email_utils import TermColors
+
+# --- Configuration ---
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+# Seconds between status checks while waiting for a batch
+BATCH_POLL_INTERVAL = 30
+BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def write_batch_file(path, requests):
+    """
+    Writes chat completion requests as an OpenAI Batch API input file.
+    Args:
+        path: JSONL file to write.
+        requests: Iterable of (custom_id, body) pairs; body holds the chat.completions.create arguments.
+    Returns:
+        int: Number of requests written.
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, body in requests:
+            f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}) + "\n")
+            count += 1
+    return count
+
+
+def submit_batch(client, path, description=None) -> str:
+    """Uploads a batch input file and creates the batch job. Returns the batch ID."""
+    with open(path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window=BATCH_COMPLETION_WINDOW,
+        metadata={"description": description} if description else None
+    )
+    print(f"{TermColors.STATUS_SUCCESS}Submitted batch {batch.id} ({BATCH_COMPLETION_WINDOW} completion window).{TermColors.RESET}")
+    return batch.id
+
+
+def wait_for_batch(client, batch_id, poll_interval=BATCH_POLL_INTERVAL, timeout=None):
+    """
+    Polls a batch until it reaches a final status or timeout seconds have passed.
+    Returns:
+        The latest Batch object (check .status).
+    """
+    start = time.monotonic()
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        progress = f" ({counts.completed + counts.failed}/{counts.total} requests done)" if counts else ""
+        print(f"{TermColors.STATUS_INFO}Batch {batch_id}: {batch.status}{progress}{TermColors.RESET}")
+        if batch.status in BATCH_FINAL_STATUSES:
+            return batch
+        if timeout is not None and time.monotonic() - start + poll_interval > timeout:
+            return batch
+        time.sleep(poll_interval)
+
+
+def _read_file_lines(client, file_id):
+    if not file_id:
+        return []
+    return [json.loads(line) for line in client.files.content(file_id).text.splitlines() if line.strip()]
+
+
+def download_batch_results(client, batch) -> dict:
+    """
+    Reads the output and error files of a finished batch.
+    Returns:
+        dict: {custom_id: message content string, or an Exception for requests that failed}.
+    """
+    results = {}
+    for record in _read_file_lines(client, batch.output_file_id) + _read_file_lines(client, batch.error_file_id):
+        custom_id = record.get("custom_id")
+        response = record.get("response") or {}
+        error = record.get("error")
+        if error or response.get("status_code", 200) != 200:
+            message = (error or {}).get("message") or json.dumps(response.get("body", {}).get("error", response))
+            results[custom_id] = RuntimeError(f"Batch request failed: {message}")
+            continue
+        try:
+            results[custom_id] = response["body"]["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError) as e:
+            results[custom_id] = RuntimeError(f"Malformed batch response: {e}")
+    return results
@@ -0,0 +1,166 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+
+# Import utilities
+from email_utils import TermColors
+
+# Determine the absolute path to THIS script's directory
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+LLM_CACHE_FILE = os.path.join(SCRIPT_DIR, "llm_cache.sqlite3")
+
+# --- Configuration ---
+# Cached results older than this are treated as misses and dropped
+LLM_CACHE_TTL_SECONDS = 30 * 24 * 3600
+# Least recently used entries beyond this count are evicted
+LLM_CACHE_MAX_ENTRIES = 20000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_results (
+    cache_key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    result_type TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_results_last_used ON llm_results(last_used_at);
+"""
+
+
+def normalize_content(text: str) -> str:
+    """Normalizes prompt text so insignificant differences (Unicode forms, whitespace) hash the same."""
+    text = unicodedata.normalize('NFC', text or '')
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def content_hash(messages) -> str:
+    """SHA-256 of the normalized chat messages (a list of {'role', 'content'} dicts, or a single string)."""
+    if isinstance(messages, str):
+        messages = [{'role': 'user', 'content': messages}]
+    normalized = [[m.get('role', ''), normalize_content(m.get('content', ''))] for m in messages]
+    return hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class LLMResultCache:
+    """
+    Persistent cache of validated classifier results, keyed by (model, prompt template version, content hash).
+    Results are stored as the pydantic model's JSON and re-validated on read. Entries expire after ttl_seconds
+    and the least recently used ones are evicted beyond max_entries.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_FILE, ttl_seconds: float = LLM_CACHE_TTL_SECONDS,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+        self.evict()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def make_key(model: str, prompt_version: str, messages) -> str:
+        """Builds the cache key for a classifier call from its model, prompt version and prompt messages."""
+        return f"{model}|{prompt_version}|{content_hash(messages)}"
+
+    def get(self, cache_key: str, result_type, count_miss: bool = True):
+        """
+        Returns the cached result as a result_type instance, or None (counted as a miss unless count_miss
+        is False, for callers that try several keys for one lookup).
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, result_type, created_at FROM llm_results WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if row is not None and (now - row['created_at'] > self.ttl_seconds or row['result_type'] != result_type.__name__):
+                self._conn.execute("DELETE FROM llm_results WHERE cache_key = ?", (cache_key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += count_miss
+                return None
+            self._conn.execute("UPDATE llm_results SET last_used_at = ? WHERE cache_key = ?", (now, cache_key))
+            self._conn.commit()
+        try:
+            result = result_type.model_validate_json(row['result'])
+        except ValueError: # Stored result no longer matches the model (e.g. a field was added)
+            with self._lock:
+                self.misses += count_miss
+            return None
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, cache_key: str, result):
+        """Stores a validated pydantic result under cache_key."""
+        model, prompt_version, digest = cache_key.split('|', 2)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_results (cache_key, model, prompt_version, content_hash, result_type, "
+                "result, created_at, last_used_at) VALUES (?,?,?,?,?,?,?,?)",
+                (cache_key, model, prompt_version, digest, type(result).__name__, result.model_dump_json(), now, now)
+            )
+            self._conn.commit()
+            over_limit = self._conn.execute("SELECT COUNT(*) FROM llm_results").fetchone()[0] > self.max_entries
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        """Drops expired entries, then the least recently used ones beyond max_entries."""
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_results WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM llm_results WHERE cache_key IN ("
+                "SELECT cache_key FROM llm_results ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_results")
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_results").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def report(self):
+        """Prints hit/miss counters for this process."""
+        stats = self.stats()
+        print(f"{TermColors.SUMMARY_KEY}LLM cache:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{stats['hits']} hits, "
+              f"{stats['misses']} misses ({stats['hit_rate']:.0%} hit rate){TermColors.RESET}")
+
+
+_default_cache = None
+
+
+def get_llm_cache() -> LLMResultCache:
+    """Returns the process-wide LLMResultCache at LLM_CACHE_FILE, opening it on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = LLMResultCache(LLM_CACHE_FILE)
+    return _default_cache
@@ -0,0 +1,182 @@
+import time
+import asyncio
+from collections import deque
+
+from openai import AsyncOpenAI
+
+# Import utilities
+from email_utils import TermColors
+from email_llm_cache import get_llm_cache
+from email_prompt_prep import count_tokens
+
+# --- Configuration ---
+# Maximum number of chat completion requests in flight at once
+LLM_CONCURRENCY = 8
+# Account budgets for the models used by the classifiers (None = unlimited). Keep these a bit below
+# the limits shown for your organization so other tools sharing the key are not starved.
+LLM_REQUESTS_PER_MINUTE = 450
+LLM_TOKENS_PER_MINUTE = 180000
+# Completion tokens reserved per request when estimating its cost against the token budget
+LLM_EXPECTED_OUTPUT_TOKENS = 200
+
+
+def estimate_tokens(messages, expected_output_tokens=LLM_EXPECTED_OUTPUT_TOKENS) -> int:
+    """Token cost of a chat request (see email_prompt_prep.count_tokens) plus the expected completion."""
+    return sum(count_tokens(m.get('content') or '') for m in messages) + expected_output_tokens
+
+
+class RequestBudget:
+    """
+    Sliding one-minute window of requests and tokens shared by all tasks of a pipeline run.
+    acquire() waits until both the request and the token budget have room.
+    """
+
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._events = deque() # (timestamp, tokens) of requests sent in the last minute
+        self._tokens = 0
+        self._lock = asyncio.Lock()
+
+    def _expire(self, now):
+        while self._events and now - self._events[0][0] >= 60:
+            self._tokens -= self._events.popleft()[1]
+
+    def _has_room(self, tokens) -> bool:
+        if self.requests_per_minute and len(self._events) >= self.requests_per_minute:
+            return False
+        if self.tokens_per_minute and self._events and self._tokens + tokens > self.tokens_per_minute:
+            return False
+        return True
+
+    async def acquire(self, tokens: int):
+        async with self._lock: # Waiters are served in arrival order
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                if self._has_room(tokens):
+                    self._events.append((now, tokens))
+                    self._tokens += tokens
+                    return
+                await asyncio.sleep(max(0.05, 60 - (now - self._events[0][0])))
+
+
+def async_client_from(client) -> AsyncOpenAI:
+    """Builds an AsyncOpenAI client with the same key, base URL and organization as a sync OpenAI client."""
+    return AsyncOpenAI(api_key=client.api_key, base_url=client.base_url, organization=client.organization)
+
+
+async def _run_requests(client, requests, concurrency, requests_per_minute, tokens_per_minute, on_complete=None):
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    budget = RequestBudget(requests_per_minute, tokens_per_minute)
+
+    async def run_one(index, create_kwargs):
+        async with semaphore:
+            await budget.acquire(estimate_tokens(create_kwargs.get('messages', [])))
+            try:
+                response = await client.chat.completions.create(**create_kwargs)
+                content = response.choices[0].message.content
+            except Exception as e: # Reported per item by the caller
+                content = e
+        if on_complete:
+            on_complete(index, content)
+        return content
+
+    try:
+        return await asyncio.gather(*(run_one(i, kwargs) for i, kwargs in enumerate(requests)))
+    finally:
+        await client.close()
+
+
+def run_chat_completions(client, requests, concurrency=LLM_CONCURRENCY,
+                         requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                         on_complete=None) -> list:
+    """
+    Sends chat completion requests concurrently with AsyncOpenAI.
+    Args:
+        client: OpenAI (sync) client; its credentials and base URL are used for the async client.
+        requests: List of keyword-argument dicts for chat.completions.create.
+        concurrency: Maximum number of requests in flight.
+        requests_per_minute / tokens_per_minute: Budgets enforced over a sliding one-minute window.
+        on_complete: Optional (index, content_or_exception) callback, called as each request finishes
+            (in completion order, not request order).
+    Returns:
+        list: For each request, in the same order, the message content string or the exception it raised.
+    """
+    if not requests:
+        return []
+    return asyncio.run(_run_requests(async_client_from(client), requests, concurrency,
+                                     requests_per_minute, tokens_per_minute, on_complete))
+
+
+def classify_all(client, items, build_messages, parse, model, prompt_version, result_type,
+                 on_error=None, rebind=None, pre_classify=None, response_format=None, on_result=None,
+                 on_failure=None, **pipeline_kwargs) -> list:
+    """
+    Classifies items through the LLM result cache and the async pipeline.
+    Args:
+        client: OpenAI (sync) client.
+        items: Items to classify (emails).
+        build_messages: item -> chat messages list.
+        parse: (item, content) -> validated result (an instance of result_type) or None.
+        model / prompt_version / result_type: Model name, prompt version and pydantic result type (also the cache key).
+        on_error: Optional (item, exception) -> fallback result for items whose request or parsing failed.
+        rebind: Optional (item, cached_result) -> result, to re-apply per-item fields to cache hits.
+        pre_classify: Optional item -> result or None. Items it decides (e.g. by email_rules) skip the cache and the model.
+        response_format: Passed to chat.completions.create (defaults to JSON object mode).
+        on_result: Optional (item, result) callback, called as soon as each item's result is known: rules
+            and cache hits first, then model results in the order their requests complete. Not called
+            for items that failed without a fallback.
+        on_failure: Optional (item, exception) callback for items whose request or parsing failed, called
+            after any on_error fallback has been passed to on_result (e.g. to retry them on a later run).
+    Returns:
+        list: Results aligned with items (None where classification failed and there is no fallback).
+    """
+    items = list(items)
+    cache = get_llm_cache()
+    results = [None] * len(items)
+
+    def resolve(i, result):
+        results[i] = result
+        if on_result and result is not None:
+            on_result(items[i], result)
+
+    pending = [] # (index, cache_key, messages)
+    for i, item in enumerate(items):
+        if pre_classify:
+            result = pre_classify(item)
+            if result is not None:
+                resolve(i, result)
+                continue
+        messages = build_messages(item)
+        cache_key = cache.make_key(model, prompt_version, messages)
+        cached = cache.get(cache_key, result_type)
+        if cached:
+            resolve(i, rebind(item, cached) if rebind else cached)
+        else:
+            pending.append((i, cache_key, messages))
+
+    def complete(position, content):
+        i, cache_key, _ = pending[position]
+        item = items[i]
+        try:
+            if isinstance(content, Exception):
+                raise content
+            result = parse(item, content)
+        except Exception as e:
+            if not on_error:
+                print(f"{TermColors.STATUS_ERROR}Error analyzing email: {e}{TermColors.RESET}")
+            resolve(i, on_error(item, e) if on_error else None)
+            if on_failure:
+                on_failure(item, e)
+            return
+        if result is not None:
+            cache.put(cache_key, result)
+        resolve(i, result)
+
+    if pending:
+        print(f"{TermColors.STATUS_INFO}Sending {len(pending)} emails to {model} ({len(items) - len(pending)} resolved by rules or cache)...{TermColors.RESET}")
+    requests = [{'model': model, 'messages': messages, 'response_format': response_format or {"type": "json_object"}}
+                for _, _, messages in pending]
+    run_chat_completions(client, requests, on_complete=complete, **pipeline_kwargs)
+    return results
@@ -9,7 +9,6 @@ from googleapiclient.errors import HttpError
 
 # Load environment variables
 from dotenv import load_dotenv
-load_dotenv(override=True)
 
 # --- Configuration ---
 # Gmail API Scopes needed by THIS script (for managing filters AND labels)
@@ -160,11 +159,16 @@ filter_definitions = [
 
 # --- Main Logic ---
 def run_filter_management(gmail_service): # Renamed and added parameter
+    """
+    Creates the labels in TARGET_LABELS and the filters in filter_definitions.
+    Returns:
+        dict: Run summary ('status' is 'ok', 'incomplete' when some filters could not be created, or 'error').
+    """
     print(f"{TermColors.BOLD}Starting Gmail Filter Manager...{TermColors.RESET}")
 
     if not gmail_service:
         print(f"{TermColors.STATUS_ERROR}Gmail service not available for filter management. Exiting.{TermColors.RESET}")
-        return
+        return {"status": "error", "error": "Gmail service not available"}
 
     # 1. Get or create necessary labels and map names to IDs
     label_name_to_id = {}
@@ -185,15 +189,17 @@ def run_filter_management(gmail_service): # Renamed and added parameter
 
     except HttpError as error:
         print(f'{TermColors.STATUS_ERROR}An error occurred while getting or creating labels: {error}{TermColors.RESET}')
-        return
+        return {"status": "error", "error": f"getting or creating labels failed: {error}"}
     
     if len(label_name_to_id) != len(TARGET_LABELS):
          print(f"{TermColors.STATUS_ERROR}Could not find or create all required labels. Cannot proceed with filter creation.{TermColors.RESET}")
-         return
+         return {"status": "error", "error": "could not find or create all required labels"}
 
     # 2. Create filters
     print(f"\n{TermColors.STATUS_INFO}Creating filters...{TermColors.RESET}")
     created_filter_count = 0
+    existing_filter_count = 0
+    failed_filter_count = 0
 
     for filter_def in filter_definitions:
         filter_name = filter_def.get('name', 'Unnamed Filter')
@@ -227,16 +233,23 @@ def run_filter_management(gmail_service): # Renamed and added parameter
             # Check if the error is due to a duplicate filter
             if error.resp.status == 409: # 409 Conflict usually indicates a duplicate
                  print(f"{TermColors.YELLOW}Warning: Filter '{filter_name}' likely already exists. Skipping creation.{TermColors.RESET}")
+                 existing_filter_count += 1
             else:
                 print(f'{TermColors.STATUS_ERROR}An error occurred while creating filter "{filter_name}": {error}{TermColors.RESET}')
+                failed_filter_count += 1
             # Decide how to handle errors - skip, retry, etc. For now, just report and continue.
 
     print(f"\n{TermColors.STATUS_SUCCESS}Finished creating filters. Total filters attempted: {len(filter_definitions)}. Total created/found duplicates: {created_filter_count}.{TermColors.RESET}")
     print(f"{TermColors.BOLD}Gmail Filter Manager finished.{TermColors.RESET}")
+    return {
+        "status": "incomplete" if failed_filter_count else "ok", "filters": len(filter_definitions),
+        "created": created_filter_count, "already_existed": existing_filter_count, "failed": failed_filter_count
+    }
 
 
 if __name__ == "__main__":
     print(f"{TermColors.BOLD}Running Gmail Filter Manager Standalone...{TermColors.RESET}")
+    load_dotenv(override=True) # Load environment variables (cli.py loads them once for every tool)
     standalone_gmail_service = get_gmail_service(TOKEN_FILE, CREDENTIALS_FILE, SCOPES)
     if not standalone_gmail_service:
         print(f"{TermColors.STATUS_ERROR}Failed to initialize Gmail service for standalone run. Exiting.{TermColors.RESET}")
@@ -0,0 +1,156 @@
+import re
+import base64
+import codecs
+from html.parser import HTMLParser
+
+# --- Configuration ---
+# Base64 characters decoded per step (multiples of 4, so every slice decodes on its own). Limited reads
+# start with a slice sized to the limit and double it up to DECODE_CHUNK_CHARS until enough text is known.
+DECODE_CHUNK_CHARS = 65536
+DECODE_MIN_CHUNK_CHARS = 256
+# Elements whose content is never part of the readable text
+HTML_SKIPPED_TAGS = {'script', 'style', 'head', 'title', 'noscript', 'template'}
+# Elements that start a new line in the extracted text
+HTML_BLOCK_TAGS = {
+    'p', 'div', 'br', 'li', 'ul', 'ol', 'tr', 'table', 'blockquote', 'section', 'article',
+    'header', 'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'pre',
+}
+
+
+def iter_parts(payload):
+    """Yields the parts of a Gmail message payload depth-first, in document order (the payload itself first)."""
+    if not payload:
+        return
+    yield payload
+    for part in payload.get('parts') or []:
+        yield from iter_parts(part)
+
+
+def find_part(payload, mime_type):
+    """Returns the first part of mime_type anywhere in the MIME tree that has body data and is not an attachment."""
+    for part in iter_parts(payload):
+        if part.get('mimeType', '').lower() == mime_type and not part.get('filename') and part.get('body', {}).get('data'):
+            return part
+    return None
+
+
+def _first_chunk_chars(max_chars):
+    """Base64 characters covering about max_chars characters of ASCII text (None = no limit)."""
+    if max_chars is None:
+        return DECODE_CHUNK_CHARS
+    return min(DECODE_CHUNK_CHARS, max(DECODE_MIN_CHUNK_CHARS, (max_chars * 4 // 3 + 3) // 4 * 4))
+
+
+def iter_decoded_chunks(data, first_chunk_chars=DECODE_CHUNK_CHARS):
+    """
+    Decodes base64url body data slice by slice and yields the text of each slice. Slices start at
+    first_chunk_chars and double up to DECODE_CHUNK_CHARS. Multi-byte UTF-8 characters split across
+    slices are carried over, so stopping early never decodes the rest.
+    """
+    data = data or ''
+    size = max(4, first_chunk_chars - first_chunk_chars % 4)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    start = 0
+    while start < len(data):
+        piece = data[start:start + size]
+        start += size
+        final = start >= len(data)
+        if final:
+            piece += '=' * (-len(piece) % 4) # Gmail often omits the padding
+        yield decoder.decode(base64.urlsafe_b64decode(piece), final=final)
+        size = min(size * 2, max(size, DECODE_CHUNK_CHARS))
+
+
+def decode_part(part) -> str:
+    """Decodes the whole body of a part."""
+    return ''.join(iter_decoded_chunks(part.get('body', {}).get('data')))
+
+
+def decode_text(part, max_chars=None) -> str:
+    """
+    Returns the stripped text of a text/plain part. With max_chars, decoding stops as soon as the first
+    max_chars characters of the stripped text are known (the result equals decode_part(part).strip()[:max_chars]).
+    """
+    chunks = []
+    length = 0
+    for chunk in iter_decoded_chunks(part.get('body', {}).get('data'), _first_chunk_chars(max_chars)):
+        chunks.append(chunk)
+        length += len(chunk)
+        if max_chars is not None and length >= max_chars:
+            text = ''.join(chunks)
+            if len(text.strip()) >= max_chars:
+                return text.lstrip()[:max_chars]
+            chunks = [text]
+    text = ''.join(chunks).strip()
+    return text if max_chars is None else text[:max_chars]
+
+
+class _TextExtractor(HTMLParser):
+    """Collects the readable text of an HTML document fed to it in chunks."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self.length = 0
+        self._skip_depth = 0
+
+    def _add(self, text):
+        self.chunks.append(text)
+        self.length += len(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HTML_SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in HTML_BLOCK_TAGS:
+            self._add('\n')
+
+    def handle_endtag(self, tag):
+        if tag in HTML_SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in HTML_BLOCK_TAGS:
+            self._add('\n')
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._add(data)
+
+    def text(self) -> str:
+        text = re.sub(r'[^\S\n]+', ' ', ''.join(self.chunks))
+        return re.sub(r' ?\n[\s]*', '\n', text).strip()
+
+
+def html_to_text(html, max_chars=None) -> str:
+    """
+    Converts HTML (a string or an iterable of string chunks) to plain text with html.parser: scripts and
+    styles are dropped, entities decoded and block elements become line breaks. With max_chars, chunks
+    stop being fed once the first max_chars characters of text are known.
+    """
+    parser = _TextExtractor()
+    for chunk in ([html] if isinstance(html, str) else html):
+        parser.feed(chunk)
+        if max_chars is not None and parser.length >= max_chars:
+            text = parser.text()
+            if len(text) >= max_chars:
+                return text[:max_chars]
+    parser.close()
+    text = parser.text()
+    return text if max_chars is None else text[:max_chars]
+
+
+def extract_body(payload, max_chars=None, html_fallback=True) -> str:
+    """
+    Returns the readable body of a Gmail message payload: the first text/plain part anywhere in the
+    MIME tree (nested multipart/alternative inside multipart/mixed included), or, with html_fallback,
+    the first text/html part converted to text. Whitespace is stripped. With max_chars, only as much
+    of the part is decoded as is needed for its first max_chars characters.
+    """
+    part = find_part(payload, 'text/plain')
+    if part:
+        text = decode_text(part, max_chars)
+        if text:
+            return text
+    if html_fallback:
+        part = find_part(payload, 'text/html')
+        if part:
+            return html_to_text(iter_decoded_chunks(part['body']['data'], _first_chunk_chars(max_chars)), max_chars)
+    return ''
@@ -4,12 +4,20 @@ from datetime import datetime, timedelta, timezone
 from openai import OpenAI
 from pydantic import BaseModel, Field
 from typing import List, Optional, Literal
-import base64
 import re
 import sys
 
 # Import utilities
 from email_utils import get_gmail_service, TermColors
+from email_fetch import iter_fetched_messages, iter_message_ids, FetchProfile, MESSAGE_METADATA_FIELDS
+from email_store import get_message_store
+from email_llm_cache import get_llm_cache
+from email_llm_pipeline import classify_all
+from email_rules import get_rule_engine
+from email_journal import ResultJournal, write_json_report
+from email_checkpoint import get_checkpoint_store, confirm_resume
+from email_estimate import estimate_run
+from email_llm_batch import write_batch_file, submit_batch, wait_for_batch, download_batch_results, BATCH_FINAL_STATUSES
 
 # Removed Google specific imports as they are in email_utils
 # from google_auth_oauthlib.flow import InstalledAppFlow
@@ -20,8 +28,6 @@ from googleapiclient.errors import HttpError # Keep for local error handling if
 
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv(override=True)
 
 # TermColors class is now imported from email_utils
 
@@ -35,6 +41,36 @@ CREDENTIALS_FILE = os.path.join(SCRIPT_DIR, "credentials.json") # Ensure this is
 # Report file
 DELETION_PLAN_REPORT_FILE = os.path.join(SCRIPT_DIR, "deletion_plan_report.md") # Changed to .md
 DELETION_CANDIDATES_JSON_FILE = os.path.join(SCRIPT_DIR, "deletion_candidates.json")
+# Suggestions are appended here as each analysis completes; the reports above are rendered from it
+DELETION_JOURNAL_FILE = os.path.join(SCRIPT_DIR, "deletion_journal.jsonl")
+# OpenAI Batch API (offline) mode: request file and the state of the pending batch
+DELETION_BATCH_INPUT_FILE = os.path.join(SCRIPT_DIR, "deletion_batch_input.jsonl")
+DELETION_BATCH_STATE_FILE = os.path.join(SCRIPT_DIR, "deletion_batch_state.json")
+
+# Checkpoint job name of the streaming analysis (see email_checkpoint.py); batch mode resumes from DELETION_BATCH_STATE_FILE
+CLEANUP_CHECKPOINT_JOB = "cleanup"
+
+# Worker threads used to fetch message details for large scans, shared by the whole scan (0 = batched requests on one connection)
+FETCH_WORKERS = 8
+# Planning reads only headers, labels, internalDate and the snippet (which stands in for the body),
+# so messages are fetched in 'metadata' format with a partial-response mask
+CLEANUP_FETCH_PROFILE = FetchProfile(
+    format='metadata', metadata_headers=('Subject', 'From', 'List-Unsubscribe', 'List-Unsubscribe-Post', 'List-Id'),
+    fields=MESSAGE_METADATA_FIELDS
+)
+
+# Model used for deletion analysis. Bump the prompt version whenever the prompt or parsing changes,
+# so results cached for the old prompt are no longer served.
+DELETION_MODEL = "gpt-3.5-turbo"
+DELETION_PROMPT_VERSION = "deletion-v2"
+# Suggestion for emails a header rule (email_rules) assigns to these categories; other categories go to the AI
+RULE_DELETION_SUGGESTIONS = {
+    "Newsletters/Promotions": "strong_candidate",
+    "Notifications": "possible_candidate",
+    "Transactional": "keep",
+}
+# Emails collected from the fetch stream before each concurrent analysis round
+ANALYSIS_CHUNK_SIZE = 50
 
 
 # --- Pydantic Models ---
@@ -54,6 +90,8 @@ class EmailDeletionSuggestion(BaseModel):
     ai_confidence: Optional[float] = None
     list_unsubscribe_mailto: Optional[str] = None
     list_unsubscribe_http: Optional[str] = None
+    list_unsubscribe_one_click: bool = False # List-Unsubscribe-Post: List-Unsubscribe=One-Click (RFC 8058)
+    list_id: Optional[str] = None
 
 class EmailDetails(BaseModel):
     id: str
@@ -62,90 +100,117 @@ class EmailDetails(BaseModel):
     sender: str
     received_date: datetime
     snippet: str
-    body_plain: Optional[str] = None
     list_unsubscribe_mailto: Optional[str] = None
     list_unsubscribe_http: Optional[str] = None
+    list_unsubscribe_one_click: bool = False
+    list_id: Optional[str] = None
+    label_ids: List[str] = []
 
 # get_gmail_service function is now imported from email_utils
 
 # --- Email Fetching ---
-def fetch_emails_for_deletion_planning(service, days_to_scan=180, max_emails=200):
-    fetched_emails: List[EmailDetails] = []
+def deletion_planning_query(days_to_scan):
+    """Gmail search query for emails older than days_to_scan days (the date is absolute, so a resumed run lists the same emails)."""
     cutoff_date = datetime.now(timezone.utc) - timedelta(days=days_to_scan)
-    query = f'before:{cutoff_date.strftime("%Y/%m/%d")}'
+    return f'before:{cutoff_date.strftime("%Y/%m/%d")}'
+
+def email_details_from_message(msg) -> EmailDetails:
+    """Builds EmailDetails from a message fetched with CLEANUP_FETCH_PROFILE."""
+    payload = msg.get('payload', {})
+    headers = payload.get('headers', [])
+
+    subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
+    sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown Sender')
+
+    list_unsubscribe_header = next((h['value'] for h in headers if h['name'].lower() == 'list-unsubscribe'), None)
+    list_unsubscribe_mailto = None
+    list_unsubscribe_http = None
+
+    if list_unsubscribe_header:
+        mailto_match = re.search(r'<mailto:([^>]+)>', list_unsubscribe_header)
+        http_match = re.search(r'<(https?:[^>]+)>', list_unsubscribe_header)
+        if mailto_match: list_unsubscribe_mailto = mailto_match.group(1)
+        if http_match: list_unsubscribe_http = http_match.group(1)
+    list_unsubscribe_post = next((h['value'] for h in headers if h['name'].lower() == 'list-unsubscribe-post'), '')
+    list_id = next((h['value'] for h in headers if h['name'].lower() == 'list-id'), None)
+
+    internal_date_ms = int(msg.get('internalDate', '0'))
+    received_dt = datetime.fromtimestamp(internal_date_ms / 1000, tz=timezone.utc)
+    snippet = msg.get('snippet', '')
+    return EmailDetails(
+        id=msg['id'], thread_id=msg['threadId'], subject=subject, sender=sender,
+        received_date=received_dt, snippet=snippet,
+        list_unsubscribe_mailto=list_unsubscribe_mailto, list_unsubscribe_http=list_unsubscribe_http,
+        list_unsubscribe_one_click=bool(list_unsubscribe_http) and 'list-unsubscribe=one-click' in list_unsubscribe_post.lower(),
+        list_id=list_id, label_ids=msg.get('labelIds', [])
+    )
+
+def iter_emails_for_deletion_planning(service, days_to_scan=180, max_emails=200, query=None, skip_ids=None):
+    """
+    Streams EmailDetails for emails older than days_to_scan days (or matching query), following list pagination.
+    Messages are hydrated page by page, so analysis can start before listing finishes.
+    Listed messages whose ID is in skip_ids are not fetched (used when resuming a checkpointed run).
+    """
+    fetched_count = 0
+    query = query or deletion_planning_query(days_to_scan)
     
     print(f"{TermColors.STATUS_INFO}Fetching emails with query: {query} (up to {max_emails} emails){TermColors.RESET}")
 
     try:
-        response = service.users().messages().list(userId='me', q=query, maxResults=max_emails).execute()
-        messages_info = response.get('messages', [])
-        
-        if not messages_info:
+        messages_info = iter_message_ids(service, query, max_results=max_emails)
+        if skip_ids:
+            messages_info = (stub for stub in messages_info if stub['id'] not in skip_ids)
+
+        for msg in iter_fetched_messages(service, messages_info, profile=CLEANUP_FETCH_PROFILE, workers=FETCH_WORKERS, store=get_message_store()):
+            fetched_count += 1
+            if fetched_count % 100 == 0:
+                print(f"{TermColors.STATUS_INFO}Fetched details for {fetched_count} emails so far...{TermColors.RESET}")
+            yield email_details_from_message(msg)
+
+        if fetched_count:
+            print(f"{TermColors.STATUS_SUCCESS}Successfully fetched details for {fetched_count} emails.{TermColors.RESET}")
+        else:
             print(f"{TermColors.YELLOW}No emails found matching the criteria.{TermColors.RESET}")
-            return fetched_emails
-
-        print(f"{TermColors.STATUS_INFO}Found {len(messages_info)} email messages. Fetching details...{TermColors.RESET}")
-        
-        for i, msg_info in enumerate(messages_info):
-            if i % 20 == 0 and i > 0:
-                print(f"{TermColors.STATUS_INFO}Fetched details for {i}/{len(messages_info)} emails...{TermColors.RESET}")
-
-            msg_id = msg_info['id']
-            thread_id = msg_info['threadId']
-            msg = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-            
-            payload = msg.get('payload', {})
-            headers = payload.get('headers', [])
-            
-            subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-            sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown Sender')
-            
-            list_unsubscribe_header = next((h['value'] for h in headers if h['name'].lower() == 'list-unsubscribe'), None)
-            list_unsubscribe_mailto = None
-            list_unsubscribe_http = None
-
-            if list_unsubscribe_header:
-                mailto_match = re.search(r'<mailto:([^>]+)>', list_unsubscribe_header)
-                http_match = re.search(r'<(https?:[^>]+)>', list_unsubscribe_header)
-                if mailto_match: list_unsubscribe_mailto = mailto_match.group(1)
-                if http_match: list_unsubscribe_http = http_match.group(1)
-            
-            internal_date_ms = int(msg.get('internalDate', '0'))
-            received_dt = datetime.fromtimestamp(internal_date_ms / 1000, tz=timezone.utc)
-            snippet = msg.get('snippet', '')
-            body_plain_content = ""
-
-            if 'parts' in payload:
-                for part in payload['parts']:
-                    if part['mimeType'] == 'text/plain':
-                        body_data = part['body'].get('data')
-                        if body_data: body_plain_content += base64.urlsafe_b64decode(body_data).decode('utf-8', errors='replace')
-                        break 
-            elif 'body' in payload and payload['body'].get('data') and payload.get('mimeType') == 'text/plain':
-                body_data = payload['body']['data']
-                body_plain_content = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='replace')
-
-            fetched_emails.append(EmailDetails(
-                id=msg_id, thread_id=thread_id, subject=subject, sender=sender,
-                received_date=received_dt, snippet=snippet,
-                body_plain=body_plain_content.strip() if body_plain_content else snippet,
-                list_unsubscribe_mailto=list_unsubscribe_mailto, list_unsubscribe_http=list_unsubscribe_http
-            ))
-            if len(fetched_emails) >= max_emails: break
-        print(f"{TermColors.STATUS_SUCCESS}Successfully fetched details for {len(fetched_emails)} emails.{TermColors.RESET}")
 
     except HttpError as error: # HttpError is still imported at the top
         print(f'{TermColors.STATUS_ERROR}An error occurred fetching emails: {error}{TermColors.RESET}')
-    return fetched_emails
+
+def fetch_emails_for_deletion_planning(service, days_to_scan=180, max_emails=200):
+    """Returns all EmailDetails from iter_emails_for_deletion_planning as a list."""
+    return list(iter_emails_for_deletion_planning(service, days_to_scan=days_to_scan, max_emails=max_emails))
 
 # --- Email Analysis ---
-def analyze_email_for_deletion(client: OpenAI, email: EmailDetails) -> EmailDeletionSuggestion:
+def _suggestion_identity(email: EmailDetails) -> dict:
+    """Per-email fields of an EmailDeletionSuggestion (everything the AI does not decide)."""
+    return dict(
+        email_id=email.id, subject=email.subject, sender=email.sender, received_date=email.received_date.isoformat(),
+        list_unsubscribe_mailto=email.list_unsubscribe_mailto, list_unsubscribe_http=email.list_unsubscribe_http,
+        list_unsubscribe_one_click=email.list_unsubscribe_one_click, list_id=email.list_id
+    )
+
+def rule_based_suggestion(email: EmailDetails) -> Optional[EmailDeletionSuggestion]:
+    """Returns a suggestion for emails that the age rule or a header rule decides confidently, else None."""
     if email.received_date < (datetime.now(timezone.utc) - timedelta(days=365*2)): # Older than 2 years
         return EmailDeletionSuggestion(
-            email_id=email.id, subject=email.subject, sender=email.sender, received_date=email.received_date.isoformat(),
-            suggestion="strong_candidate", reason_category="age", reason_detail="Email older than 2 years.",
-            list_unsubscribe_mailto=email.list_unsubscribe_mailto, list_unsubscribe_http=email.list_unsubscribe_http
+            **_suggestion_identity(email),
+            suggestion="strong_candidate", reason_category="age", reason_detail="Email older than 2 years."
+        )
+    verdict = get_rule_engine().classify(
+        email.sender, email.subject, label_ids=email.label_ids,
+        has_list_unsubscribe=bool(email.list_unsubscribe_mailto or email.list_unsubscribe_http),
+        categories=RULE_DELETION_SUGGESTIONS
+    )
+    if verdict:
+        return EmailDeletionSuggestion(
+            **_suggestion_identity(email),
+            suggestion=RULE_DELETION_SUGGESTIONS[verdict.category],
+            reason_category="subject_rule" if verdict.kind == "subject" else "sender_rule",
+            reason_detail=f"Matched rule '{verdict.rule}' ({verdict.category})."
         )
+    return None
+
+def deletion_messages(email: EmailDetails) -> list:
+    """Builds the chat messages for the deletion analysis of one email."""
     prompt_text = f"""
     Analyze the following email to determine if it's a strong candidate for deletion.
     Consider if it's promotional, a social media notification, an outdated alert, a newsletter the user likely no longer reads,
@@ -156,7 +221,6 @@ def analyze_email_for_deletion(client: OpenAI, email: EmailDetails) -> EmailDele
     From: {email.sender}
     Date: {email.received_date.strftime('%Y-%m-%d')}
     Snippet: {email.snippet}
-    Body (first 200 chars): {email.body_plain[:200] if email.body_plain else ""}
 
     Based on this, provide a JSON response with:
     - "suggestion": "strong_candidate", "possible_candidate", or "keep"
@@ -164,46 +228,109 @@ def analyze_email_for_deletion(client: OpenAI, email: EmailDetails) -> EmailDele
     - "reason_detail": A brief explanation for your suggestion.
     - "ai_confidence": Your confidence in this assessment (0.0 to 1.0).
     """
-    try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an email management assistant helping to identify emails for deletion. Be conservative with important-looking emails."},
-                {"role": "user", "content": prompt_text}
-            ],
-            response_format={"type": "json_object"}
-        )
-        analysis_data = json.loads(response.choices[0].message.content)
-        return EmailDeletionSuggestion(
-            email_id=email.id, subject=email.subject, sender=email.sender, received_date=email.received_date.isoformat(),
-            suggestion=analysis_data.get("suggestion", "keep"),
-            reason_category=analysis_data.get("reason_category", "ai_unsure"),
-            reason_detail=analysis_data.get("reason_detail", "AI analysis performed."),
-            ai_confidence=analysis_data.get("ai_confidence"),
-            list_unsubscribe_mailto=email.list_unsubscribe_mailto, list_unsubscribe_http=email.list_unsubscribe_http
-        )
-    except Exception as e:
-        print(f"{TermColors.STATUS_ERROR}Error analyzing email ID {email.id} with AI: {e}{TermColors.RESET}")
-        return EmailDeletionSuggestion(
-            email_id=email.id, subject=email.subject, sender=email.sender, received_date=email.received_date.isoformat(),
-            suggestion="keep", reason_category="ai_unsure", reason_detail=f"AI analysis failed: {e}",
-            list_unsubscribe_mailto=email.list_unsubscribe_mailto, list_unsubscribe_http=email.list_unsubscribe_http
-        )
+    return [
+        {"role": "system", "content": "You are an email management assistant helping to identify emails for deletion. Be conservative with important-looking emails."},
+        {"role": "user", "content": prompt_text}
+    ]
+
+def parse_deletion_suggestion(email: EmailDetails, content: str) -> EmailDeletionSuggestion:
+    analysis_data = json.loads(content)
+    return EmailDeletionSuggestion(
+        **_suggestion_identity(email),
+        suggestion=analysis_data.get("suggestion", "keep"),
+        reason_category=analysis_data.get("reason_category", "ai_unsure"),
+        reason_detail=analysis_data.get("reason_detail", "AI analysis performed."),
+        ai_confidence=analysis_data.get("ai_confidence")
+    )
+
+def deletion_analysis_error(email: EmailDetails, error) -> EmailDeletionSuggestion:
+    print(f"{TermColors.STATUS_ERROR}Error analyzing email ID {email.id} with AI: {error}{TermColors.RESET}")
+    return EmailDeletionSuggestion(
+        **_suggestion_identity(email),
+        suggestion="keep", reason_category="ai_unsure", reason_detail=f"AI analysis failed: {error}"
+    )
+
+def analyze_emails_for_deletion(client: OpenAI, emails: List[EmailDetails], on_result=None, on_failure=None) -> List[EmailDeletionSuggestion]:
+    """
+    Suggests whether to delete each email. Emails decided by the age or header rules skip the AI; the rest are
+    analyzed concurrently (see email_llm_pipeline.classify_all). Results keep the order of emails.
+    on_result, if given, is called with (email, suggestion) as soon as each suggestion is known, and on_failure
+    with (email, error) for emails whose AI analysis failed (their suggestion is the 'keep' fallback).
+    """
+    suggestions = [rule_based_suggestion(email) for email in emails]
+    to_analyze = [i for i, suggestion in enumerate(suggestions) if suggestion is None]
+    if on_result:
+        for email, suggestion in zip(emails, suggestions):
+            if suggestion is not None:
+                on_result(email, suggestion)
+    analyzed = classify_all(
+        client, [emails[i] for i in to_analyze], deletion_messages, parse_deletion_suggestion,
+        DELETION_MODEL, DELETION_PROMPT_VERSION, EmailDeletionSuggestion,
+        on_error=deletion_analysis_error,
+        rebind=lambda email, cached: cached.model_copy(update=_suggestion_identity(email)), # Identical content may come from another message
+        on_result=on_result, on_failure=on_failure
+    )
+    for i, suggestion in zip(to_analyze, analyzed):
+        suggestions[i] = suggestion
+    return suggestions
+
+def analyze_email_for_deletion(client: OpenAI, email: EmailDetails) -> EmailDeletionSuggestion:
+    return analyze_emails_for_deletion(client, [email])[0]
 
 # --- Reporting ---
-def generate_deletion_plan_reports(deletion_suggestions: List[EmailDeletionSuggestion]):
-    strong_candidates = [s for s in deletion_suggestions if s.suggestion == "strong_candidate"]
-    possible_candidates = [s for s in deletion_suggestions if s.suggestion == "possible_candidate"]
+def get_deletion_journal() -> ResultJournal:
+    return ResultJournal(DELETION_JOURNAL_FILE)
+
+def journal_deletion_suggestions(suggestions) -> ResultJournal:
+    """Starts a new deletion journal holding suggestions (used by the batch mode, whose results arrive together)."""
+    journal = get_deletion_journal()
+    journal.reset()
+    journal.extend(s.model_dump(mode="json") for s in suggestions)
+    return journal
+
+def _iter_candidates(journal: ResultJournal, suggestion: str):
+    """Streams the journaled suggestions of one kind, newest email first."""
+    return journal.iter_sorted(key=lambda entry: entry["received_date"], where=lambda entry: entry["suggestion"] == suggestion, reverse=True)
+
+def _write_candidate_markdown(f, s: EmailDeletionSuggestion):
+    f.write(f"### Subject: {s.subject}\n\n")
+    f.write(f"- **From:** {s.sender}\n")
+    f.write(f"- **Date:** {s.received_date}\n")
+    f.write(f"- **Reason Category:** {s.reason_category}\n")
+    f.write(f"- **Detail:** {s.reason_detail}\n")
+    if s.ai_confidence is not None:
+        f.write(f"- **AI Confidence:** {s.ai_confidence:.2f}\n")
+    if s.list_unsubscribe_mailto:
+        f.write(f"- **Unsubscribe Mailto:** `{s.list_unsubscribe_mailto}`\n")
+    if s.list_unsubscribe_http:
+        f.write(f"- **Unsubscribe HTTP:** [{s.list_unsubscribe_http}]({s.list_unsubscribe_http})"
+                f"{' (one-click)' if s.list_unsubscribe_one_click else ''}\n")
+    f.write(f"- **Email ID:** `{s.email_id}`\n\n")
+    f.write("---\n\n")
+
+def generate_deletion_plan_reports(journal: ResultJournal = None) -> dict:
+    """
+    Renders the terminal summary, DELETION_PLAN_REPORT_FILE and DELETION_CANDIDATES_JSON_FILE from the deletion
+    journal. Entries are streamed from disk, so memory use does not grow with the number of emails analyzed.
+    Returns:
+        dict: Counts of analyzed emails and of strong and possible candidates.
+    """
+    journal = journal or get_deletion_journal()
+    total = 0
+    counts = {"strong_candidate": 0, "possible_candidate": 0}
+    reason_summary = {}
+    for entry in journal:
+        total += 1
+        if entry["suggestion"] in counts:
+            counts[entry["suggestion"]] += 1
+        if entry["suggestion"] == "strong_candidate":
+            reason_summary[entry["reason_category"]] = reason_summary.get(entry["reason_category"], 0) + 1
 
     # Terminal Report
     print(f"\n{TermColors.SUMMARY_HEADER}--- Email Deletion Plan: Executive Summary ---{TermColors.RESET}")
-    print(f"{TermColors.SUMMARY_KEY}Total Emails Analyzed:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{len(deletion_suggestions)}{TermColors.RESET}")
-    print(f"{TermColors.SUMMARY_KEY}Strong Deletion Candidates:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{len(strong_candidates)}{TermColors.RESET}")
-    print(f"{TermColors.SUMMARY_KEY}Possible Deletion Candidates:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{len(possible_candidates)}{TermColors.RESET}")
-    
-    reason_summary = {}
-    for s in strong_candidates:
-        reason_summary[s.reason_category] = reason_summary.get(s.reason_category, 0) + 1
+    print(f"{TermColors.SUMMARY_KEY}Total Emails Analyzed:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{total}{TermColors.RESET}")
+    print(f"{TermColors.SUMMARY_KEY}Strong Deletion Candidates:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{counts['strong_candidate']}{TermColors.RESET}")
+    print(f"{TermColors.SUMMARY_KEY}Possible Deletion Candidates:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{counts['possible_candidate']}{TermColors.RESET}")
     
     if reason_summary:
         print(f"\n{TermColors.SUMMARY_KEY}Breakdown of Strong Candidates by Reason:{TermColors.RESET}")
@@ -215,9 +342,9 @@ def generate_deletion_plan_reports(deletion_suggestions: List[EmailDeletionSugge
         f.write("# Email Deletion Plan Report\n\n")
         f.write(f"_Generated on: {datetime.now().isoformat()}_\n\n")
         f.write("## Executive Summary\n\n")
-        f.write(f"- **Total Emails Analyzed:** {len(deletion_suggestions)}\n")
-        f.write(f"- **Strong Deletion Candidates:** {len(strong_candidates)}\n")
-        f.write(f"- **Possible Deletion Candidates:** {len(possible_candidates)}\n\n")
+        f.write(f"- **Total Emails Analyzed:** {total}\n")
+        f.write(f"- **Strong Deletion Candidates:** {counts['strong_candidate']}\n")
+        f.write(f"- **Possible Deletion Candidates:** {counts['possible_candidate']}\n\n")
         
         if reason_summary:
             f.write("### Breakdown of Strong Candidates by Reason:\n")
@@ -226,104 +353,284 @@ def generate_deletion_plan_reports(deletion_suggestions: List[EmailDeletionSugge
             f.write("\n")
         
         f.write("## Strong Deletion Candidates\n\n")
-        if strong_candidates:
-            for s in strong_candidates:
-                f.write(f"### Subject: {s.subject}\n\n")
-                f.write(f"- **From:** {s.sender}\n")
-                f.write(f"- **Date:** {s.received_date}\n")
-                f.write(f"- **Reason Category:** {s.reason_category}\n")
-                f.write(f"- **Detail:** {s.reason_detail}\n")
-                if s.ai_confidence is not None:
-                    f.write(f"- **AI Confidence:** {s.ai_confidence:.2f}\n")
-                if s.list_unsubscribe_mailto:
-                    f.write(f"- **Unsubscribe Mailto:** `{s.list_unsubscribe_mailto}`\n")
-                if s.list_unsubscribe_http:
-                    f.write(f"- **Unsubscribe HTTP:** [{s.list_unsubscribe_http}]({s.list_unsubscribe_http})\n")
-                f.write(f"- **Email ID:** `{s.email_id}`\n\n")
-                f.write("---\n\n")
-        else:
+        for entry in _iter_candidates(journal, "strong_candidate"):
+            _write_candidate_markdown(f, EmailDeletionSuggestion(**entry))
+        if not counts["strong_candidate"]:
             f.write("No strong candidates identified.\n\n")
         
         f.write("## Possible Deletion Candidates\n\n")
-        if possible_candidates:
-            for s in possible_candidates:
-                f.write(f"### Subject: {s.subject}\n\n")
-                f.write(f"- **From:** {s.sender}\n")
-                f.write(f"- **Date:** {s.received_date}\n")
-                f.write(f"- **Reason Category:** {s.reason_category}\n")
-                f.write(f"- **Detail:** {s.reason_detail}\n")
-                if s.ai_confidence is not None:
-                    f.write(f"- **AI Confidence:** {s.ai_confidence:.2f}\n")
-                if s.list_unsubscribe_mailto:
-                    f.write(f"- **Unsubscribe Mailto:** `{s.list_unsubscribe_mailto}`\n")
-                if s.list_unsubscribe_http:
-                    f.write(f"- **Unsubscribe HTTP:** [{s.list_unsubscribe_http}]({s.list_unsubscribe_http})\n")
-                f.write(f"- **Email ID:** `{s.email_id}`\n\n")
-                f.write("---\n\n")
-        else:
+        for entry in _iter_candidates(journal, "possible_candidate"):
+            _write_candidate_markdown(f, EmailDeletionSuggestion(**entry))
+        if not counts["possible_candidate"]:
             f.write("No possible candidates identified.\n\n")
             
     print(f"\n{TermColors.STATUS_SUCCESS}Detailed deletion plan report saved to: {os.path.basename(DELETION_PLAN_REPORT_FILE)} (in the project directory){TermColors.RESET}")
-    candidates_for_json = {"strong_candidates": [s.model_dump() for s in strong_candidates], "possible_candidates": [s.model_dump() for s in possible_candidates]}
-    with open(DELETION_CANDIDATES_JSON_FILE, "w", encoding="utf-8") as f_json:
-        json.dump(candidates_for_json, f_json, indent=2)
+    write_json_report(DELETION_CANDIDATES_JSON_FILE, {}, {
+        "strong_candidates": _iter_candidates(journal, "strong_candidate"),
+        "possible_candidates": _iter_candidates(journal, "possible_candidate"),
+    })
     print(f"{TermColors.STATUS_SUCCESS}Deletion candidates saved to JSON: {os.path.basename(DELETION_CANDIDATES_JSON_FILE)} (in the project directory){TermColors.RESET}")
+    return {"analyzed": total, "strong_candidates": counts["strong_candidate"], "possible_candidates": counts["possible_candidate"]}
 
 # --- Main Orchestration ---
-def run_cleanup_planning(gmail_service, openai_client): # Renamed and added parameters
+# --- OpenAI Batch API (offline) mode ---
+def submit_deletion_batch(openai_client: OpenAI, emails: List[EmailDetails]) -> dict:
+    """
+    Resolves what it can locally (age and header rules, LLM cache) and submits the remaining deletion analyses
+    as one OpenAI batch. The state needed to merge the results later is saved to DELETION_BATCH_STATE_FILE.
+    Returns:
+        dict: The saved state ('batch_id' is None when nothing had to be sent).
+    """
+    cache = get_llm_cache()
+    resolved = {} # email_id -> EmailDeletionSuggestion dict
+    requests = []
+    for email in emails:
+        suggestion = rule_based_suggestion(email)
+        if suggestion is None:
+            messages = deletion_messages(email)
+            cached = cache.get(cache.make_key(DELETION_MODEL, DELETION_PROMPT_VERSION, messages), EmailDeletionSuggestion)
+            if cached:
+                suggestion = cached.model_copy(update=_suggestion_identity(email))
+            else:
+                requests.append((email.id, {"model": DELETION_MODEL, "messages": messages, "response_format": {"type": "json_object"}}))
+        if suggestion:
+            resolved[email.id] = suggestion.model_dump()
+
+    state = {
+        "batch_id": None, "submitted_at": datetime.now().isoformat(),
+        "emails": [email.model_dump(mode="json") for email in emails], "resolved": resolved
+    }
+    if requests:
+        write_batch_file(DELETION_BATCH_INPUT_FILE, requests)
+        print(f"{TermColors.STATUS_INFO}Wrote {len(requests)} requests to {os.path.basename(DELETION_BATCH_INPUT_FILE)} ({len(resolved)} emails resolved without the AI).{TermColors.RESET}")
+        state["batch_id"] = submit_batch(openai_client, DELETION_BATCH_INPUT_FILE, description="email cleanup planning")
+        with open(DELETION_BATCH_STATE_FILE, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+    return state
+
+def merge_deletion_batch(openai_client: OpenAI, state: dict, batch=None) -> List[EmailDeletionSuggestion]:
+    """Builds the suggestions for all emails of a batch state, in the original order."""
+    results = download_batch_results(openai_client, batch) if batch is not None else {}
+    cache = get_llm_cache()
+    suggestions = []
+    for email_data in state["emails"]:
+        email = EmailDetails(**email_data)
+        if email.id in state["resolved"]:
+            suggestions.append(EmailDeletionSuggestion(**state["resolved"][email.id]))
+            continue
+        content = results.get(email.id, RuntimeError(f"no result in batch ({batch.status if batch else 'not submitted'})"))
+        try:
+            if isinstance(content, Exception):
+                raise content
+            suggestion = parse_deletion_suggestion(email, content)
+            cache.put(cache.make_key(DELETION_MODEL, DELETION_PROMPT_VERSION, deletion_messages(email)), suggestion)
+        except Exception as e:
+            suggestion = deletion_analysis_error(email, e)
+        suggestions.append(suggestion)
+    return suggestions
+
+def resume_deletion_batch(openai_client: OpenAI, wait: bool = False) -> Optional[dict]:
+    """
+    Checks the pending batch in DELETION_BATCH_STATE_FILE (waiting for it if wait is True). Once the batch
+    is finished, merges its results, writes the deletion plan reports and clears the pending state.
+    Returns:
+        dict: The report counts (see generate_deletion_plan_reports), or None while the batch is still running.
+    """
+    with open(DELETION_BATCH_STATE_FILE, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    batch = wait_for_batch(openai_client, state["batch_id"], timeout=None if wait else 0)
+    if batch.status not in BATCH_FINAL_STATUSES:
+        print(f"{TermColors.YELLOW}Batch {batch.id} is still {batch.status}. Run cleanup planning again later to collect the results.{TermColors.RESET}")
+        return None
+    if batch.status != "completed":
+        print(f"{TermColors.YELLOW}Batch {batch.id} ended with status '{batch.status}'. Emails without a result are marked 'keep'.{TermColors.RESET}")
+
+    suggestions = merge_deletion_batch(openai_client, state, batch)
+    summary = generate_deletion_plan_reports(journal_deletion_suggestions(suggestions))
+    os.remove(DELETION_BATCH_STATE_FILE)
+    return {**summary, "batch_id": batch.id, "batch_status": batch.status}
+
+def run_cleanup_planning(gmail_service, openai_client, resume=None, days=None, max_emails=None, batch=None,
+                         wait=None, collect_batch=None, estimate=False): # Renamed and added parameters
+    """
+    Plans which emails to delete.
+    Args:
+        resume: True continues the interrupted run recorded in the checkpoint database: emails it already
+            analyzed are skipped, and only failed and not-yet-analyzed ones are sent again.
+        days / max_emails: Scan emails older than this many days, up to this many emails.
+        batch: Analyze with the OpenAI Batch API instead of the streaming pipeline.
+        wait: In batch mode, wait for the batch to complete.
+        collect_batch: If a batch is pending, check it instead of starting a new scan.
+        estimate: Only project the scan's cost and duration from a sample (email_estimate), without analyzing
+            anything; no OpenAI client is needed.
+        Parameters left as None are asked for interactively.
+    Returns:
+        dict: Run summary ('status' is 'ok', 'incomplete' when some emails failed, 'pending' while a batch
+        is running, or 'error').
+    """
     print(f"{TermColors.BOLD}Starting Email Deletion Planner...{TermColors.RESET}")
     
     if not gmail_service:
         print(f"{TermColors.STATUS_ERROR}Gmail service not available for cleanup planning. Exiting.{TermColors.RESET}")
-        return
+        return {"status": "error", "error": "Gmail service not available"}
     
-    if not openai_client:
+    if not openai_client and not estimate:
         print(f"{TermColors.STATUS_ERROR}OpenAI client not available for cleanup planning. Exiting.{TermColors.RESET}")
-        return
+        return {"status": "error", "error": "OpenAI client not available"}
+
+    if estimate: # A new scan is estimated; pending batches and interrupted runs are left alone
+        resume, collect_batch = False, False
+    if os.path.exists(DELETION_BATCH_STATE_FILE):
+        with open(DELETION_BATCH_STATE_FILE, "r", encoding="utf-8") as f:
+            pending = json.load(f)
+        if collect_batch is None:
+            collect_batch = input(f"A cleanup batch ({pending['batch_id']}, submitted {pending['submitted_at']}) is pending. Check it instead of starting a new scan? (y/n) [y]: ").lower().strip() != 'n'
+        if collect_batch:
+            if wait is None:
+                wait = input("Wait until the batch completes? (y/n) [n]: ").lower().strip() == 'y'
+            summary = resume_deletion_batch(openai_client, wait=wait)
+            if summary is None:
+                return {"status": "pending", "batch_id": pending["batch_id"]}
+            print(f"\n{TermColors.BOLD}Email Deletion Planner finished.{TermColors.RESET}")
+            return {"status": "ok", "mode": "batch", **summary}
+    elif collect_batch:
+        print(f"{TermColors.YELLOW}No cleanup batch is pending.{TermColors.RESET}")
+        return {"status": "error", "error": "no cleanup batch is pending"}
+
+    store = get_checkpoint_store()
+    if resume is None:
+        resume = confirm_resume(CLEANUP_CHECKPOINT_JOB, "cleanup planning")
+    if resume:
+        checkpoint = store.unfinished_job(CLEANUP_CHECKPOINT_JOB)
+        if checkpoint is None:
+            print(f"{TermColors.YELLOW}No interrupted cleanup planning run to resume.{TermColors.RESET}")
+            return {"status": "error", "error": "no interrupted cleanup planning run to resume"}
+        print(f"{TermColors.STATUS_INFO}Resuming {store.describe(CLEANUP_CHECKPOINT_JOB)}.{TermColors.RESET}")
+        return plan_deletions_streaming(gmail_service, openai_client, checkpoint["params"]["query"],
+                                        checkpoint["params"]["max_emails"], resume=True)
 
     # openai_client = OpenAI() # Use passed-in client
-    days_to_scan_for_old_emails = 30 # Default for CLI, can be made configurable
-    max_emails_to_process = 50  # Default for CLI, can be made configurable
+    days_to_scan_for_old_emails = days if days is not None else 30 # Default for CLI, can be made configurable
+    max_emails_to_process = max_emails if max_emails is not None else 50  # Default for CLI, can be made configurable
     
-    # User input for days_to_scan and max_emails could be added here if desired for CLI flexibility
-    # For now, using fixed values for simplicity in refactoring.
-    # Example prompt for days:
+    # Only the values not passed in are asked for
     try:
-        days_input = input(f"Scan emails older than how many days? (default {days_to_scan_for_old_emails})? Press Enter for default: ")
-        if days_input.strip():
-            days_to_scan_for_old_emails = int(days_input)
+        if days is None:
+            days_input = input(f"Scan emails older than how many days? (default {days_to_scan_for_old_emails})? Press Enter for default: ")
+            if days_input.strip():
+                days_to_scan_for_old_emails = int(days_input)
         
-        max_input = input(f"Maximum number of emails to process (default {max_emails_to_process})? Press Enter for default: ")
-        if max_input.strip():
-            max_emails_to_process = int(max_input)
+        if max_emails is None:
+            max_input = input(f"Maximum number of emails to process (default {max_emails_to_process})? Press Enter for default: ")
+            if max_input.strip():
+                max_emails_to_process = int(max_input)
 
     except ValueError:
         print(f"{TermColors.YELLOW}Invalid input. Using default values.{TermColors.RESET}")
 
+    if estimate:
+        return estimate_run(
+            "cleanup planning", gmail_service, deletion_planning_query(days_to_scan_for_old_emails), CLEANUP_FETCH_PROFILE,
+            email_details_from_message, deletion_messages, DELETION_MODEL, (DELETION_PROMPT_VERSION,), EmailDeletionSuggestion,
+            max_emails=max_emails_to_process, pre_classify=rule_based_suggestion, batch_api=True
+        )
 
-    emails_to_analyze = fetch_emails_for_deletion_planning(
-        gmail_service, days_to_scan=days_to_scan_for_old_emails, max_emails=max_emails_to_process
-    )
-
-    if not emails_to_analyze:
+    # Batch mode trades latency (up to 24h) for lower cost and no rate-limit pressure on large scans
+    if batch is None:
+        batch = input("Analyze with the OpenAI Batch API (offline, lower cost, results within 24h)? (y/n) [n]: ").lower().strip() == 'y'
+    if batch:
+        emails = fetch_emails_for_deletion_planning(
+            gmail_service, days_to_scan=days_to_scan_for_old_emails, max_emails=max_emails_to_process
+        )
+        if not emails:
+            print(f"{TermColors.YELLOW}No emails fetched for analysis. Exiting.{TermColors.RESET}")
+            return {"status": "ok", "mode": "batch", "analyzed": 0}
+        state = submit_deletion_batch(openai_client, emails)
+        get_rule_engine().report()
+        if state["batch_id"] is None:
+            summary = generate_deletion_plan_reports(journal_deletion_suggestions(merge_deletion_batch(openai_client, state)))
+        else:
+            if wait is None:
+                wait = input("Wait for the batch to complete now? (y/n) [n]: ").lower().strip() == 'y'
+            summary = resume_deletion_batch(openai_client, wait=True) if wait else None
+            if summary is None:
+                print(f"{TermColors.STATUS_INFO}Run cleanup planning again later to collect the results of batch {state['batch_id']}.{TermColors.RESET}")
+                return {"status": "pending", "mode": "batch", "batch_id": state["batch_id"]}
+        print(f"\n{TermColors.BOLD}Email Deletion Planner finished.{TermColors.RESET}")
+        return {"status": "ok", "mode": "batch", **summary}
+
+    return plan_deletions_streaming(gmail_service, openai_client, deletion_planning_query(days_to_scan_for_old_emails), max_emails_to_process)
+
+def plan_deletions_streaming(gmail_service, openai_client, query: str, max_emails: int, resume: bool = False):
+    """
+    Analyzes the emails matching query as they stream in from the fetcher, journaling each suggestion and
+    checkpointing each email. With resume=True, emails the checkpoint records as done are not fetched again;
+    their stored suggestions go straight into the reports.
+    Returns:
+        dict: Run summary (see run_cleanup_planning).
+    """
+    store = get_checkpoint_store()
+    journal = get_deletion_journal()
+    journal.reset()
+    if resume:
+        skip_ids = store.done_ids(CLEANUP_CHECKPOINT_JOB)
+        stale_ids = set(store.pending_ids(CLEANUP_CHECKPOINT_JOB)) # Dropped below unless they are listed again
+        journal.extend(store.iter_results(CLEANUP_CHECKPOINT_JOB))
+    else:
+        skip_ids = None
+        stale_ids = set()
+        store.start_job(CLEANUP_CHECKPOINT_JOB, {"query": query, "max_emails": max_emails})
+
+    # Each suggestion is journaled and checkpointed the moment it is known, so an interrupted run keeps its progress
+    analyzed_count = len(skip_ids or ())
+    def record_suggestion(email, suggestion):
+        nonlocal analyzed_count
+        result = suggestion.model_dump(mode="json")
+        journal.append(result)
+        store.mark_done(CLEANUP_CHECKPOINT_JOB, email.id, result)
+        analyzed_count += 1
+    def record_failure(email, error):
+        store.mark_failed(CLEANUP_CHECKPOINT_JOB, email.id, error) # Retried by --resume; reported as 'keep' for now
+
+    emails_to_analyze = iter_emails_for_deletion_planning(gmail_service, max_emails=max_emails, query=query, skip_ids=skip_ids)
+    print(f"\n{TermColors.STATUS_INFO}Analyzing up to {max_emails} emails for deletion potential...{TermColors.RESET}")
+    chunk = []
+    for email in emails_to_analyze:
+        chunk.append(email)
+        stale_ids.discard(email.id)
+        if len(chunk) >= ANALYSIS_CHUNK_SIZE:
+            store.add_messages(CLEANUP_CHECKPOINT_JOB, [e.id for e in chunk])
+            analyze_emails_for_deletion(openai_client, chunk, on_result=record_suggestion, on_failure=record_failure)
+            print(f"{TermColors.STATUS_INFO}Analyzed {analyzed_count} emails...{TermColors.RESET}")
+            chunk = []
+    if chunk:
+        store.add_messages(CLEANUP_CHECKPOINT_JOB, [e.id for e in chunk])
+        analyze_emails_for_deletion(openai_client, chunk, on_result=record_suggestion, on_failure=record_failure)
+    store.remove_messages(CLEANUP_CHECKPOINT_JOB, stale_ids) # No longer listed (deleted or moved)
+
+    if not analyzed_count:
         print(f"{TermColors.YELLOW}No emails fetched for analysis. Exiting.{TermColors.RESET}")
-        return
-
-    all_suggestions: List[EmailDeletionSuggestion] = []
-    print(f"\n{TermColors.STATUS_INFO}Analyzing {len(emails_to_analyze)} emails for deletion potential...{TermColors.RESET}")
-    for i, email in enumerate(emails_to_analyze):
-        if i % 10 == 0 and i > 0:
-            print(f"{TermColors.STATUS_INFO}Analyzed {i}/{len(emails_to_analyze)} emails...{TermColors.RESET}")
-        suggestion = analyze_email_for_deletion(openai_client, email)
-        all_suggestions.append(suggestion)
+        store.finish_job(CLEANUP_CHECKPOINT_JOB)
+        return {"status": "ok", "mode": "streaming", "analyzed": 0, "failed": 0}
     
     print(f"{TermColors.STATUS_SUCCESS}Analysis complete.{TermColors.RESET}")
-    generate_deletion_plan_reports(all_suggestions)
+    get_llm_cache().report()
+    get_rule_engine().report()
+    store.report(CLEANUP_CHECKPOINT_JOB)
+    summary = {"status": "ok", "mode": "streaming", **generate_deletion_plan_reports(journal)}
+    summary["failed"] = len(store.pending_ids(CLEANUP_CHECKPOINT_JOB))
+    if not summary["failed"]:
+        store.finish_job(CLEANUP_CHECKPOINT_JOB)
+    else:
+        print(f"{TermColors.YELLOW}Some emails could not be analyzed. Run cleanup planning with --resume to retry them.{TermColors.RESET}")
+        summary["status"] = "incomplete"
 
     print(f"\n{TermColors.BOLD}Email Deletion Planner finished.{TermColors.RESET}")
+    return summary
 
 if __name__ == "__main__":
     print(f"{TermColors.BOLD}Running Email Deletion Planner Standalone...{TermColors.RESET}")
+    load_dotenv(override=True) # Load environment variables (cli.py loads them once for every tool)
     standalone_gmail_service = get_gmail_service(TOKEN_FILE, CREDENTIALS_FILE, SCOPES)
     if not standalone_gmail_service:
         print(f"{TermColors.STATUS_ERROR}Failed to initialize Gmail service for standalone run. Exiting.{TermColors.RESET}")
@@ -336,4 +643,5 @@ if __name__ == "__main__":
         print(f"{TermColors.STATUS_ERROR}Failed to initialize OpenAI client for standalone run: {e}{TermColors.RESET}")
         sys.exit(1)
 
-    run_cleanup_planning(standalone_gmail_service, standalone_openai_client)
+    run_cleanup_planning(standalone_gmail_service, standalone_openai_client, resume="--resume" in sys.argv[1:] or None,
+                         estimate="--estimate" in sys.argv[1:])
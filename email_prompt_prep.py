@@ -0,0 +1,151 @@
+import re
+import threading
+
+# Import utilities
+from email_utils import TermColors
+
+try: # Optional: exact token counts for OpenAI models
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# --- Configuration ---
+# Encoding used when tiktoken does not know a model
+DEFAULT_ENCODING = "cl100k_base"
+# Characters per token assumed when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+# Lines longer than this are body text, never a footer line
+MAX_FOOTER_LINE_CHARS = 120
+# Stands in for each run of removed footer lines, so the model still sees that the email had one
+FOOTER_MARKER = '[mailing-list footer removed]'
+# URLs longer than this are shortened to their scheme and host (tracking links cost many tokens)
+MAX_URL_CHARS = 40
+
+# Start of quoted reply history; everything from the match on is dropped
+QUOTE_HEADER_PATTERNS = [
+    re.compile(r'^On\b[^\n]{0,200}(?:\n[^\n]{0,200})?\bwrote:[ \t]*$', re.MULTILINE),
+    re.compile(r'^-{2,}\s*Original Message\s*-{2,}', re.MULTILINE | re.IGNORECASE),
+    re.compile(r'^_{10,}\s*\nFrom:', re.MULTILINE),
+    re.compile(r'^From:[^\n]+\n(?:[^\n]*\n){0,3}?Sent:', re.MULTILINE),
+]
+# Start of a signature; everything from the match on is dropped
+SIGNATURE_PATTERNS = [
+    re.compile(r'^-- ?$', re.MULTILINE), # RFC 3676 signature delimiter
+    re.compile(r'^(?:Sent from my \w+|Get Outlook for \w+)', re.MULTILINE | re.IGNORECASE),
+]
+# Short lines of tracking/marketing footers that are replaced by FOOTER_MARKER wherever they appear
+FOOTER_LINE_PATTERN = re.compile(
+    r'unsubscribe|view (?:this email |it )?(?:in|on) (?:your|a|the)? ?(?:browser|web)|you are receiving this|'
+    r'you received this (?:email|message)|(?:update|manage) your (?:email )?(?:preferences|subscription)|'
+    r'privacy policy|all rights reserved|this email was sent to',
+    re.IGNORECASE
+)
+# Consecutive markers (blank lines between them included) collapse into one
+FOOTER_RUN_PATTERN = re.compile(re.escape(FOOTER_MARKER) + r'(?:\s*' + re.escape(FOOTER_MARKER) + r')+')
+URL_PATTERN = re.compile(r'(https?://[^\s/<>"\')\]]+)[^\s<>"\')\]]*')
+
+_encodings = {}
+
+
+def _encoding_for(model):
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding(DEFAULT_ENCODING)
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str = None) -> int:
+    """Token count of text for model (tiktoken when installed, else about CHARS_PER_TOKEN characters per token)."""
+    if not text:
+        return 0
+    if tiktoken is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(_encoding_for(model).encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = None) -> str:
+    """Returns the longest prefix of text that fits in max_tokens."""
+    if tiktoken is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    encoding = _encoding_for(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def _shorten_url(match):
+    url = match.group(0)
+    return url if len(url) <= MAX_URL_CHARS else match.group(1) + '/…'
+
+
+def clean_body(text: str) -> str:
+    """
+    Strips what classifiers do not need from an email body: quoted reply history, signatures, the paths
+    of long (tracking) URLs, and short tracking and marketing footer lines (each run of them becomes one
+    FOOTER_MARKER). Falls back to the original text if cleaning would leave nothing.
+    """
+    if not text:
+        return ''
+    cleaned = text.replace('\r\n', '\n')
+    for pattern in QUOTE_HEADER_PATTERNS + SIGNATURE_PATTERNS:
+        match = pattern.search(cleaned)
+        if match and match.start() > 0: # A body that starts with a quote keeps it
+            cleaned = cleaned[:match.start()]
+    lines = []
+    for line in cleaned.split('\n'):
+        if line.lstrip().startswith('>'):
+            continue
+        footer = len(line) <= MAX_FOOTER_LINE_CHARS and FOOTER_LINE_PATTERN.search(line)
+        lines.append(FOOTER_MARKER if footer else line.rstrip())
+    cleaned = FOOTER_RUN_PATTERN.sub(FOOTER_MARKER, '\n'.join(lines))
+    cleaned = URL_PATTERN.sub(_shorten_url, cleaned)
+    cleaned = re.sub(r'\n{3,}', '\n\n', cleaned).strip()
+    return cleaned or text.strip()
+
+
+class BodyPreparer:
+    """
+    Prepares email bodies for classifier prompts: cleans them (clean_body) and truncates them to the
+    classifier's token budget. Counts tokens before and after so each run can report the savings.
+    """
+
+    def __init__(self):
+        self.bodies = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, text: str, max_tokens: int, model: str = None) -> str:
+        original = (text or '').strip()
+        prepared = clean_body(original)
+        if count_tokens(prepared, model) > max_tokens:
+            prepared = truncate_to_tokens(prepared, max_tokens, model).rstrip()
+        with self._lock:
+            self.bodies += 1
+            self.tokens_before += count_tokens(original, model)
+            self.tokens_after += count_tokens(prepared, model)
+        return prepared
+
+    def report(self):
+        """Prints the body tokens saved since the last report, then resets the counters."""
+        if self.bodies:
+            saved = self.tokens_before - self.tokens_after
+            share = saved / self.tokens_before if self.tokens_before else 0.0
+            counter = "tiktoken" if tiktoken is not None else f"~{CHARS_PER_TOKEN} chars/token"
+            print(f"{TermColors.SUMMARY_KEY}Prompt preparation:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{self.bodies} bodies, "
+                  f"{self.tokens_before} -> {self.tokens_after} tokens ({saved} saved, {share:.0%}; {counter}){TermColors.RESET}")
+        self.bodies = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+
+_default_preparer = None
+
+
+def get_body_preparer() -> BodyPreparer:
+    """Returns the process-wide BodyPreparer."""
+    global _default_preparer
+    if _default_preparer is None:
+        _default_preparer = BodyPreparer()
+    return _default_preparer
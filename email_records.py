@@ -0,0 +1,65 @@
+import os
+import mmap
+from datetime import datetime
+from typing import List
+
+from pydantic import BaseModel
+
+from email_mime import extract_body
+
+# --- Configuration ---
+# Body characters kept per record: enough for email_prompt_prep to strip quoted history and footers
+# and still fill the largest prompt token budget
+RECORD_BODY_CHARS = 16000
+
+
+class EmailRecord(BaseModel):
+    """One fetched email, as handed from the fetch stage to the analysis stages."""
+    id: str = ''
+    thread_id: str = ''
+    message_id: str = '' # RFC 822 Message-ID header
+    subject: str = 'No Subject'
+    sender: str = 'Unknown Sender' # Raw From header
+    received: str = '' # ISO timestamp (local time) from internalDate
+    body: str = ''
+    label_ids: List[str] = []
+
+
+def email_record_from_message(msg) -> EmailRecord:
+    """Builds an EmailRecord from a full-format Gmail message resource."""
+    payload = msg.get('payload', {})
+    headers = payload.get('headers', [])
+
+    subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
+    from_sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown Sender')
+    message_id = next((h['value'] for h in headers if h['name'].lower() == 'message-id'), '')
+    received_date_unix = int(msg.get('internalDate', '0')) / 1000
+    received_date = datetime.fromtimestamp(received_date_unix).isoformat()
+
+    return EmailRecord(
+        id=msg.get('id', ''), thread_id=msg.get('threadId', ''), message_id=message_id,
+        subject=subject, sender=from_sender, received=received_date, body=extract_body(payload, RECORD_BODY_CHARS),
+        label_ids=msg.get('labelIds', [])
+    )
+
+
+def spool_records(records, path, append=False):
+    """
+    Yields records unchanged while appending each one to a JSONL spool file, so a crash mid-run still
+    leaves every record fetched so far on disk. The file is truncated first unless append is True.
+    """
+    with open(path, "a" if append else "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(record.model_dump_json() + "\n")
+            f.flush()
+            yield record
+
+
+def iter_spool(path):
+    """Streams EmailRecords back from a JSONL spool file, memory-mapped so large spools are not read whole."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for line in iter(mapped.readline, b""):
+            if line.strip():
+                yield EmailRecord.model_validate_json(line)
@@ -0,0 +1,153 @@
+import re
+from email.utils import parseaddr
+from typing import Optional, Literal
+
+from pydantic import BaseModel
+
+# Import utilities
+from email_utils import TermColors
+from email_manage_filters import filter_definitions
+
+# --- Configuration ---
+# Gmail category labels treated as confident bulk-mail signals, and the filter label they correspond to
+GMAIL_CATEGORY_LABELS = {
+    'CATEGORY_PROMOTIONS': 'Newsletters/Promotions',
+    'CATEGORY_SOCIAL': 'Notifications',
+}
+# Category hinted for mail carrying a List-Unsubscribe header when no other rule matched
+LIST_UNSUBSCRIBE_CATEGORY = 'Newsletters/Promotions'
+
+
+class RuleVerdict(BaseModel):
+    category: str # One of the filter labels (email_manage_filters.TARGET_LABELS)
+    rule: str # Name of the rule that matched
+    kind: Literal["sender", "subject", "label", "list_unsubscribe"]
+    confident: bool # False for loose patterns whose match should still go to the model
+
+
+class CompiledRule(BaseModel):
+    name: str
+    category: str
+    kind: Literal["sender", "subject"]
+    addresses: frozenset = frozenset() # Full sender addresses (terms containing '@')
+    domains: tuple = () # Sender domains, matched with their subdomains (never confident)
+    phrases: tuple = () # Lower-cased subject phrases
+    pattern: Optional[str] = None # Regex for Gmail wildcard subject patterns
+    confident: bool = True
+
+
+def _split_terms(expression: str) -> list:
+    """Splits a Gmail 'a OR "b c" OR d' criteria expression into its terms."""
+    return [term.strip().strip('"').strip() for term in re.split(r'\s+OR\s+', expression or '') if term.strip()]
+
+
+def compile_rules(definitions=filter_definitions) -> list:
+    """
+    Compiles filter definitions into header rules. 'from' and 'subject' criteria are used;
+    'query' criteria search the body, which is not available before classification, and are skipped.
+    """
+    rules = []
+    for definition in definitions:
+        labels = definition.get('action', {}).get('addLabelIds', [])
+        if not labels:
+            continue
+        criteria = definition.get('criteria', {})
+        name = definition.get('name', 'Unnamed Filter')
+        if criteria.get('from'):
+            terms = [term.lower() for term in _split_terms(criteria['from'])]
+            addresses = frozenset(t for t in terms if '@' in t)
+            domains = tuple(t for t in terms if '@' not in t)
+            if addresses:
+                rules.append(CompiledRule(name=name, category=labels[0], kind="sender", addresses=addresses))
+            if domains: # People mail from google.com, github.com etc. too, so a domain only hints
+                rules.append(CompiledRule(name=name, category=labels[0], kind="sender", domains=domains, confident=False))
+        if criteria.get('subject'):
+            terms = _split_terms(criteria['subject'])
+            phrases = tuple(t.lower() for t in terms if '*' not in t)
+            wildcards = [t for t in terms if '*' in t]
+            if phrases: # Words like 'discount' or 'invoice' also appear in personal mail
+                rules.append(CompiledRule(name=name, category=labels[0], kind="subject", phrases=phrases, confident=False))
+            if wildcards: # e.g. '*[*]*' matches far more than intended, so only hint, never decide
+                pattern = '|'.join('.*'.join(re.escape(part) for part in t.split('*')) for t in wildcards)
+                rules.append(CompiledRule(name=name, category=labels[0], kind="subject", pattern=pattern, confident=False))
+    return rules
+
+
+COMPILED_RULES = compile_rules()
+
+
+class RuleEngine:
+    """
+    Header-only pre-classifier shared by all classifiers. Decides on exact sender addresses and Gmail category
+    labels; sender domain, subject and List-Unsubscribe matches are only hints and leave the email to the model.
+    Counts the emails it decided, i.e. model calls saved.
+    """
+
+    def __init__(self, rules=None):
+        self.rules = COMPILED_RULES if rules is None else rules
+        self._sender_rules = [r for r in self.rules if r.kind == "sender"]
+        self._subject_rules = [r for r in self.rules if r.kind == "subject"]
+        self._patterns = {r.name: re.compile(r.pattern, re.IGNORECASE) for r in self._subject_rules if r.pattern}
+        self.checked = 0
+        self.decided = 0
+
+    def match(self, sender: str = '', subject: str = '', label_ids=(), has_list_unsubscribe: bool = False) -> Optional[RuleVerdict]:
+        """
+        Returns a confident verdict if one applies, else the first loose match (a hint for the model), or None.
+        Only exact sender addresses and Gmail category labels are confident.
+        """
+        address = parseaddr(sender or '')[1].lower()
+        domain = address.rsplit('@', 1)[-1] if '@' in address else ''
+        for rule in self._sender_rules:
+            if address in rule.addresses:
+                return RuleVerdict(category=rule.category, rule=rule.name, kind="sender", confident=rule.confident)
+
+        for label_id in label_ids or ():
+            if label_id in GMAIL_CATEGORY_LABELS:
+                return RuleVerdict(category=GMAIL_CATEGORY_LABELS[label_id], rule=f"Gmail {label_id}", kind="label", confident=True)
+
+        for rule in self._sender_rules:
+            if any(domain == d or domain.endswith('.' + d) for d in rule.domains):
+                return RuleVerdict(category=rule.category, rule=rule.name, kind="sender", confident=False)
+
+        subject_lower = (subject or '').lower()
+        for rule in self._subject_rules:
+            matched = self._patterns[rule.name].search(subject or '') if rule.pattern else any(phrase in subject_lower for phrase in rule.phrases)
+            if matched:
+                return RuleVerdict(category=rule.category, rule=rule.name, kind="subject", confident=False)
+
+        if has_list_unsubscribe: # Set by plenty of personal and work mail sent through mailing software
+            return RuleVerdict(category=LIST_UNSUBSCRIBE_CATEGORY, rule="List-Unsubscribe header", kind="list_unsubscribe", confident=False)
+        return None
+
+    def classify(self, sender: str = '', subject: str = '', label_ids=(), has_list_unsubscribe: bool = False,
+                 categories=None) -> Optional[RuleVerdict]:
+        """
+        Returns a confident verdict whose category is in `categories` (all categories if None),
+        or None to defer to the model. Confident verdicts are counted as saved model calls.
+        """
+        self.checked += 1
+        verdict = self.match(sender, subject, label_ids, has_list_unsubscribe)
+        if verdict is None or not verdict.confident or (categories is not None and verdict.category not in categories):
+            return None
+        self.decided += 1
+        return verdict
+
+    def report(self):
+        """Prints how many model calls the rules saved since the last report, then resets the counters."""
+        if self.checked:
+            print(f"{TermColors.SUMMARY_KEY}Rule pre-classifier:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{self.decided} of "
+                  f"{self.checked} emails decided by rules ({self.decided} API calls saved){TermColors.RESET}")
+        self.checked = 0
+        self.decided = 0
+
+
+_default_engine = None
+
+
+def get_rule_engine() -> RuleEngine:
+    """Returns the process-wide RuleEngine built from email_manage_filters.filter_definitions."""
+    global _default_engine
+    if _default_engine is None:
+        _default_engine = RuleEngine()
+    return _default_engine
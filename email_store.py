@@ -0,0 +1,310 @@
+import os
+import json
+import sqlite3
+import time
+import threading
+from datetime import datetime
+
+from email_mime import find_part, decode_part
+
+# Determine the absolute path to THIS script's directory
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+MESSAGE_STORE_FILE = os.path.join(SCRIPT_DIR, "message_store.sqlite3")
+
+# How much of a message each Gmail format carries; a cached record satisfies any request of equal or lower rank.
+# 'raw' carries no parsed payload, so it only satisfies 'raw' (and 'minimal') requests.
+FORMAT_RANK = {'minimal': 0, 'metadata': 1, 'full': 2}
+# Stored labels confirmed against Gmail (fetched, synced or revalidated) within this many seconds are served
+# without another check; older ones are revalidated first (see email_fetch.revalidate_stored)
+LABELS_FRESH_SECONDS = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    history_id INTEGER,
+    internal_date INTEGER,
+    label_ids TEXT,
+    headers TEXT,
+    snippet TEXT,
+    body_plain TEXT,
+    body_html TEXT,
+    format TEXT NOT NULL,
+    metadata_headers TEXT,
+    fields TEXT,
+    resource TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    added_history_id INTEGER,
+    checked_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages(thread_id);
+CREATE INDEX IF NOT EXISTS idx_messages_internal_date ON messages(internal_date);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _decode_bodies(payload):
+    """Returns the first text/plain and text/html bodies found anywhere in the MIME tree."""
+    plain_part, html_part = find_part(payload, 'text/plain'), find_part(payload, 'text/html')
+    return (decode_part(plain_part) if plain_part else None), (decode_part(html_part) if html_part else None)
+
+
+def field_paths(fields) -> set:
+    """Splits a partial-response mask ('id,payload/headers') into its paths."""
+    return {path.strip() for path in (fields or '').split(',') if path.strip()}
+
+
+def _covers_fields(row_fields, fields) -> bool:
+    """Checks whether a record fetched with the row_fields mask holds everything the fields mask asks for."""
+    if not row_fields:
+        return True # Complete resource
+    if not fields:
+        return False
+    cached = field_paths(row_fields)
+    return all(any(path == c or path.startswith(c + '/') for c in cached) for path in field_paths(fields))
+
+
+def _satisfies(row_format, row_metadata_headers, format, metadata_headers, row_fields=None, fields=None) -> bool:
+    """Checks whether a cached record fetched as row_format (with the row_fields mask) can serve a request for format."""
+    if not _covers_fields(row_fields, fields):
+        return False
+    if format == 'raw' or row_format == 'raw':
+        return row_format == format or format == 'minimal'
+    if FORMAT_RANK.get(row_format, -1) < FORMAT_RANK.get(format, 99):
+        return False
+    if row_format == 'metadata' and format == 'metadata' and row_metadata_headers is not None:
+        if not metadata_headers:
+            return False # Request wants every header; cached record only has some
+        cached = {h.lower() for h in json.loads(row_metadata_headers)}
+        return {h.lower() for h in metadata_headers} <= cached
+    return True
+
+
+class MessageStore:
+    """
+    SQLite-backed cache of hydrated Gmail messages, keyed by message ID and historyId.
+    Holds the message resource as returned by the API plus parsed headers, decoded bodies,
+    labels and internalDate, so repeat runs read locally instead of refetching.
+    """
+
+    def __init__(self, path: str = MESSAGE_STORE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+            columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(messages)")}
+            if 'added_history_id' not in columns: # Stores created before incremental sync existed
+                self._conn.execute("ALTER TABLE messages ADD COLUMN added_history_id INTEGER")
+            if 'fields' not in columns: # Stores created before fetch profiles existed (complete resources)
+                self._conn.execute("ALTER TABLE messages ADD COLUMN fields TEXT")
+            if 'checked_at' not in columns: # Stores created before label revalidation (checked on first use)
+                self._conn.execute("ALTER TABLE messages ADD COLUMN checked_at REAL")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_added ON messages(added_history_id)")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_many(self, message_ids, format='full', metadata_headers=None, fields=None) -> dict:
+        """Returns {message_id: resource} for cached messages that satisfy the requested format and fields mask."""
+        found = {}
+        message_ids = list(dict.fromkeys(message_ids))
+        with self._lock:
+            for i in range(0, len(message_ids), 500): # Stay under SQLite's bound-parameter limit
+                chunk = message_ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT id, format, metadata_headers, fields, resource FROM messages WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for row in rows:
+                    if _satisfies(row['format'], row['metadata_headers'], format, metadata_headers, row['fields'], fields):
+                        found[row['id']] = json.loads(row['resource'])
+        return found
+
+    def get(self, message_id, format='full', metadata_headers=None, fields=None):
+        """Returns the cached resource for one message, or None."""
+        return self.get_many([message_id], format=format, metadata_headers=metadata_headers, fields=fields).get(message_id)
+
+    def get_profiles(self, message_ids) -> dict:
+        """
+        Returns {message_id: {'format', 'metadata_headers', 'fields'}} describing how each stored message was
+        fetched, so a request it does not satisfy can refetch with a profile covering both.
+        """
+        found = {}
+        message_ids = list(dict.fromkeys(message_ids))
+        with self._lock:
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT id, format, metadata_headers, fields FROM messages WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for row in rows:
+                    headers = json.loads(row['metadata_headers']) if row['metadata_headers'] else None
+                    found[row['id']] = {'format': row['format'], 'metadata_headers': tuple(headers) if headers else None,
+                                        'fields': row['fields']}
+        return found
+
+    def put_many(self, resources, format='full', metadata_headers=None, added_history_id=None, fields=None):
+        """
+        Stores message resources fetched with the given format (and partial-response fields mask).
+        added_history_id marks messages discovered by a sync, so consumers can ask for what is new (see email_sync).
+        Messages that were already stored keep their original marker.
+        """
+        now = datetime.now().isoformat()
+        rows = []
+        for msg in resources:
+            if not msg:
+                continue
+            payload = msg.get('payload', {})
+            headers = {h['name']: h['value'] for h in payload.get('headers', [])}
+            body_plain, body_html = _decode_bodies(payload) if format == 'full' else (None, None)
+            rows.append((
+                msg['id'], msg.get('threadId'), int(msg.get('historyId', 0) or 0), int(msg.get('internalDate', 0) or 0),
+                json.dumps(msg.get('labelIds', [])), json.dumps(headers), msg.get('snippet', ''),
+                body_plain, body_html, format,
+                json.dumps(list(metadata_headers)) if format == 'metadata' and metadata_headers else None,
+                fields or None, json.dumps(msg), now, added_history_id, time.time()
+            ))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO messages (id, thread_id, history_id, internal_date, label_ids, headers, snippet, "
+                "body_plain, body_html, format, metadata_headers, fields, resource, updated_at, added_history_id, checked_at) "
+                "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?) "
+                "ON CONFLICT(id) DO UPDATE SET thread_id=excluded.thread_id, history_id=excluded.history_id, "
+                "internal_date=excluded.internal_date, label_ids=excluded.label_ids, headers=excluded.headers, "
+                "snippet=excluded.snippet, body_plain=excluded.body_plain, body_html=excluded.body_html, "
+                "format=excluded.format, metadata_headers=excluded.metadata_headers, fields=excluded.fields, resource=excluded.resource, "
+                "updated_at=excluded.updated_at, added_history_id=COALESCE(messages.added_history_id, excluded.added_history_id), "
+                "checked_at=excluded.checked_at",
+                rows
+            )
+            self._conn.commit()
+
+    def put(self, resource, format='full', metadata_headers=None, fields=None):
+        self.put_many([resource], format=format, metadata_headers=metadata_headers, fields=fields)
+
+    def delete_many(self, message_ids):
+        message_ids = list(message_ids)
+        with self._lock:
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                self._conn.execute(f"DELETE FROM messages WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            self._conn.commit()
+
+    def update_labels(self, message_id, label_ids, history_id=None) -> bool:
+        """Updates the labels (and optionally historyId) of a stored message. Returns False if it is not stored."""
+        with self._lock:
+            row = self._conn.execute("SELECT resource, history_id FROM messages WHERE id = ?", (message_id,)).fetchone()
+            if row is None:
+                return False
+            resource = json.loads(row['resource'])
+            resource['labelIds'] = list(label_ids)
+            new_history_id = max(int(history_id or 0), row['history_id'] or 0)
+            if new_history_id:
+                resource['historyId'] = str(new_history_id)
+            self._conn.execute(
+                "UPDATE messages SET label_ids = ?, history_id = ?, resource = ?, updated_at = ?, checked_at = ? WHERE id = ?",
+                (json.dumps(list(label_ids)), new_history_id, json.dumps(resource), datetime.now().isoformat(), time.time(), message_id)
+            )
+            self._conn.commit()
+            return True
+
+    def mark_current(self, message_ids):
+        """Records that the stored labels of message_ids were just confirmed against Gmail."""
+        message_ids = list(message_ids)
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                self._conn.execute(f"UPDATE messages SET checked_at = ? WHERE id IN ({','.join('?' * len(chunk))})", [now] + chunk)
+            self._conn.commit()
+
+    def unconfirmed_ids(self, message_ids, max_age=LABELS_FRESH_SECONDS) -> list:
+        """The stored IDs among message_ids whose labels were not confirmed against Gmail in the last max_age seconds."""
+        message_ids = list(dict.fromkeys(message_ids))
+        cutoff = time.time() - max_age
+        stale = set()
+        with self._lock:
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT id FROM messages WHERE (checked_at IS NULL OR checked_at < ?) AND id IN ({','.join('?' * len(chunk))})",
+                    [cutoff] + chunk
+                ).fetchall()
+                stale.update(row['id'] for row in rows)
+        return [msg_id for msg_id in message_ids if msg_id in stale]
+
+    def mark_added(self, message_ids, history_id):
+        """Marks already stored messages as added by the sync at history_id, unless they carry a marker already."""
+        message_ids = list(message_ids)
+        with self._lock:
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                self._conn.execute(
+                    f"UPDATE messages SET added_history_id = ? WHERE added_history_id IS NULL AND id IN ({','.join('?' * len(chunk))})",
+                    [int(history_id)] + chunk
+                )
+            self._conn.commit()
+
+    def get_history_ids(self, message_ids) -> dict:
+        """Returns {message_id: stored historyId} for the stored messages among message_ids."""
+        found = {}
+        message_ids = list(message_ids)
+        with self._lock:
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT id, history_id FROM messages WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update((row['id'], row['history_id']) for row in rows)
+        return found
+
+    def ids_added_since(self, history_id, label_ids=None, excluded_label_ids=None, received_after=None) -> list:
+        """
+        Returns IDs of messages a sync added after history_id (oldest first), optionally requiring all of
+        label_ids and none of excluded_label_ids, and an internalDate (epoch milliseconds) of at least received_after.
+        """
+        query, params = "SELECT id, label_ids FROM messages WHERE added_history_id > ?", [int(history_id or 0)]
+        if received_after is not None:
+            query, params = query + " AND internal_date >= ?", params + [int(received_after)]
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY internal_date", params).fetchall()
+        required, excluded = set(label_ids or []), set(excluded_label_ids or [])
+        result = []
+        for row in rows:
+            labels = set(json.loads(row['label_ids'] or '[]'))
+            if required <= labels and not (excluded & labels):
+                result.append(row['id'])
+        return result
+
+    def get_state(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else default
+
+    def set_state(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, str(value)))
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+
+_default_store = None
+
+
+def get_message_store() -> MessageStore:
+    """Returns the process-wide MessageStore at MESSAGE_STORE_FILE, opening it on first use."""
+    global _default_store
+    if _default_store is None:
+        _default_store = MessageStore(MESSAGE_STORE_FILE)
+    return _default_store
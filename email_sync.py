@@ -0,0 +1,249 @@
+import json
+from datetime import datetime, timedelta
+
+from googleapiclient.errors import HttpError
+
+# Import utilities
+from email_utils import TermColors
+from email_fetch import fetch_messages, iter_message_ids, FetchProfile, MESSAGE_FULL_FIELDS
+from email_store import get_message_store
+
+# --- Configuration ---
+HISTORY_STATE_KEY = 'history_id'
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+# Query used to seed the local store on the first sync, or when the stored historyId has expired
+FULL_SYNC_QUERY = 'newer_than:30d -in:spam -in:trash'
+FULL_SYNC_MAX_MESSAGES = 2000
+# Messages fetched per round during a full resync (keeps memory flat)
+FULL_SYNC_CHUNK_SIZE = 500
+# How synced messages are stored: 'full' covers every stage's fetch profile
+SYNC_FETCH_PROFILE = FetchProfile(format='full', fields=MESSAGE_FULL_FIELDS)
+# Added messages whose fetch failed are kept here and retried by the following syncs (message_id -> attempts)
+PENDING_ADDED_STATE_KEY = 'pending_added'
+SYNC_MAX_FETCH_ATTEMPTS = 5
+# A full resync marks every listed message as added. Consumers whose cursor predates it only take the ones
+# received since their last run (minus this margin, for emails that arrived while that run was processing)
+FULL_RESYNC_STATE_KEY = 'full_resync_history_id'
+RESYNC_OVERLAP_HOURS = 2
+
+
+def sync_mailbox(service, store=None, full_sync_query=FULL_SYNC_QUERY, max_full_sync=FULL_SYNC_MAX_MESSAGES) -> dict:
+    """
+    Brings the local message store up to date with the mailbox.
+    Uses users().history().list from the last stored historyId and applies message-added, label-changed
+    and deleted deltas. Falls back to a full resync when there is no stored historyId or it has expired.
+    Returns:
+        dict: {'mode', 'added' (list of IDs), 'deleted', 'labels_changed', 'history_id'}
+    """
+    store = store or get_message_store()
+    start_history_id = store.get_state(HISTORY_STATE_KEY)
+    if start_history_id:
+        try:
+            return _incremental_sync(service, store, int(start_history_id))
+        except HttpError as error:
+            if error.resp.status != 404:
+                raise
+            print(f"{TermColors.YELLOW}Stored history ID {start_history_id} has expired. Falling back to a full resync...{TermColors.RESET}")
+    return full_resync(service, store, query=full_sync_query, max_messages=max_full_sync)
+
+
+def _incremental_sync(service, store, start_history_id: int) -> dict:
+    added = {} # message_id -> history record ID, in history order
+    deleted = set()
+    label_updates = {} # message_id -> (label_ids, history record ID)
+    latest_history_id = start_history_id
+    page_token = None
+
+    print(f"{TermColors.STATUS_INFO}Syncing mailbox changes since history ID {start_history_id}...{TermColors.RESET}")
+    while True:
+        list_kwargs = {'userId': 'me', 'startHistoryId': start_history_id, 'historyTypes': HISTORY_TYPES, 'maxResults': 500}
+        if page_token:
+            list_kwargs['pageToken'] = page_token
+        response = service.users().history().list(**list_kwargs).execute()
+
+        for record in response.get('history', []):
+            record_id = int(record['id'])
+            for item in record.get('messagesAdded', []):
+                msg = item['message']
+                added[msg['id']] = record_id
+                deleted.discard(msg['id'])
+            for item in record.get('messagesDeleted', []):
+                msg_id = item['message']['id']
+                deleted.add(msg_id)
+                added.pop(msg_id, None)
+                label_updates.pop(msg_id, None)
+            for item in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                msg = item['message']
+                if msg['id'] not in deleted:
+                    label_updates[msg['id']] = (msg.get('labelIds', []), record_id)
+
+        latest_history_id = max(latest_history_id, int(response.get('historyId', latest_history_id)))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+
+    if deleted:
+        store.delete_many(deleted)
+
+    pending = _load_pending(store, exclude=deleted)
+    added_ids = list(added) + [msg_id for msg_id in pending if msg_id not in added]
+    cached = store.get_many(added_ids, format=SYNC_FETCH_PROFILE.format, fields=SYNC_FETCH_PROFILE.fields)
+    missing = [msg_id for msg_id in added_ids if msg_id not in cached]
+    failed = _store_new_messages(service, store, missing, latest_history_id)
+    store.mark_added(added_ids, latest_history_id)
+
+    labels_changed = 0
+    for msg_id, (label_ids, record_id) in label_updates.items():
+        if msg_id in missing:
+            continue # Freshly fetched resources already carry their current labels
+        if store.update_labels(msg_id, label_ids, record_id):
+            labels_changed += 1
+
+    _save_pending(store, pending, failed)
+    store.set_state(HISTORY_STATE_KEY, latest_history_id)
+    store.mark_current(added_ids) # Label changes were applied through update_labels
+    failed_set = set(failed)
+    stored_ids = [msg_id for msg_id in added_ids if msg_id not in failed_set]
+    print(f"{TermColors.STATUS_SUCCESS}Sync complete: {len(stored_ids)} added, {labels_changed} label changes, {len(deleted)} deleted.{TermColors.RESET}")
+    return {'mode': 'incremental', 'added': stored_ids, 'deleted': len(deleted),
+            'labels_changed': labels_changed, 'history_id': latest_history_id}
+
+
+def _store_new_messages(service, store, message_ids, added_history_id) -> list:
+    """Fetches and stores messages a sync found, marked with added_history_id. Returns the IDs whose fetch failed."""
+    if not message_ids:
+        return []
+    messages = fetch_messages(service, message_ids, profile=SYNC_FETCH_PROFILE)
+    store.put_many(messages, format=SYNC_FETCH_PROFILE.format, fields=SYNC_FETCH_PROFILE.fields, added_history_id=added_history_id)
+    return [msg_id for msg_id, msg in zip(message_ids, messages) if msg is None]
+
+
+def _load_pending(store, exclude=()) -> dict:
+    """Returns {message_id: failed attempts} for added messages earlier syncs could not fetch, minus exclude."""
+    pending = json.loads(store.get_state(PENDING_ADDED_STATE_KEY) or '{}')
+    return {msg_id: attempts for msg_id, attempts in pending.items() if msg_id not in exclude}
+
+
+def _save_pending(store, pending, failed):
+    """
+    Records the IDs whose fetch failed in this sync so the next sync retries them, even though the stored
+    historyId moves past the records that added them. IDs failing SYNC_MAX_FETCH_ATTEMPTS times are dropped.
+    """
+    remaining, dropped = {}, []
+    for msg_id in failed:
+        attempts = pending.get(msg_id, 0) + 1
+        if attempts >= SYNC_MAX_FETCH_ATTEMPTS:
+            dropped.append(msg_id)
+        else:
+            remaining[msg_id] = attempts
+    store.set_state(PENDING_ADDED_STATE_KEY, json.dumps(remaining))
+    if remaining:
+        print(f"{TermColors.YELLOW}{len(remaining)} new emails could not be fetched; the next sync retries them.{TermColors.RESET}")
+    if dropped:
+        print(f"{TermColors.YELLOW}Giving up on {len(dropped)} new emails that failed to fetch {SYNC_MAX_FETCH_ATTEMPTS} times.{TermColors.RESET}")
+
+
+def full_resync(service, store=None, query=FULL_SYNC_QUERY, max_messages=FULL_SYNC_MAX_MESSAGES) -> dict:
+    """
+    Re-seeds the local store from a messages().list query and records the current historyId.
+    Messages already stored are only re-checked with cheap 'minimal' fetches to refresh their labels.
+    """
+    store = store or get_message_store()
+    # Record the history ID before listing so no change between listing and the next sync is missed
+    history_id = int(service.users().getProfile(userId='me').execute()['historyId'])
+    print(f"{TermColors.STATUS_INFO}Running full mailbox sync with query '{query}' (up to {max_messages} emails)...{TermColors.RESET}")
+
+    added_ids = []
+    failed = []
+    labels_changed = 0
+    chunk = []
+    pending = _load_pending(store)
+
+    def flush(chunk):
+        nonlocal labels_changed
+        known = store.get_history_ids(chunk)
+        if known:
+            for msg in fetch_messages(service, list(known), format='minimal'):
+                if msg and int(msg.get('historyId', 0)) != known[msg['id']]:
+                    if store.update_labels(msg['id'], msg.get('labelIds', []), msg.get('historyId')):
+                        labels_changed += 1
+        cached = store.get_many(chunk, format=SYNC_FETCH_PROFILE.format, fields=SYNC_FETCH_PROFILE.fields)
+        missing = [msg_id for msg_id in chunk if msg_id not in cached]
+        chunk_failed = _store_new_messages(service, store, missing, history_id)
+        store.mark_added(chunk, history_id)
+        store.mark_current(chunk)
+        failed.extend(chunk_failed)
+        chunk_failed = set(chunk_failed)
+        added_ids.extend(msg_id for msg_id in chunk if msg_id not in chunk_failed)
+
+    for stub in iter_message_ids(service, query, max_results=max_messages):
+        chunk.append(stub['id'])
+        if len(chunk) >= FULL_SYNC_CHUNK_SIZE:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    # Earlier failures outside the query window are retried here as well
+    listed = set(added_ids) | set(failed)
+    retry = [msg_id for msg_id in pending if msg_id not in listed]
+    for i in range(0, len(retry), FULL_SYNC_CHUNK_SIZE):
+        flush(retry[i:i + FULL_SYNC_CHUNK_SIZE])
+
+    _save_pending(store, pending, failed)
+    store.set_state(HISTORY_STATE_KEY, history_id)
+    store.set_state(FULL_RESYNC_STATE_KEY, history_id)
+    print(f"{TermColors.STATUS_SUCCESS}Full sync complete: {len(added_ids)} emails, {labels_changed} label changes.{TermColors.RESET}")
+    return {'mode': 'full', 'added': added_ids, 'deleted': 0, 'labels_changed': labels_changed, 'history_id': history_id}
+
+
+def get_new_messages(service, consumer: str, label_ids=None, excluded_label_ids=('SPAM', 'TRASH'), store=None,
+                     profile=SYNC_FETCH_PROFILE, max_messages=None, first_run_hours=24):
+    """
+    Syncs the mailbox, then returns messages that are new since `consumer` last committed its cursor.
+    A consumer without a cursor gets the messages received in the last first_run_hours hours. When a full
+    resync ran since the cursor, only messages received since the consumer's last run count as new, so a
+    resync does not hand it the whole FULL_SYNC_QUERY window.
+    Args:
+        service: Authorized Gmail API service instance.
+        consumer: Name of the calling stage (e.g. 'triage'); each stage keeps its own cursor.
+        label_ids: Labels a message must carry (e.g. ['INBOX']).
+        excluded_label_ids: Labels that exclude a message.
+        profile: email_fetch.FetchProfile of the calling stage (served from the store the sync filled).
+        max_messages: At most this many (the most recent) new messages are returned (None = no limit).
+            Older ones are skipped: the returned history ID still covers them.
+        first_run_hours: Lookback for a consumer that has no cursor yet.
+    Returns:
+        tuple: (list of message resources, history ID to pass to commit_cursor after processing)
+    """
+    store = store or get_message_store()
+    sync_result = sync_mailbox(service, store)
+    cursor = store.get_state(f'cursor:{consumer}')
+    received_after = None
+    if cursor is None:
+        received_after = datetime.now() - timedelta(hours=first_run_hours)
+        print(f"{TermColors.STATUS_INFO}First incremental run for {consumer}: taking emails from the last {first_run_hours} hours.{TermColors.RESET}")
+    elif int(store.get_state(FULL_RESYNC_STATE_KEY, 0)) > int(cursor):
+        last_run = last_run_time(consumer, store)
+        received_after = (last_run - timedelta(hours=RESYNC_OVERLAP_HOURS)) if last_run else datetime.now() - timedelta(hours=first_run_hours)
+        print(f"{TermColors.STATUS_INFO}The mailbox was resynced since the last {consumer} run: taking emails received after {received_after:%Y-%m-%d %H:%M}.{TermColors.RESET}")
+    new_ids = store.ids_added_since(cursor, label_ids=label_ids, excluded_label_ids=excluded_label_ids,
+                                    received_after=int(received_after.timestamp() * 1000) if received_after else None)
+    if max_messages is not None and len(new_ids) > max_messages:
+        print(f"{TermColors.YELLOW}{len(new_ids)} new emails; only the {max_messages} most recent are processed (raise it with --max).{TermColors.RESET}")
+        new_ids = new_ids[-max_messages:]
+    messages = [msg for msg in fetch_messages(service, new_ids, profile=profile, store=store) if msg is not None]
+    return messages, sync_result['history_id']
+
+
+def commit_cursor(consumer: str, history_id, store=None):
+    """Records that `consumer` has processed everything up to history_id."""
+    store = store or get_message_store()
+    store.set_state(f'cursor:{consumer}', history_id)
+    store.set_state(f'cursor:{consumer}:time', datetime.now().isoformat())
+
+
+def last_run_time(consumer: str, store=None):
+    """Returns when `consumer` last committed its cursor (datetime), or None."""
+    store = store or get_message_store()
+    value = store.get_state(f'cursor:{consumer}:time')
+    return datetime.fromisoformat(value) if value else None
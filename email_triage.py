@@ -6,17 +6,26 @@ from openai import OpenAI
 from pydantic import BaseModel
 from typing import List, Optional, Literal
 import re
-import base64
+from email.utils import parseaddr
 from email.mime.text import MIMEText 
 import sys 
 
 # Import utilities
 from email_utils import get_gmail_service, TermColors 
+from email_fetch import iter_fetched_messages, iter_message_ids, fetch_threads, FetchProfile, MESSAGE_FULL_FIELDS, MESSAGE_METADATA_FIELDS
+from email_records import email_record_from_message, spool_records, iter_spool
+from email_store import get_message_store
+from email_sync import get_new_messages, commit_cursor, last_run_time
+from email_llm_cache import get_llm_cache
+from email_llm_pipeline import classify_all
+from email_rules import get_rule_engine
+from email_prompt_prep import get_body_preparer
+from email_journal import ResultJournal, write_json_report
+from email_checkpoint import get_checkpoint_store, confirm_resume
+from email_estimate import estimate_run, GMAIL_QUOTA_UNITS
 
 from googleapiclient.errors import HttpError # Keep HttpError for exception handling
 
-# Load environment variables
-load_dotenv(override=True)
 
 # --- Configuration ---
 # Gmail API Scopes needed by THIS script
@@ -35,10 +44,43 @@ class EmailImportance(BaseModel):
     topics: List[str]
 
 # File paths
-RECENT_EMAILS_FILE = "recent_emails.txt" # Should be SCRIPT_DIR relative
+# Append-only JSONL copy of the emails handed to analysis (None disables spooling)
+RECENT_EMAILS_SPOOL = os.path.join(SCRIPT_DIR, "recent_emails.jsonl")
 RESPONSE_HISTORY_FILE = os.path.join(SCRIPT_DIR, "response_history.json")
 NEEDS_RESPONSE_JSON = os.path.join(SCRIPT_DIR, "needs_response_emails.json")
 NEEDS_RESPONSE_REPORT = os.path.join(SCRIPT_DIR, "needs_response_report.md") # Changed to .md
+ALL_ANALYZED_JSON = os.path.join(SCRIPT_DIR, "all_analyzed_emails.json")
+# Each analyzed email is appended here as soon as its analysis completes; the reports above are rendered from it
+TRIAGE_JOURNAL_FILE = os.path.join(SCRIPT_DIR, "triage_journal.jsonl")
+
+# How triage decides whether an email was already answered:
+# "threads" fetches only the threads of the triaged emails and checks whether the last message is yours;
+# "sent_folder" scans the sent folder over the lookback window and matches by headers, thread and subject.
+RESPONDED_DETECTION = "threads"
+# Headers needed from sent emails to detect replies
+SENT_METADATA_HEADERS = ['Subject', 'To', 'Cc', 'Date', 'In-Reply-To', 'References']
+# What each triage fetch requests: incoming emails need the body; sent emails and threads only headers
+TRIAGE_FETCH_PROFILE = FetchProfile(format='full', fields=MESSAGE_FULL_FIELDS)
+SENT_FETCH_PROFILE = FetchProfile(format='metadata', metadata_headers=tuple(SENT_METADATA_HEADERS), fields=MESSAGE_METADATA_FIELDS)
+THREAD_FIELDS = 'id,messages(id,labelIds,internalDate,payload/headers)'
+
+# Cursor name used by incremental (history-based) triage runs
+TRIAGE_SYNC_CONSUMER = "triage"
+# Checkpoint job name of triage runs (see email_checkpoint.py)
+TRIAGE_CHECKPOINT_JOB = "triage"
+
+# Model used for importance analysis. Bump the prompt version whenever the prompt or parsing changes,
+# so results cached for the old prompt are no longer served.
+IMPORTANCE_MODEL = "gpt-4.1"
+IMPORTANCE_PROMPT_VERSION = "importance-v1"
+# Maximum emails triaged per windowed run; each one is a request to IMPORTANCE_MODEL, so long windows
+# (e.g. --hours 720 --include-read) are capped instead of costing whatever the mailbox holds
+MAX_EMAILS_TO_PROCESS = 50
+# Token budget for the email body in the importance prompt (after quoted history, signatures and footers are stripped)
+IMPORTANCE_BODY_TOKENS = 1000
+# Header-rule categories (email_rules) that never need a response. Notifications are left to the AI
+# because security alerts can be time-sensitive.
+RULE_LOW_IMPORTANCE_CATEGORIES = {"Newsletters/Promotions", "Transactional"}
 
 
 def load_response_history():
@@ -61,103 +103,145 @@ def save_response_history(history, new_response=None):
     with open(RESPONSE_HISTORY_FILE, "w", encoding="utf-8") as f:
         json.dump(history, f, indent=2)
 
+REPLY_PREFIX_PATTERN = re.compile(r'^\s*(?:(?:re|fwd?|aw|sv)\s*(?:\[\d+\])?\s*:\s*)+', re.IGNORECASE)
+
+def normalize_subject(subject):
+    """Lower-cases a subject, strips any chain of reply/forward prefixes and collapses whitespace."""
+    return ' '.join(REPLY_PREFIX_PATTERN.sub('', subject or '').lower().split())
+
+def _message_ids(header_value):
+    """Extracts <message-id> tokens from a Message-ID, In-Reply-To or References header."""
+    return set(re.findall(r'<[^<>\s]+>', header_value or ''))
+
+class SentMailIndex:
+    """
+    Lookup tables over sent emails for "already responded" checks:
+    recipient address -> normalized subjects, replied-to Message-IDs (In-Reply-To/References),
+    and threadId -> time of the latest sent message in that thread.
+    """
+
+    def __init__(self, sent_emails=()):
+        self.subjects_by_recipient = {}
+        self.replied_message_ids = set()
+        self.last_sent_by_thread = {}
+        for sent_email in sent_emails:
+            self.add(sent_email)
+
+    def add(self, sent_email):
+        normalized = normalize_subject(sent_email.get('subject', ''))
+        for recipient in sent_email.get('recipients', []):
+            self.subjects_by_recipient.setdefault(recipient.lower(), set()).add(normalized)
+        self.replied_message_ids |= _message_ids(sent_email.get('in_reply_to')) | _message_ids(sent_email.get('references'))
+        thread_id, sent_time = sent_email.get('thread_id'), sent_email.get('sent_time', '')
+        if thread_id and sent_time > self.last_sent_by_thread.get(thread_id, ''):
+            self.last_sent_by_thread[thread_id] = sent_time
+
+    def has_responded(self, email):
+        """email is an EmailRecord."""
+        if _message_ids(email.message_id) & self.replied_message_ids:
+            return True
+        thread_id = email.thread_id
+        if thread_id in self.last_sent_by_thread and email.received and self.last_sent_by_thread[thread_id] >= email.received:
+            return True # We wrote in this thread after the email arrived
+        sender_email = parseaddr(email.sender)[1].lower()
+        return bool(sender_email) and normalize_subject(email.subject) in self.subjects_by_recipient.get(sender_email, ())
+
+def get_responded_thread_ids(service, thread_ids):
+    """
+    Fetches the given threads (metadata format, batched) and returns the IDs of those whose latest
+    message was sent by you, i.e. threads you have already answered.
+    """
+    thread_ids = [t for t in dict.fromkeys(thread_ids) if t]
+    if not thread_ids:
+        return set()
+    own_address = service.users().getProfile(userId='me').execute().get('emailAddress', '').lower()
+    responded = set()
+    for thread in fetch_threads(service, thread_ids, format='metadata', metadata_headers=['From'], fields=THREAD_FIELDS):
+        if not thread or not thread.get('messages'):
+            continue
+        last_message = max(thread['messages'], key=lambda m: int(m.get('internalDate', 0)))
+        headers = last_message.get('payload', {}).get('headers', [])
+        sender = parseaddr(next((h['value'] for h in headers if h['name'].lower() == 'from'), ''))[1].lower()
+        if 'SENT' in last_message.get('labelIds', []) or (own_address and sender == own_address):
+            responded.add(thread['id'])
+    return responded
+
 def is_previously_responded(email, sent_emails):
-    """Check if we've already responded to this email"""
-    from_match = re.search(r'<(.+?)>', email.get('from', ''))
-    sender_email = from_match.group(1).lower() if from_match else None
-    
-    if not sender_email:
-        return False
-    
-    subject = email.get('subject', '').lower()
-    clean_subject = re.sub(r'^(?:re|fwd):\s*', '', subject, flags=re.IGNORECASE)
-    
-    for sent_email in sent_emails:
-        if sender_email in sent_email.get('recipients', []):
-            sent_subject = sent_email.get('subject', '').lower()
-            clean_sent_subject = re.sub(r'^(?:re|fwd):\s*', '', sent_subject, flags=re.IGNORECASE)
-            if clean_subject == clean_sent_subject or clean_subject in clean_sent_subject or clean_sent_subject in clean_subject:
-                return True
-    return False
-
-def get_emails(service, query, hours=24): # Added query parameter
+    """Check if we've already responded to this email (an EmailRecord). sent_emails is a SentMailIndex (or a list of sent emails)."""
+    index = sent_emails if isinstance(sent_emails, SentMailIndex) else SentMailIndex(sent_emails)
+    return index.has_responded(email)
+
+def time_window_query(query, hours):
+    """query restricted to emails from the last hours hours."""
+    query_date = (datetime.now() - timedelta(hours=hours)).strftime('%Y/%m/%d')
+    return f'after:{query_date} {query}'
+
+def get_emails(service, query, hours=24, max_emails=MAX_EMAILS_TO_PROCESS): # Added query parameter
     """
-    Fetches emails from Gmail from the last {hours} hours using the provided query and saves to RECENT_EMAILS_FILE.
+    Fetches emails from Gmail from the last {hours} hours using the provided query.
+    Follows list pagination; max_emails caps the number of emails fetched (None = all matching emails).
+    Returns a list of EmailRecord (also spooled to RECENT_EMAILS_SPOOL).
     """
     if not service:
         print(f"{TermColors.STATUS_ERROR}Failed to get Gmail service in get_emails (service not provided).{TermColors.RESET}")
         return []
 
     emails_data = []
-    query_date = (datetime.now() - timedelta(hours=hours)).strftime('%Y/%m/%d')
-    # query = f'after:{query_date} is:unread category:primary' # Query is now passed in
-
-    # Construct the final query string including the date filter
-    final_query = f'after:{query_date} {query}'
+    final_query = time_window_query(query, hours) # Query is now passed in
 
     try:
-        response = service.users().messages().list(userId='me', q=final_query, maxResults=50).execute() # Use final_query
-        messages = response.get('messages', [])
-        
-        # Ensure RECENT_EMAILS_FILE is SCRIPT_DIR relative
-        recent_emails_file_path = os.path.join(SCRIPT_DIR, RECENT_EMAILS_FILE)
+        messages = iter_message_ids(service, final_query, max_results=max_emails) # Streams IDs page by page
+        emails_data = save_recent_emails(iter_fetched_messages(service, messages, profile=TRIAGE_FETCH_PROFILE, store=get_message_store()))
+        print(f"{TermColors.STATUS_INFO}Fetched {len(emails_data)} emails from the last {hours} hours.{TermColors.RESET}")
+        if max_emails is not None and len(emails_data) >= max_emails:
+            print(f"{TermColors.YELLOW}Stopped at the limit of {max_emails} emails; older matching emails are not triaged (raise it with --max).{TermColors.RESET}")
+    except HttpError as error:
+        print(f"{TermColors.STATUS_ERROR}An error occurred fetching emails: {error}{TermColors.RESET}")
+        emails_data = []
+    
+    return emails_data
 
-        with open(recent_emails_file_path, "w", encoding="utf-8") as f_out:
-            for message_info in messages:
-                msg_id = message_info['id']
-                msg = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-                
-                payload = msg.get('payload', {})
-                headers = payload.get('headers', [])
-                
-                subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-                from_sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown Sender')
-                received_date_unix = int(msg.get('internalDate', '0')) / 1000
-                received_date = datetime.fromtimestamp(received_date_unix).isoformat()
-
-                body_content = ""
-                if 'parts' in payload:
-                    for part in payload['parts']:
-                        if part['mimeType'] == 'text/plain':
-                            body_data = part['body'].get('data')
-                            if body_data:
-                                body_content += base64.urlsafe_b64decode(body_data).decode('utf-8', errors='replace')
-                            break 
-                    if not body_content: 
-                         for part in payload['parts']:
-                            if part['mimeType'] == 'text/html':
-                                body_data = part['body'].get('data')
-                                if body_data:
-                                    html_content = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='replace')
-                                    body_content += re.sub('<[^<]+?>', '', html_content) 
-                                break
-                elif 'body' in payload and payload['body'].get('data'):
-                    body_data = payload['body']['data']
-                    body_content = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='replace')
-                    if payload.get('mimeType') == 'text/html':
-                        body_content = re.sub('<[^<]+?>', '', body_content)
-
-                email_detail = {
-                    'subject': subject, 'from': from_sender,
-                    'receivedDateTime': received_date, 'body': body_content.strip()
-                }
-                emails_data.append(email_detail)
-
-                f_out.write(f"Subject: {subject}\nFrom: {from_sender}\nReceived: {received_date}\nBody: {body_content.strip()}\n" + "-" * 50 + "\n")
+def get_new_emails(service, include_read=False, max_emails=MAX_EMAILS_TO_PROCESS):
+    """
+    Fetches inbox emails that arrived since the last incremental triage run (via the Gmail history API),
+    at most max_emails of them (the most recent; None = no limit).
+    Returns:
+        tuple: (list of EmailRecord, history ID to commit once the run has finished)
+    """
+    if not service:
+        print(f"{TermColors.STATUS_ERROR}Failed to get Gmail service in get_new_emails (service not provided).{TermColors.RESET}")
+        return [], None
 
-        print(f"{TermColors.STATUS_INFO}Fetched {len(emails_data)} emails from the last {hours} hours.{TermColors.RESET}")
-        if not emails_data:
-            # Ensure file is empty if no emails
-            with open(recent_emails_file_path, 'w', encoding='utf-8') as f_out_empty:
-                 f_out_empty.write("")
-            print(f"{TermColors.YELLOW}{recent_emails_file_path} is empty as no new emails were found.{TermColors.RESET}")
+    required_labels = ['INBOX'] if include_read else ['INBOX', 'UNREAD']
+    try:
+        messages, history_id = get_new_messages(service, TRIAGE_SYNC_CONSUMER, label_ids=required_labels, profile=TRIAGE_FETCH_PROFILE,
+                                                max_messages=max_emails)
+        emails_data = save_recent_emails(messages)
+        print(f"{TermColors.STATUS_INFO}Fetched {len(emails_data)} emails that are new since the last triage run.{TermColors.RESET}")
+        return emails_data, history_id
+    except HttpError as error:
+        print(f"{TermColors.STATUS_ERROR}An error occurred syncing new emails: {error}{TermColors.RESET}")
+        return [], None
 
+def get_emails_by_id(service, message_ids):
+    """Fetches the given emails (used to resume a checkpointed run). Returns a list of EmailRecord (also spooled)."""
+    try:
+        return save_recent_emails(iter_fetched_messages(service, message_ids, profile=TRIAGE_FETCH_PROFILE, store=get_message_store()))
     except HttpError as error:
         print(f"{TermColors.STATUS_ERROR}An error occurred fetching emails: {error}{TermColors.RESET}")
-        with open(os.path.join(SCRIPT_DIR, RECENT_EMAILS_FILE), 'w', encoding='utf-8') as f_out_err: # ensure empty on error
-             f_out_err.write("")
-        print(f"{TermColors.YELLOW}{os.path.join(SCRIPT_DIR, RECENT_EMAILS_FILE)} is empty due to an error.{TermColors.RESET}")
-    
+        return []
+
+def save_recent_emails(messages):
+    """
+    Converts message resources to EmailRecords, appending each to RECENT_EMAILS_SPOOL as it arrives
+    (when spooling is enabled). Returns the records.
+    """
+    records = (email_record_from_message(msg) for msg in messages)
+    if RECENT_EMAILS_SPOOL:
+        records = spool_records(records, RECENT_EMAILS_SPOOL)
+    emails_data = list(records)
+    if not emails_data:
+        print(f"{TermColors.YELLOW}No new emails were found.{TermColors.RESET}")
     return emails_data
 
 def get_sent_emails(service, days=7): # Added service parameter
@@ -172,20 +256,20 @@ def get_sent_emails(service, days=7): # Added service parameter
     query = f'after:{query_date} in:sent'
 
     try:
-        response = service.users().messages().list(userId='me', q=query, maxResults=100).execute()
-        messages = response.get('messages', [])
+        messages = iter_message_ids(service, query)
         
-        for message_info in messages:
-            msg_id = message_info['id']
-            msg = service.users().messages().get(userId='me', id=msg_id, format='metadata', metadataHeaders=['Subject', 'To', 'Date']).execute()
+        for msg in iter_fetched_messages(service, messages, profile=SENT_FETCH_PROFILE, store=get_message_store()):
             payload = msg.get('payload', {})
-            headers = payload.get('headers', [])
-            subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-            recipients_str = next((h['value'] for h in headers if h['name'].lower() == 'to'), '')
-            recipients = [email.strip() for email in re.findall(r'[\w\.-]+@[\w\.-]+', recipients_str)]
+            headers = {h['name'].lower(): h['value'] for h in payload.get('headers', [])}
+            subject = headers.get('subject', 'No Subject')
+            recipients_str = f"{headers.get('to', '')}, {headers.get('cc', '')}"
+            recipients = [email.strip().lower() for email in re.findall(r'[\w\.+-]+@[\w\.-]+', recipients_str)]
             sent_date_unix = int(msg.get('internalDate', '0')) / 1000
             sent_date = datetime.fromtimestamp(sent_date_unix).isoformat()
-            sent_emails_data.append({'subject': subject, 'recipients': recipients, 'sent_time': sent_date})
+            sent_emails_data.append({
+                'subject': subject, 'recipients': recipients, 'sent_time': sent_date, 'thread_id': msg.get('threadId'),
+                'in_reply_to': headers.get('in-reply-to', ''), 'references': headers.get('references', '')
+            })
         
         print(f"{TermColors.STATUS_INFO}Fetched {len(sent_emails_data)} sent emails from the last {days} days.{TermColors.RESET}")
     except HttpError as error:
@@ -193,44 +277,15 @@ def get_sent_emails(service, days=7): # Added service parameter
     return sent_emails_data
 
 def read_emails():
-    """Read emails from recent_emails.txt and return as a list of dictionaries"""
-    recent_emails_file_path = os.path.join(SCRIPT_DIR, RECENT_EMAILS_FILE)
-    try:
-        with open(recent_emails_file_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-    except FileNotFoundError:
-        print(f"{TermColors.YELLOW}No {recent_emails_file_path} file found. Creating empty file.{TermColors.RESET}")
-        with open(recent_emails_file_path, "w", encoding="utf-8") as f:
-            f.write("")
+    """Streams the EmailRecords of the last fetch back from RECENT_EMAILS_SPOOL (e.g. to re-run analysis offline)."""
+    if not RECENT_EMAILS_SPOOL or not os.path.exists(RECENT_EMAILS_SPOOL):
+        print(f"{TermColors.YELLOW}No spooled emails found.{TermColors.RESET}")
         return []
-    
-    emails = []
-    current_email = {}
-    current_body_lines = []
-    
-    for line in lines:
-        line = line.rstrip()
-        if line.startswith("Subject: "):
-            if current_email:
-                current_email["body"] = "\n".join(l for l in current_body_lines if l.strip())
-                emails.append(current_email)
-                current_body_lines = []
-            current_email = {"subject": line[9:], "from": "unknown"}
-        elif line.startswith("From: "): current_email["from"] = line[6:]
-        elif line.startswith("Received: "): current_email["received"] = line[10:]
-        elif line.startswith("Body: "): current_body_lines = [line[6:]]
-        elif line.startswith("-" * 50): continue
-        else:
-            if current_body_lines is not None: current_body_lines.append(line)
-            
-    if current_email:
-        current_email["body"] = "\n".join(l for l in current_body_lines if l.strip())
-        emails.append(current_email)
-    return emails
+    return list(iter_spool(RECENT_EMAILS_SPOOL))
 
-def analyze_email_importance(client, email):
-    """Analyze a single email's importance using OpenAI API"""
-    body = email['body'].strip()
+def importance_messages(email):
+    """Builds the chat messages for the importance analysis of one email."""
+    body = get_body_preparer().prepare(email.body, IMPORTANCE_BODY_TOKENS, IMPORTANCE_MODEL)
     prompt = f"""
     You are an email importance analyzer for a busy professional.
     Your task is to determine which emails CRITICALLY NEED a response and which can be ignored.
@@ -241,11 +296,11 @@ def analyze_email_importance(client, email):
     4. Have clear business value, substantial opportunity, or time-sensitive importance
     Automated notifications, newsletters, marketing emails should ALWAYS be marked as not needing response.
     Email to analyze:
-    Subject: {email['subject']}
-    From: {email['from']}
-    Received: {email.get('received', 'unknown')}
+    Subject: {email.subject}
+    From: {email.sender}
+    Received: {email.received or 'unknown'}
     Body:
-    {body[:4000]}
+    {body}
     Classify importance:
     - "high" importance: Personalized communications with clear value, time-sensitive matters that MUST be addressed
     - "medium" importance: Potentially useful but less critical communications
@@ -259,32 +314,56 @@ def analyze_email_importance(client, email):
         "time_sensitive": <boolean - true if matter is time-sensitive>,
         "topics": [<list of 1-3 key topics in the email>]
     }}"""
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[
-                {"role": "system", "content": "You are an executive assistant who helps busy professionals prioritize their emails. You are EXTREMELY selective about what emails truly need a response. Your goal is to minimize noise and only surface emails that absolutely must be dealt with."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
-        content = response.choices[0].message.content
-        if content:
-            analysis = json.loads(content)
-            print(f"\n{TermColors.STATUS_INFO}Analyzing: {email['subject']}{TermColors.RESET}")
-            print(f"Analysis result: {json.dumps(analysis, indent=2)}")
-            return EmailImportance(**analysis)
-        else:
-            print(f"{TermColors.YELLOW}Empty response for email: {email['subject']}{TermColors.RESET}")
-            return None
-    except Exception as e:
-        print(f"{TermColors.STATUS_ERROR}Error analyzing email: {e}{TermColors.RESET}")
-        print(f"Failed email subject: {email['subject']}")
+    return [
+        {"role": "system", "content": "You are an executive assistant who helps busy professionals prioritize their emails. You are EXTREMELY selective about what emails truly need a response. Your goal is to minimize noise and only surface emails that absolutely must be dealt with."},
+        {"role": "user", "content": prompt}
+    ]
+
+def parse_importance(email, content):
+    """Validates the model's JSON answer for one email. Returns None for an empty answer."""
+    if not content:
+        print(f"{TermColors.YELLOW}Empty response for email: {email.subject}{TermColors.RESET}")
         return None
+    analysis = json.loads(content)
+    print(f"\n{TermColors.STATUS_INFO}Analyzing: {email.subject}{TermColors.RESET}")
+    print(f"Analysis result: {json.dumps(analysis, indent=2)}")
+    return EmailImportance(**analysis)
+
+def rule_importance(email):
+    """Rates bulk mail recognised by the header rules as low importance without asking the AI."""
+    verdict = get_rule_engine().classify(email.sender, email.subject, email.label_ids, categories=RULE_LOW_IMPORTANCE_CATEGORIES)
+    if verdict is None:
+        return None
+    return EmailImportance(
+        importance="low", reason=f"Matched rule '{verdict.rule}' ({verdict.category}).",
+        needs_response=False, time_sensitive=False, topics=[verdict.category]
+    )
+
+def importance_error(email, error):
+    print(f"{TermColors.STATUS_ERROR}Error analyzing email: {error}{TermColors.RESET}")
+    print(f"Failed email subject: {email.subject}")
+    return None
+
+def analyze_emails_importance(client, emails, on_result=None, on_failure=None):
+    """
+    Analyzes the importance of many emails concurrently (see email_llm_pipeline.classify_all).
+    Returns a list of EmailImportance (or None where analysis failed), in the same order as emails.
+    on_result, if given, is called with (email, analysis) as soon as each analysis is known, and on_failure
+    with (email, error) for each email whose analysis failed.
+    """
+    return classify_all(
+        client, emails, importance_messages, parse_importance,
+        IMPORTANCE_MODEL, IMPORTANCE_PROMPT_VERSION, EmailImportance,
+        on_error=importance_error, pre_classify=rule_importance, on_result=on_result, on_failure=on_failure
+    )
 
-def run_triage(gmail_service, openai_client): # Renamed and added parameters
-    """Main function to identify important emails, callable from other scripts."""
-    scan_hours = 24 # Default
+def analyze_email_importance(client, email):
+    """Analyze a single email's importance using OpenAI API"""
+    return analyze_emails_importance(client, [email])[0]
+
+def prompt_scan_hours(default_hours=24):
+    """Asks how far back triage should look and returns the answer in hours."""
+    scan_hours = default_hours # Default
     unit_prompt_text = "Look back for new emails in (d)ays or (h)ours? [h, default 24h]: "
     while True:
         unit_choice = input(unit_prompt_text).lower().strip()
@@ -316,79 +395,51 @@ def run_triage(gmail_service, openai_client): # Renamed and added parameters
             except ValueError:
                 print("Invalid number. Please enter a whole number.")
     scan_hours = scan_value # Update scan_hours with the chosen value
+    return scan_hours
 
-    # Ask about including read emails
-    include_read = False
-    read_prompt = "Include read emails in the triage? (y/n) [n]: "
-    read_choice = input(read_prompt).lower().strip()
-    if read_choice == 'y':
-        include_read = True
-
-    # Construct the query based on user input
-    email_query_parts = ['in:INBOX', '-in:spam', '-in:trash'] # Changed to in:INBOX and added exclusions
-    if not include_read:
-        email_query_parts.append('is:unread') # Add is:unread only if needed
-    email_query = ' '.join(email_query_parts)
-
-    print(f"{TermColors.STATUS_INFO}Fetching emails from the last {scan_hours} hours with query '{email_query}'...{TermColors.RESET}")
-    # Use passed-in gmail_service and the constructed query
-    get_emails(service=gmail_service, query=email_query, hours=scan_hours)
-    
-    # client = OpenAI() # Use passed-in openai_client
-    # Adjust sent email lookback based on incoming scan hours
-    sent_email_lookback_days = max(1, scan_hours // 24) # Ensure at least 1 day
+def _triage_sort_key(email):
+    return (not email['analysis']['time_sensitive'], email["already_responded"],
+            0 if email['analysis']['importance'] == 'high' else 1 if email['analysis']['importance'] == 'medium' else 2)
+
+def _needs_new_response(email):
+    return email["analysis"]["needs_response"] and not email["already_responded"] # Only new emails needing response
+
+def render_triage_reports(journal: ResultJournal) -> dict:
+    """
+    Renders ALL_ANALYZED_JSON, NEEDS_RESPONSE_JSON, NEEDS_RESPONSE_REPORT and the terminal summary from the
+    triage journal. Entries are streamed from disk, so memory use does not grow with the number of emails.
+    Returns:
+        dict: Counts of analyzed emails, emails needing a new response, already responded and urgent emails.
+    """
+    # Group by status for the summaries
+    status_counts = {"🚨 URGENT": 0, "✅ ALREADY RESPONDED": 0, "🟠 Needs Response": 0, "⚪️ No Response Needed": 0}
+    analyzed_count = 0
+    needs_response_count = 0
+    for email in journal:
+        analyzed_count += 1
+        needs_response_count += _needs_new_response(email)
+        if email["already_responded"]: # Prioritize already responded
+            status_counts["✅ ALREADY RESPONDED"] += 1
+        elif email["analysis"]["time_sensitive"]:
+            status_counts["🚨 URGENT"] += 1
+        elif email["analysis"]["needs_response"]:
+            status_counts["🟠 Needs Response"] += 1
+        else:
+            status_counts["⚪️ No Response Needed"] += 1
+    already_responded_count = status_counts["✅ ALREADY RESPONDED"]
 
-    print(f"{TermColors.STATUS_INFO}Checking sent folder for previous responses (last {sent_email_lookback_days} days)...{TermColors.RESET}")
-    # Use passed-in gmail_service and the adjusted lookback days
-    sent_emails = get_sent_emails(service=gmail_service, days=sent_email_lookback_days)
-    
-    # client = OpenAI() # Use passed-in openai_client
-    emails = read_emails()
-    
-    # Collect ALL analyzed emails, not just those needing response
-    all_analyzed_emails = []
-    
-    for email in emails:
-        already_responded = is_previously_responded(email, sent_emails)
-        analysis = analyze_email_importance(openai_client, email) # Use passed-in openai_client
-        
-        if analysis: # Only include if AI analysis was successful
-             email_data = {
-                "subject": email["subject"], "from": email["from"],
-                "received": email.get("received", datetime.now().isoformat()),
-                "body": email["body"][:1000] + ("..." if len(email["body"]) > 1000 else ""),
-                "analysis": analysis.model_dump(),
-                "already_responded": already_responded
-            }
-             all_analyzed_emails.append(email_data)
-    
     # Save ALL analyzed emails to JSON (optional, but useful for debugging/future features)
-    output_data = {"last_updated": datetime.now().isoformat(), "analyzed_emails": all_analyzed_emails}
-    # We'll keep NEEDS_RESPONSE_JSON for compatibility with email_draft_reply.py for now,
-    # but it will only contain emails flagged as needing response.
-    # Let's create a new JSON for ALL analyzed emails.
-    ALL_ANALYZED_JSON = os.path.join(SCRIPT_DIR, "all_analyzed_emails.json")
-    with open(ALL_ANALYZED_JSON, "w", encoding="utf-8") as f: json.dump(output_data, f, indent=2)
+    write_json_report(ALL_ANALYZED_JSON, {"last_updated": datetime.now().isoformat()}, {"analyzed_emails": iter(journal)})
     print(f"\n{TermColors.STATUS_INFO}All analyzed emails saved to: {os.path.basename(ALL_ANALYZED_JSON)} (in the project directory){TermColors.RESET}")
 
-
-    # Filter for emails needing response for the original JSON and report summary
-    needs_response_emails = [
-        email for email in all_analyzed_emails 
-        if email["analysis"]["needs_response"] and not email["already_responded"] # Only new emails needing response
-    ]
-    
-    # Update NEEDS_RESPONSE_JSON for compatibility with email_draft_reply.py
-    needs_response_output_data = {"last_updated": datetime.now().isoformat(), "needs_response_emails": needs_response_emails}
-    with open(NEEDS_RESPONSE_JSON, "w", encoding="utf-8") as f: json.dump(needs_response_output_data, f, indent=2)
+    # NEEDS_RESPONSE_JSON keeps only the emails flagged as needing a new response (read by email_draft_reply.py)
+    write_json_report(NEEDS_RESPONSE_JSON, {"last_updated": datetime.now().isoformat()},
+                      {"needs_response_emails": (email for email in journal if _needs_new_response(email))})
     print(f"{TermColors.STATUS_INFO}Emails requiring response (for drafting) saved to: {os.path.basename(NEEDS_RESPONSE_JSON)} (in the project directory){TermColors.RESET}")
 
-
-    print(f"\n{TermColors.SUMMARY_KEY}Processed {len(emails)} emails from the last {scan_hours} hours.{TermColors.RESET}") # Use scan_hours
-    print(f"{TermColors.SUMMARY_KEY}Emails requiring response (new):{TermColors.RESET} {TermColors.SUMMARY_VALUE}{len(needs_response_emails)}{TermColors.RESET}")
-    already_responded_count = sum(1 for email in all_analyzed_emails if email["already_responded"]) # Count from all analyzed
+    print(f"{TermColors.SUMMARY_KEY}Emails requiring response (new):{TermColors.RESET} {TermColors.SUMMARY_VALUE}{needs_response_count}{TermColors.RESET}")
     print(f"{TermColors.SUMMARY_KEY}Previously responded to:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{already_responded_count}{TermColors.RESET}")
-    print(f"{TermColors.SUMMARY_KEY}Total emails analyzed:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{len(all_analyzed_emails)}{TermColors.RESET}") # Report total analyzed
+    print(f"{TermColors.SUMMARY_KEY}Total emails analyzed:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{analyzed_count}{TermColors.RESET}") # Report total analyzed
     
     print(f"\n{TermColors.STATUS_INFO}Detailed results saved to: {os.path.basename(NEEDS_RESPONSE_JSON)} and {os.path.basename(ALL_ANALYZED_JSON)} (in the project directory){TermColors.RESET}")
     
@@ -396,22 +447,15 @@ def run_triage(gmail_service, openai_client): # Renamed and added parameters
     with open(NEEDS_RESPONSE_REPORT, "w", encoding="utf-8") as f:
         f.write("# Email Triage Report\n\n") # More general title
         f.write(f"Generated on: {datetime.now().isoformat()}\n\n")
-        f.write(f"**Total Emails Analyzed:** {len(all_analyzed_emails)}\n\n")
-        f.write(f"**Emails Requiring New Response:** {len(needs_response_emails)}\n\n")
+        f.write(f"**Total Emails Analyzed:** {analyzed_count}\n\n")
+        f.write(f"**Emails Requiring New Response:** {needs_response_count}\n\n")
         f.write(f"**Previously Responded To:** {already_responded_count}\n\n")
         f.write("---\n\n")
         
-        if all_analyzed_emails:
-            # Sort all analyzed emails for the report
-            sorted_emails = sorted(
-                all_analyzed_emails, 
-                key=lambda x: (not x['analysis']['time_sensitive'], x["already_responded"], 
-                               0 if x['analysis']['importance'] == 'high' else 1 if x['analysis']['importance'] == 'medium' else 2)
-            )
-            
+        if analyzed_count:
             f.write("## Analyzed Emails\n\n")
 
-            for email in sorted_emails:
+            for email in journal.iter_sorted(_triage_sort_key):
                 f.write(f"### {email['subject']}\n\n")
                 f.write(f"**From:** {email['from']}\n\n")
                 f.write(f"**Received:** {email['received']}\n\n")
@@ -438,22 +482,9 @@ def run_triage(gmail_service, openai_client): # Renamed and added parameters
             f.write("No emails were analyzed.\n\n")
     
     # Terminal output remains the same for immediate feedback
-    if all_analyzed_emails: # Print summary to terminal from all analyzed
+    if analyzed_count: # Print summary to terminal from all analyzed
         print(f"\n{TermColors.SUMMARY_HEADER}ANALYZED EMAILS SUMMARY:{TermColors.RESET}\n" + "="*50)
-        
-        # Group by status for terminal summary
-        status_counts = {"🚨 URGENT": 0, "✅ ALREADY RESPONDED": 0, "🟠 Needs Response": 0, "⚪️ No Response Needed": 0}
-        for email in all_analyzed_emails:
-             if email["already_responded"]: # Prioritize already responded
-                 status_counts["✅ ALREADY RESPONDED"] += 1
-             elif email["analysis"]["time_sensitive"]:
-                 status_counts["🚨 URGENT"] += 1
-             elif email["analysis"]["needs_response"]:
-                 status_counts["🟠 Needs Response"] += 1
-             else:
-                 status_counts["⚪️ No Response Needed"] += 1
-
-        print(f"{TermColors.SUMMARY_KEY}Total Emails Analyzed:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{len(all_analyzed_emails)}{TermColors.RESET}")
+        print(f"{TermColors.SUMMARY_KEY}Total Emails Analyzed:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{analyzed_count}{TermColors.RESET}")
         print(f"{TermColors.RED}🚨 URGENT:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{status_counts['🚨 URGENT']}{TermColors.RESET}")
         print(f"{TermColors.GREEN}✅ ALREADY RESPONDED:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{status_counts['✅ ALREADY RESPONDED']}{TermColors.RESET}")
         print(f"{TermColors.YELLOW}🟠 Needs Response:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{status_counts['🟠 Needs Response']}{TermColors.RESET}")
@@ -461,13 +492,7 @@ def run_triage(gmail_service, openai_client): # Renamed and added parameters
         
         print("\n" + "="*50) # Separator for terminal detail list
 
-        # Print terminal detail list (similar to before, but from all_analyzed_emails)
-        sorted_emails_terminal = sorted(
-            all_analyzed_emails, 
-            key=lambda x: (not x['analysis']['time_sensitive'], x["already_responded"], 
-                           0 if x['analysis']['importance'] == 'high' else 1 if x['analysis']['importance'] == 'medium' else 2)
-        )
-        for email in sorted_emails_terminal:
+        for email in journal.iter_sorted(_triage_sort_key):
             print(f"\n{TermColors.CANDIDATE_INFO}Subject: {email['subject']}{TermColors.RESET}")
             print(f"{TermColors.CANDIDATE_INFO}From: {email['from']}{TermColors.RESET}")
             
@@ -489,9 +514,149 @@ def run_triage(gmail_service, openai_client): # Renamed and added parameters
     else: print(f"\n{TermColors.YELLOW}No emails were analyzed.{TermColors.RESET}")
     
     print(f"\n{TermColors.STATUS_INFO}Full report available in {os.path.basename(NEEDS_RESPONSE_REPORT)} (in the project directory){TermColors.RESET}")
+    return {
+        "analyzed": analyzed_count, "needs_response": needs_response_count,
+        "already_responded": already_responded_count, "urgent": status_counts["🚨 URGENT"]
+    }
+
+def run_triage(gmail_service, openai_client, resume=None, hours=None, include_read=None, incremental=None, estimate=False,
+               max_emails=MAX_EMAILS_TO_PROCESS): # Renamed and added parameters
+    """
+    Main function to identify important emails, callable from other scripts.
+    Args:
+        resume: True continues the interrupted run recorded in the checkpoint database: emails it already
+            analyzed are not analyzed again, and only failed and not-yet-analyzed ones are sent to the model.
+        hours: How far back to look for emails.
+        include_read: Whether read emails are triaged too.
+        max_emails: At most this many emails of the window (or, in incremental runs, of the new emails) are
+            triaged (None = no limit).
+        incremental: Only triage emails that arrived since the last incremental run (Gmail history sync).
+        estimate: Only project the run's cost and duration from a sample (email_estimate), without analyzing
+            anything; no OpenAI client is needed. Incremental runs are estimated over the time since the last run.
+        Parameters left as None are asked for interactively.
+    Returns:
+        dict: Run summary ('status' is 'ok', 'incomplete' when some emails failed, or 'error').
+    """
+    store = get_checkpoint_store()
+    if estimate:
+        resume = False
+    if resume is None:
+        resume = confirm_resume(TRIAGE_CHECKPOINT_JOB, "triage")
+    if resume:
+        checkpoint = store.unfinished_job(TRIAGE_CHECKPOINT_JOB)
+        if checkpoint is None:
+            print(f"{TermColors.YELLOW}No interrupted triage run to resume.{TermColors.RESET}")
+            return {"status": "error", "error": "no interrupted triage run to resume"}
+        scan_hours = checkpoint["params"]["scan_hours"]
+        sync_history_id = checkpoint["params"].get("sync_history_id")
+        message_ids = store.pending_ids(TRIAGE_CHECKPOINT_JOB)
+        print(f"{TermColors.STATUS_INFO}Resuming {store.describe(TRIAGE_CHECKPOINT_JOB)}. Fetching {len(message_ids)} emails...{TermColors.RESET}")
+        emails = get_emails_by_id(gmail_service, message_ids)
+        fetched_ids = {email.id for email in emails}
+        store.remove_messages(TRIAGE_CHECKPOINT_JOB, [message_id for message_id in message_ids if message_id not in fetched_ids]) # No longer in Gmail
+    else:
+        # Incremental mode only processes emails that arrived since the previous incremental run
+        if incremental is None:
+            incremental_choice = input("Only triage emails new since the last triage run (Gmail history sync)? (y/n) [n]: ").lower().strip()
+            incremental = incremental_choice == 'y'
+        if incremental:
+            last_run = last_run_time(TRIAGE_SYNC_CONSUMER)
+            # The sent-folder lookback still needs a window: cover the time since the last run
+            scan_hours = max(1, int((datetime.now() - last_run).total_seconds() // 3600) + 1) if last_run else 24
+        else:
+            scan_hours = hours if hours is not None else prompt_scan_hours()
+
+        # Ask about including read emails
+        if include_read is None:
+            include_read = False
+            read_prompt = "Include read emails in the triage? (y/n) [n]: "
+            read_choice = input(read_prompt).lower().strip()
+            if read_choice == 'y':
+                include_read = True
+
+        # Construct the query based on user input
+        email_query_parts = ['in:INBOX', '-in:spam', '-in:trash'] # Changed to in:INBOX and added exclusions
+        if not include_read:
+            email_query_parts.append('is:unread') # Add is:unread only if needed
+        email_query = ' '.join(email_query_parts)
+
+        if estimate:
+            return estimate_run(
+                "triage", gmail_service, time_window_query(email_query, scan_hours), TRIAGE_FETCH_PROFILE,
+                email_record_from_message, importance_messages, IMPORTANCE_MODEL, (IMPORTANCE_PROMPT_VERSION,), EmailImportance,
+                max_emails=max_emails, pre_classify=rule_importance,
+                gmail_units_per_email=GMAIL_QUOTA_UNITS["threads.get"] if RESPONDED_DETECTION == "threads" else 0
+            )
+
+        # Fetchers hand EmailRecords straight to analysis
+        sync_history_id = None
+        if incremental:
+            print(f"{TermColors.STATUS_INFO}Syncing emails that arrived since the last triage run...{TermColors.RESET}")
+            emails, sync_history_id = get_new_emails(service=gmail_service, include_read=include_read, max_emails=max_emails)
+        else:
+            print(f"{TermColors.STATUS_INFO}Fetching emails from the last {scan_hours} hours with query '{email_query}'...{TermColors.RESET}")
+            # Use passed-in gmail_service and the constructed query
+            emails = get_emails(service=gmail_service, query=email_query, hours=scan_hours, max_emails=max_emails)
+        store.start_job(TRIAGE_CHECKPOINT_JOB, {"scan_hours": scan_hours, "sync_history_id": sync_history_id},
+                        [email.id for email in emails])
+
+    if RESPONDED_DETECTION == "threads":
+        # Only the threads of the emails being triaged are fetched; no sent-folder scan
+        print(f"{TermColors.STATUS_INFO}Checking {len(emails)} email threads for previous responses...{TermColors.RESET}")
+        responded_thread_ids = get_responded_thread_ids(gmail_service, [email.thread_id for email in emails])
+        is_responded = lambda email: email.thread_id in responded_thread_ids
+    else:
+        # Adjust sent email lookback based on incoming scan hours
+        sent_email_lookback_days = max(1, scan_hours // 24) # Ensure at least 1 day
+        print(f"{TermColors.STATUS_INFO}Checking sent folder for previous responses (last {sent_email_lookback_days} days)...{TermColors.RESET}")
+        # Use passed-in gmail_service and the adjusted lookback days
+        sent_emails = SentMailIndex(get_sent_emails(service=gmail_service, days=sent_email_lookback_days)) # Built once, O(1) lookups per email
+        is_responded = lambda email: is_previously_responded(email, sent_emails)
+
+    # Each analyzed email is journaled and checkpointed the moment its analysis completes, so an interrupted run keeps its progress
+    journal = ResultJournal(TRIAGE_JOURNAL_FILE)
+    journal.reset()
+    if resume:
+        journal.extend(store.iter_results(TRIAGE_CHECKPOINT_JOB))
+
+    def record_analysis(email, analysis):
+        email_data = {
+            "id": email.id, "thread_id": email.thread_id,
+            "subject": email.subject, "from": email.sender,
+            "received": email.received or datetime.now().isoformat(),
+            "body": email.body[:1000] + ("..." if len(email.body) > 1000 else ""),
+            "analysis": analysis.model_dump(),
+            "already_responded": is_responded(email)
+        }
+        journal.append(email_data)
+        store.mark_done(TRIAGE_CHECKPOINT_JOB, email.id, email_data)
+
+    def record_failure(email, error):
+        store.mark_failed(TRIAGE_CHECKPOINT_JOB, email.id, error) # Retried by --resume
+
+    # Emails are analyzed concurrently; failed analyses are left out of the journal
+    analyze_emails_importance(openai_client, emails, on_result=record_analysis, on_failure=record_failure)
+
+    print(f"\n{TermColors.SUMMARY_KEY}Processed {len(emails)} emails from the last {scan_hours} hours.{TermColors.RESET}") # Use scan_hours
+    get_llm_cache().report()
+    get_rule_engine().report()
+    get_body_preparer().report()
+    store.report(TRIAGE_CHECKPOINT_JOB)
+    summary = {"status": "ok", "emails_fetched": len(emails), "scan_hours": scan_hours, **render_triage_reports(journal)}
+
+    failed_count = len(store.pending_ids(TRIAGE_CHECKPOINT_JOB))
+    summary["failed"] = failed_count
+    if failed_count:
+        print(f"{TermColors.YELLOW}Some emails could not be analyzed. Run triage with --resume to retry them.{TermColors.RESET}")
+        return {**summary, "status": "incomplete"}
+    store.finish_job(TRIAGE_CHECKPOINT_JOB)
+    if sync_history_id is not None:
+        commit_cursor(TRIAGE_SYNC_CONSUMER, sync_history_id) # Next incremental run starts after these emails
+    return summary
 
 if __name__ == "__main__":
     print(f"{TermColors.BOLD}Running Email Triage Standalone...{TermColors.RESET}")
+    load_dotenv(override=True) # Load environment variables (cli.py loads them once for every tool)
     # Initialize services for standalone run
     standalone_gmail_service = get_gmail_service(TOKEN_FILE, CREDENTIALS_FILE, SCOPES)
     if not standalone_gmail_service:
@@ -506,4 +671,5 @@ if __name__ == "__main__":
         print(f"{TermColors.STATUS_ERROR}Failed to initialize OpenAI client for standalone run: {e}{TermColors.RESET}")
         sys.exit(1)
 
-    run_triage(standalone_gmail_service, standalone_openai_client)
+    run_triage(standalone_gmail_service, standalone_openai_client, resume="--resume" in sys.argv[1:] or None,
+               estimate="--estimate" in sys.argv[1:])
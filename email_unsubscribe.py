@@ -0,0 +1,450 @@
+import os
+import time
+import base64
+import sqlite3
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.mime.text import MIMEText
+from email.utils import parseaddr
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from googleapiclient.errors import HttpError
+
+# Import utilities
+from email_utils import TermColors
+from email_fetch import is_retryable_error
+
+# Determine the absolute path to THIS script's directory
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+UNSUBSCRIBE_LEDGER_FILE = os.path.join(SCRIPT_DIR, "unsubscribe_ledger.sqlite3")
+
+# --- Configuration ---
+# Unsubscribe requests in flight at once, and at most this many to any one host
+HTTP_WORKERS = 8
+PER_HOST_CONCURRENCY = 2
+HTTP_TIMEOUT_SECONDS = 10
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+# Words on an unsubscribe page (first KB) that suggest a plain GET already unsubscribed
+SUCCESS_KEYWORDS = ["unsubscribed", "removed", "success", "no longer receive", "manage your preferences"]
+# Body of an RFC 8058 one-click unsubscribe POST
+ONE_CLICK_BODY = "List-Unsubscribe=One-Click"
+# Unsubscribe emails: messages.send costs 100 of the 250 quota units a user may spend per second, and
+# consumer Gmail accounts may send about 500 messages a day. Sends are throttled to MAILTO_SENDS_PER_SECOND
+# with bursts of MAILTO_BURST, and stop after MAILTO_DAILY_LIMIT in any 24 hours (the rest stay queued).
+MAILTO_SENDS_PER_SECOND = 1.0
+MAILTO_BURST = 5
+MAILTO_DAILY_LIMIT = 400
+# Unsubscribe emails rejected this many times (e.g. an invalid address) are no longer retried
+MAILTO_MAX_ATTEMPTS = 3
+MAILTO_DEFAULT_SUBJECT = "Automated Unsubscribe Request"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS unsubscribed_lists (
+    list_key TEXT PRIMARY KEY,
+    method TEXT NOT NULL,
+    target TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    detail TEXT,
+    attempts INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mailto_queue (
+    address TEXT PRIMARY KEY,
+    list_key TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    queued_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_mailto_queue_sent_at ON mailto_queue(sent_at);
+"""
+
+# Outcomes: one-click POST accepted; page visited and it reads like a confirmation; page visited but it
+# may need a click by hand; request failed (retried on the next run). Lists with any outcome but
+# FAILED are never processed again.
+UNSUBSCRIBED, VISITED, NEEDS_MANUAL, FAILED = "unsubscribed", "visited", "needs_manual", "failed"
+
+
+# --- List Identity ---
+def sender_domain(sender):
+    """Domain of the address in a From header ('Unknown Sender' and the like give the header itself)."""
+    address = parseaddr(sender or '')[1]
+    return address.rsplit('@', 1)[1].lower() if '@' in address else (sender or 'unknown').strip().lower()
+
+
+def unsubscribe_target(candidate):
+    """
+    Identifies the mailing list a candidate's List-Unsubscribe header points to: the mailto address, or
+    the host of the HTTP link (the rest of the link usually carries a per-message token). None if neither.
+    """
+    if candidate.get("list_unsubscribe_http"):
+        return urlsplit(candidate["list_unsubscribe_http"]).netloc.lower() or None
+    if candidate.get("list_unsubscribe_mailto"):
+        return candidate["list_unsubscribe_mailto"].split("?", 1)[0].strip().lower() or None
+    return None
+
+
+def list_identity(candidate):
+    """
+    Key under which a candidate's mailing list is unsubscribed once: its List-Id header when the plan has
+    one, else the sender domain plus the unsubscribe target (one mail provider's host serves many lists).
+    """
+    if candidate.get("list_id"):
+        return "list-id:" + candidate["list_id"].strip().strip("<>").lower()
+    return f"{sender_domain(candidate.get('sender'))}|{unsubscribe_target(candidate)}"
+
+
+# --- Ledger ---
+class UnsubscribeLedger:
+    """
+    SQLite record of every list an unsubscribe was attempted for, keyed by list_identity: the method used
+    (one_click, get or mailto), the URL or address, and the outcome. Lists already handled are skipped, so
+    the same newsletter is never unsubscribed twice, within a run or across runs.
+    """
+
+    def __init__(self, path: str = UNSUBSCRIBE_LEDGER_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+        self.counts = defaultdict(int) # Outcomes recorded since the last report
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, list_key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM unsubscribed_lists WHERE list_key = ?", (list_key,)).fetchone()
+        return dict(row) if row else None
+
+    def is_handled(self, list_key: str) -> bool:
+        """True if list_key was unsubscribed (or visited) before; failed attempts do not count."""
+        entry = self.get(list_key)
+        return entry is not None and entry["outcome"] != FAILED
+
+    def record(self, list_key: str, method: str, target: str, outcome: str, detail: str = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO unsubscribed_lists (list_key, method, target, outcome, detail, attempts, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 1, ?) ON CONFLICT(list_key) DO UPDATE SET method=excluded.method, "
+                "target=excluded.target, outcome=excluded.outcome, detail=excluded.detail, "
+                "attempts=unsubscribed_lists.attempts + 1, updated_at=excluded.updated_at",
+                (list_key, method, target, outcome, detail, time.time())
+            )
+            self._conn.commit()
+            self.counts[outcome] += 1
+
+    # --- Queue of unsubscribe emails (see MailtoUnsubscriber) ---
+    def claim_mailto(self, address: str, list_key: str, subject: str, body: str) -> bool:
+        """
+        Queues an unsubscribe email to address for list_key, unless address is queued (or sent) already.
+        Returns:
+            bool: True if this call queued it.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO mailto_queue (address, list_key, subject, body, status, queued_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (address, list_key, subject, body, time.time())
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def queued_mailtos(self, max_attempts: int) -> list:
+        """Unsent queued emails (address, list_key, subject, body) with fewer than max_attempts failed sends, in queue order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT address, list_key, subject, body FROM mailto_queue WHERE status != 'sent' AND attempts < ? ORDER BY queued_at, address",
+                (max_attempts,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_queued_mailtos(self, max_attempts: int) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM mailto_queue WHERE status != 'sent' AND attempts < ?", (max_attempts,)
+            ).fetchone()[0]
+
+    def count_mailtos_sent_since(self, since: float) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM mailto_queue WHERE sent_at > ?", (since,)).fetchone()[0]
+
+    def update_mailto(self, address: str, status: str = None, error: str = None, attempted: bool = True):
+        """
+        Records a send of the queued email to address: its new status ('sent' or 'failed'; None keeps it
+        queued), the error (None clears it) and, if attempted, one more attempt.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE mailto_queue SET status = COALESCE(?, status), error = ?, attempts = attempts + ?, "
+                "sent_at = CASE WHEN ? = 'sent' THEN ? ELSE sent_at END WHERE address = ?",
+                (status, error, 1 if attempted else 0, status, time.time(), address)
+            )
+            self._conn.commit()
+
+    def report(self):
+        """Prints the outcomes recorded since the last report, then resets the counts."""
+        if self.counts:
+            summary = ", ".join(f"{count} {outcome.replace('_', ' ')}" for outcome, count in sorted(self.counts.items()))
+            print(f"{TermColors.SUMMARY_KEY}Unsubscribe ledger:{TermColors.RESET} {TermColors.SUMMARY_VALUE}{summary}{TermColors.RESET}")
+        self.counts = defaultdict(int)
+
+
+_default_ledger = None
+
+
+def get_unsubscribe_ledger() -> UnsubscribeLedger:
+    """Returns the process-wide UnsubscribeLedger at UNSUBSCRIBE_LEDGER_FILE, opening it on first use."""
+    global _default_ledger
+    if _default_ledger is None:
+        _default_ledger = UnsubscribeLedger(UNSUBSCRIBE_LEDGER_FILE)
+    return _default_ledger
+
+
+# --- HTTP Unsubscribe Engine ---
+def make_unsubscribe_session(pool_size=HTTP_WORKERS):
+    """
+    A requests.Session whose connections are pooled and reused across unsubscribe requests. Cookies are
+    never stored or sent (RFC 8058 one-click requests must carry no context about the user).
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+def http_unsubscribe_jobs(candidates, ledger):
+    """
+    Collapses candidates to one job per mailing list with an HTTP unsubscribe link, dropping lists the
+    ledger already handled. A list is sent one-click if any of its emails advertised it.
+    Returns:
+        dict: {list_key: {'url', 'one_click'}} in first-seen order.
+    """
+    jobs = {}
+    for candidate in candidates:
+        url = candidate.get("list_unsubscribe_http")
+        if not url:
+            continue
+        list_key = list_identity(candidate)
+        if list_key not in jobs:
+            if ledger.is_handled(list_key):
+                continue
+            jobs[list_key] = {"url": url, "one_click": False}
+        if candidate.get("list_unsubscribe_one_click"):
+            jobs[list_key] = {"url": url, "one_click": True}
+    return jobs
+
+
+class HttpUnsubscriber:
+    """
+    Unsubscribes from mailing lists through their List-Unsubscribe HTTP links: once per list
+    (list_identity), skipping lists the ledger already handled, with up to `workers` requests in flight on
+    one pooled session and at most `per_host` at a time to any one host. Lists that advertise RFC 8058
+    (List-Unsubscribe-Post: List-Unsubscribe=One-Click) get the one-click POST; the others get a GET of
+    the unsubscribe page, as a browser visit would.
+    """
+
+    def __init__(self, ledger: UnsubscribeLedger = None, session: requests.Session = None, workers: int = HTTP_WORKERS,
+                 per_host: int = PER_HOST_CONCURRENCY, timeout: float = HTTP_TIMEOUT_SECONDS):
+        self.ledger = ledger or get_unsubscribe_ledger()
+        self.session = session or make_unsubscribe_session(workers)
+        self.workers = workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self._host_slots = {}
+        self._host_lock = threading.Lock()
+
+    def _slot(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._host_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _request(self, url, one_click):
+        """Sends one unsubscribe request. Returns (method, outcome, detail)."""
+        if one_click:
+            # RFC 8058: POST the fixed body to the URI; redirects are not followed
+            response = self.session.post(url, data=ONE_CLICK_BODY, timeout=self.timeout, allow_redirects=False,
+                                         headers={"Content-Type": "application/x-www-form-urlencoded"})
+            if 200 <= response.status_code < 300:
+                return "one_click", UNSUBSCRIBED, f"HTTP {response.status_code}"
+            # Some senders advertise one-click but only serve the page; fall back to visiting it
+        response = self.session.get(url, timeout=self.timeout, allow_redirects=True)
+        response.raise_for_status()
+        content_sample = response.text[:1024].lower()
+        if any(keyword in content_sample for keyword in SUCCESS_KEYWORDS):
+            return "get", VISITED, f"HTTP {response.status_code}, confirmation text found"
+        return "get", NEEDS_MANUAL, f"HTTP {response.status_code}, no confirmation text found"
+
+    def _unsubscribe_one(self, list_key, job):
+        with self._slot(job["url"]):
+            try:
+                method, outcome, detail = self._request(job["url"], job["one_click"])
+            except requests.exceptions.RequestException as e:
+                method, outcome, detail = "one_click" if job["one_click"] else "get", FAILED, str(e)
+        self.ledger.record(list_key, method, job["url"], outcome, detail)
+        return list_key, job["url"], outcome, detail
+
+    def unsubscribe(self, candidates, on_outcome=None):
+        """
+        Unsubscribes from the lists of candidates (deletion candidate dicts) that have an HTTP link.
+        on_outcome(list_key, url, outcome, detail) is called as each list completes.
+        Returns:
+            dict: {outcome: list count}, plus 'lists' (lists attempted) and 'skipped' (already in the ledger).
+        """
+        candidates = list(candidates)
+        jobs = http_unsubscribe_jobs(candidates, self.ledger)
+        listed = {list_identity(c) for c in candidates if c.get("list_unsubscribe_http")}
+        summary = {"lists": len(jobs), "skipped": len(listed) - len(jobs), UNSUBSCRIBED: 0, VISITED: 0, NEEDS_MANUAL: 0, FAILED: 0}
+        if not jobs:
+            return summary
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(jobs))) as pool:
+            futures = [pool.submit(self._unsubscribe_one, list_key, job) for list_key, job in jobs.items()]
+            for future in as_completed(futures):
+                list_key, url, outcome, detail = future.result()
+                summary[outcome] += 1
+                if on_outcome:
+                    on_outcome(list_key, url, outcome, detail)
+        return summary
+
+
+# --- Mailto Unsubscribe Queue ---
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+
+    def acquire(self):
+        """Takes one token, waiting until one is available."""
+        while True:
+            now = self._clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            self._sleep((1 - self.tokens) / self.rate)
+
+
+def parse_mailto(mailto):
+    """
+    Splits a List-Unsubscribe mailto target ('leave@example.com?subject=unsubscribe') into
+    (address, subject, body); subject and body are None when the target does not set them.
+    """
+    address, _, query = mailto.strip().partition("?")
+    params = parse_qs(query)
+    subject = params.get("subject", [None])[0]
+    body = params.get("body", [None])[0]
+    return unquote(address).strip().lower(), subject, body
+
+
+def unsubscribe_email_body(original_subject):
+    return (
+        f"This is an automated unsubscribe request regarding emails with subjects similar to: \"{original_subject}\".\n\n"
+        "Please remove this email address from your mailing list.\n\n"
+        "If this is an error, please ignore this message.\n"
+        "(This email was sent by an automated script based on user direction.)"
+    )
+
+
+class MailtoUnsubscriber:
+    """
+    Queue of unsubscribe emails, stored next to the ledger in SQLite. Candidates are collapsed to one
+    email per unsubscribe address (and lists the ledger already handled are dropped) when queued; sending
+    drains the queue through a TokenBucket sized to Gmail's send quota. A crash, Ctrl-C or quota error
+    leaves the unsent emails queued, and the next send() continues with them.
+    """
+
+    def __init__(self, service, ledger: UnsubscribeLedger = None, rate: float = MAILTO_SENDS_PER_SECOND,
+                 burst: int = MAILTO_BURST, daily_limit: int = MAILTO_DAILY_LIMIT, bucket: TokenBucket = None):
+        self.service = service
+        self.ledger = ledger or get_unsubscribe_ledger()
+        self.bucket = bucket or TokenBucket(rate, burst)
+        self.daily_limit = daily_limit
+
+    def enqueue(self, candidates) -> int:
+        """Queues one unsubscribe email per new mailto address among candidates. Returns how many were queued."""
+        queued = 0
+        for candidate in candidates:
+            if not candidate.get("list_unsubscribe_mailto"):
+                continue
+            list_key = list_identity(candidate)
+            if self.ledger.is_handled(list_key):
+                continue
+            address, subject, body = parse_mailto(candidate["list_unsubscribe_mailto"])
+            if not address:
+                continue
+            if self.ledger.claim_mailto(address, list_key, subject or MAILTO_DEFAULT_SUBJECT,
+                                        body or unsubscribe_email_body(candidate.get("subject", ""))):
+                queued += 1
+        return queued
+
+    def pending(self) -> int:
+        """Number of queued unsubscribe emails that will be sent (or retried) by the next send()."""
+        return self.ledger.count_queued_mailtos(MAILTO_MAX_ATTEMPTS)
+
+    def sent_last_day(self) -> int:
+        return self.ledger.count_mailtos_sent_since(time.time() - 24 * 3600)
+
+    def _send_one(self, address, subject, body):
+        message = MIMEText(body)
+        message['to'] = address
+        message['subject'] = subject
+        raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
+        return self.service.users().messages().send(userId="me", body={'raw': raw}).execute()
+
+    def send(self, on_outcome=None):
+        """
+        Sends the queued unsubscribe emails in queue order. Stops early (leaving the rest queued) on a
+        quota error or when MAILTO_DAILY_LIMIT emails were sent in the last 24 hours.
+        on_outcome(address, outcome, detail) is called after each email.
+        Returns:
+            dict: 'sent', 'failed' and 'remaining' counts, and 'stopped' (the reason sending stopped early, or None).
+        """
+        summary = {"sent": 0, "failed": 0, "remaining": 0, "stopped": None}
+        for row in self.ledger.queued_mailtos(MAILTO_MAX_ATTEMPTS):
+            if self.sent_last_day() >= self.daily_limit:
+                summary["stopped"] = f"daily limit of {self.daily_limit} unsubscribe emails reached"
+                break
+            self.bucket.acquire()
+            try:
+                sent = self._send_one(row["address"], row["subject"], row["body"])
+            except HttpError as error:
+                if is_retryable_error(error) or "limit exceeded" in str(error).lower():
+                    # Quota or rate limit: not the email's fault, so it stays queued without using up an attempt
+                    self.ledger.update_mailto(row["address"], error=str(error), attempted=False)
+                    summary["stopped"] = f"Gmail quota error: {error}"
+                    break
+                self.ledger.update_mailto(row["address"], status='failed', error=str(error))
+                summary["failed"] += 1
+                if on_outcome:
+                    on_outcome(row["address"], FAILED, str(error))
+                continue
+            self.ledger.update_mailto(row["address"], status='sent')
+            self.ledger.record(row["list_key"], "mailto", row["address"], UNSUBSCRIBED, f"Message ID {sent.get('id')}")
+            summary["sent"] += 1
+            if on_outcome:
+                on_outcome(row["address"], UNSUBSCRIBED, f"Message ID {sent.get('id')}")
+        summary["remaining"] = self.pending()
+        return summary
@@ -3,11 +3,9 @@ import json
 import base64
 from email.mime.text import MIMEText
 
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request as GoogleAuthRequest # Renamed to avoid conflict
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+# google-auth, httplib2 and the discovery module are imported inside the functions that use them, so
+# modules that only need TermColors (and `cli.py --help`) start without loading them
 
 # ANSI escape codes for colors
 class TermColors:
@@ -56,6 +54,8 @@ def get_gmail_service(token_file_path: str, credentials_file_path: str, scopes:
         credentials_file_path: Path to the credentials.json file.
         scopes: List of scopes to request.
     """
+    from google.auth.transport.requests import Request as GoogleAuthRequest # Renamed to avoid conflict
+    from google.oauth2.credentials import Credentials
     creds = None
     if os.path.exists(token_file_path):
         try:
@@ -119,12 +119,18 @@ def get_gmail_service(token_file_path: str, credentials_file_path: str, scopes:
             if not os.path.exists(credentials_file_path):
                 print(f"{TermColors.STATUS_ERROR}CRITICAL ERROR: {credentials_file_path} not found. Please download it from Google Cloud Console.{TermColors.RESET}")
                 return None
+            from google_auth_oauthlib.flow import InstalledAppFlow
             flow = InstalledAppFlow.from_client_secrets_file(credentials_file_path, scopes)
             creds = flow.run_local_server(port=0)
+        token_info = json.loads(creds.to_json())
+        if getattr(creds, 'granted_scopes', None): # The consent screen lets the user untick scopes; record what was granted
+            token_info['scopes'] = sorted(creds.granted_scopes)
         with open(token_file_path, 'w') as token:
-            token.write(creds.to_json())
+            json.dump(token_info, token)
     try:
-        service = build('gmail', 'v1', credentials=creds)
+        from googleapiclient.discovery import build
+        # The Gmail discovery document bundled with google-api-python-client is used instead of fetching it on every start
+        service = build('gmail', 'v1', credentials=creds, static_discovery=True, cache_discovery=False)
         return service
     except HttpError as error:
         print(f'{TermColors.STATUS_ERROR}An error occurred building the Gmail service: {error}{TermColors.RESET}')
@@ -134,6 +140,36 @@ def get_gmail_service(token_file_path: str, credentials_file_path: str, scopes:
         return None
 
 
+def clone_gmail_service(service):
+    """
+    Builds a new Gmail service object that shares the credentials of an existing one.
+    Service objects (and their httplib2 connections) are not thread-safe, so each worker thread needs its own.
+    Args:
+        service: Authorized Gmail API service instance to clone.
+    """
+    import httplib2
+    import google_auth_httplib2
+    from googleapiclient.discovery import build_from_document
+    if isinstance(service._http, google_auth_httplib2.AuthorizedHttp):
+        http = google_auth_httplib2.AuthorizedHttp(service._http.credentials, http=httplib2.Http())
+    else:
+        http = httplib2.Http()
+    return build_from_document(service._rootDesc, http=http)
+
+
+def granted_scopes(token_file_path: str):
+    """
+    Returns the set of OAuth scopes recorded as granted in token.json (as written by get_gmail_service),
+    or None if there is no readable token. Reads the file only, so it never triggers re-authentication.
+    """
+    try:
+        with open(token_file_path) as f:
+            scopes = json.load(f).get('scopes') or ()
+    except (OSError, ValueError):
+        return None
+    return set(scopes.split() if isinstance(scopes, str) else scopes)
+
+
 def send_email(service, subject: str, body: str, recipient_email: str) -> bool:
     """
     Sends an email using the provided Gmail service.